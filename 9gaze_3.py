@@ -21,20 +21,50 @@ from kivymd.icon_definitions import md_icons
 
 from kivy.uix.image import Image
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.stencilview import StencilView
 from kivy.clock import Clock
+from kivy.graphics import Color, Rectangle
 from kivy.graphics.texture import Texture
-from kivy.properties import StringProperty, NumericProperty, DictProperty, BooleanProperty
+from kivy.properties import StringProperty, NumericProperty, DictProperty, BooleanProperty, ObjectProperty
 from kivy.core.window import Window
 from kivy.metrics import dp
 from kivy.utils import get_color_from_hex
+from kivy.logger import Logger
 
 import cv2
 import numpy as np
 from datetime import datetime
+from collections import OrderedDict
 import os
 import json
+import secrets
+import threading
+import time
 import warnings
 
+from capture_store import CaptureStore
+from exam_file import write_exam, EXAM_EXTENSION
+from collage import COLLAGE_CELL, native_cell_size, overlay_cache, overlay_settings, render_cache
+from image_pyramid import ImagePyramid
+from clip_recorder import ClipRecorder
+from registration import Registrar
+from reflex_analysis import ReflexAnalyser
+from exam_trace import ExamTrace
+from post_queue import PostQueue
+from exam_report import ReportGenerator
+from rerender import CollageRerenderer, find_exams
+from storage_manager import StorageManager, UploadLedger
+from collage_server import CollageClient
+from preview_stream import PreviewStreamer
+from photometric import PhotometricNormalizer
+from exposure import ExposureController, SimulatedCamera, luminance_stats, software_brightness
+from diagnostics import LeakProfiler, format_report
+from preview_governor import IdleGovernor
+from video_import import VideoImporter
+from task_executor import TaskExecutor, CAPTURE, PREVIEW, ENCODE, HOUSEKEEPING
+from analysis_pool import AnalysisPool, available as analysis_pool_available
+from perceptual_hash import DuplicateIndex, HASH_BITS, hash_hex, perceptual_hash
+
 warnings.filterwarnings("ignore")
 
 # Set window size for desktop testing
@@ -43,30 +73,138 @@ Window.size = (1200, 800)
 # ---------------- CAMERA CONTROLLER ---------------- #
 
 class CameraController:
-    def __init__(self):
+    # Frames are read on a background thread and tagged with a sequence
+    # number and capture time, so the preview can tell when nothing new
+    # has arrived and skip the tick entirely. `source` may supply a
+    # VideoCapture stand-in (e.g. exposure.SimulatedCamera) for testing.
+    # With decode_stride > 1 only every n-th frame is decoded; the others
+    # are grabbed and dropped to keep the device queue fresh.
+    # Frames are withheld until auto-exposure has settled (mean level above
+    # `dark_level` and steady between frames), or `warmup_timeout` passed.
+    def __init__(self, source=None, brightness=50, open=True, dark_level=20, warmup_timeout=3.0):
+        self.source = source
+        self.brightness = brightness
+        self.dark_level = dark_level
+        self.warmup_timeout = warmup_timeout
+        self.exposure = None
         self.cap = None
-        self.open_camera()
+        self.lock = threading.Lock()
+        self.open_lock = threading.Lock()
+        self.frame = None
+        self.frame_seq = 0
+        self.frame_time = 0.0
+        self.decode_stride = 1
+        self.reader = None
+        self.running = False
+        self.timings = {}
+        if open:
+            self.open_camera()
         
     def open_camera(self):
-        try:
-            self.cap = cv2.VideoCapture(0)
-            if self.cap.isOpened():
-                self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        # Serialized, so a foreground open waits for a warm-up in progress
+        # instead of opening the device twice
+        with self.open_lock:
+            if self.cap and self.cap.isOpened() and self.running:
                 return True
-        except:
-            pass
+            started = time.monotonic()
+            try:
+                self.cap = self.source() if self.source else cv2.VideoCapture(0)
+                if self.cap.isOpened():
+                    self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+                    self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+                    # Let the sensor deliver the requested brightness when it can
+                    self.exposure = ExposureController(self.cap)
+                    self.exposure.set_brightness(self.brightness)
+                    self.timings = {'opened_at': started,
+                                    'open_ms': round((time.monotonic() - started) * 1000, 1),
+                                    'discarded': 0}
+                    self._warm_mean = None
+                    self.start_reader()
+                    return True
+            except:
+                pass
+            return False
+    
+    @property
+    def opening(self):
+        return self.open_lock.locked()
+    
+    @property
+    def usable(self):
+        return 'usable_ms' in self.timings
+    
+    def start_reader(self):
+        self.running = True
+        self.reader = threading.Thread(target=self.read_loop, daemon=True)
+        self.reader.start()
+    
+    def read_loop(self):
+        grabbed = 0
+        while self.running:
+            grabbed += 1
+            if self.decode_stride > 1 and grabbed % self.decode_stride:
+                if not self.cap.grab():
+                    time.sleep(0.01)
+                continue
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            if self.exposure:
+                self.exposure.observe(frame)
+            if not self.usable and not self.settled(frame):
+                continue
+            frame = cv2.flip(frame, 1)
+            with self.lock:
+                self.frame = frame
+                self.frame_seq += 1
+                self.frame_time = time.monotonic()
+    
+    def settled(self, frame):
+        # Warm-up check for one frame; dark or still-changing frames from
+        # the sensor's first exposure iterations are discarded
+        now = time.monotonic()
+        timings = self.timings
+        elapsed = now - timings['opened_at']
+        timings.setdefault('first_frame_ms', round(elapsed * 1000, 1))
+        mean, clipped = luminance_stats(frame)
+        previous, self._warm_mean = self._warm_mean, mean
+        if self.hardware_exposure:
+            # Our own exposure loop is driving the sensor: wait for it
+            steady = self.exposure.converged
+        else:
+            steady = previous is not None and abs(mean - previous) <= max(2.0, 0.03 * mean) and clipped < 0.2
+        if (mean >= self.dark_level and steady) or elapsed >= self.warmup_timeout:
+            timings['usable_ms'] = round(elapsed * 1000, 1)
+            return True
+        timings['discarded'] += 1
         return False
     
+    @property
+    def hardware_exposure(self):
+        # True when brightness is handled by the sensor, not per frame in software
+        return self.exposure is not None and self.exposure.hardware
+    
+    def set_brightness(self, brightness):
+        self.brightness = brightness
+        if self.exposure:
+            self.exposure.set_brightness(brightness)
+    
+    def read_tagged(self):
+        # (sequence number, capture time, frame) of the newest frame
+        with self.lock:
+            return self.frame_seq, self.frame_time, self.frame
+    
     def get_frame(self):
         if not self.cap or not self.cap.isOpened():
             return None
-        ret, frame = self.cap.read()
-        if not ret:
-            return None
-        return cv2.flip(frame, 1)
+        return self.read_tagged()[2]
     
     def release(self):
+        self.running = False
+        if self.reader and self.reader is not threading.current_thread():
+            self.reader.join(timeout=1)
+        self.reader = None
         if self.cap:
             self.cap.release()
 
@@ -171,10 +309,219 @@ class DirectionIcon(MDLabel):
         self.halign = "center"
         self.valign = "middle"
 
+class TileTextureCache:
+    # LRU cache of uploaded pyramid tiles, bounded by texture memory
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+    
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        return entry[0]
+    
+    def put(self, key, texture, nbytes):
+        self.entries[key] = (texture, nbytes)
+        self.nbytes += nbytes
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+    
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+class ZoomableImageView(StencilView):
+    # Pinch-zoom / pan viewer. A small base texture covers the whole image
+    # and only the pyramid tiles visible at the current zoom are uploaded on
+    # top of it, a few per frame, so interaction never waits on uploads.
+    max_zoom = NumericProperty(4)
+    uploads_per_frame = NumericProperty(4)
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.pyramid = None
+        self.base_texture = None
+        self.image_size = (1, 1)
+        self.zoom = 1
+        self.fit_zoom = 1
+        self.view_x = 0
+        self.view_y = 0
+        self.tile_cache = TileTextureCache()
+        self._touches = {}
+        self._redraw_trigger = Clock.create_trigger(self._redraw)
+        self.bind(pos=self._on_resize, size=self._on_resize)
+    
+    def set_image(self, image):
+        # Quick single texture shown until the pyramid is ready
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        self.base_texture = self._make_texture(rgb)
+        self.pyramid = None
+        self.tile_cache.clear()
+        self.image_size = (rgb.shape[1], rgb.shape[0])
+        self.reset_view()
+    
+    def set_texture(self, texture, size, pyramid=None):
+        # Show a texture (and pyramid) made earlier, without uploading again
+        self.base_texture = texture
+        self.pyramid = pyramid
+        self.tile_cache.clear()
+        self.image_size = size
+        self.reset_view()
+    
+    def set_pyramid(self, pyramid):
+        self.pyramid = pyramid
+        self.tile_cache.clear()
+        top = pyramid.level_count - 1
+        self.base_texture = self._make_texture(pyramid.levels[top])
+        if pyramid.size != self.image_size:
+            self.image_size = pyramid.size
+            self.reset_view()
+        else:
+            self._redraw_trigger()
+    
+    def reset_view(self):
+        w, h = self.image_size
+        self.fit_zoom = min(self.width / w, self.height / h) if self.width and self.height else 1
+        self.zoom = self.fit_zoom
+        self.view_x = w / 2
+        self.view_y = h / 2
+        self._redraw_trigger()
+    
+    def zoom_at(self, factor, anchor):
+        ax, ay = anchor
+        ix = self.view_x + (ax - self.center_x) / self.zoom
+        iy = self.view_y - (ay - self.center_y) / self.zoom
+        self.zoom = max(self.fit_zoom, min(self.max_zoom, self.zoom * factor))
+        self.view_x = ix - (ax - self.center_x) / self.zoom
+        self.view_y = iy + (ay - self.center_y) / self.zoom
+        self._clamp_view()
+    
+    def pan(self, dx, dy):
+        self.view_x -= dx / self.zoom
+        self.view_y += dy / self.zoom
+        self._clamp_view()
+    
+    def _clamp_view(self):
+        w, h = self.image_size
+        half_w = min(w / 2, self.width / (2 * self.zoom))
+        half_h = min(h / 2, self.height / (2 * self.zoom))
+        self.view_x = max(half_w, min(w - half_w, self.view_x))
+        self.view_y = max(half_h, min(h - half_h, self.view_y))
+        self._redraw_trigger()
+    
+    def _on_resize(self, *args):
+        if self.zoom <= self.fit_zoom:
+            self.reset_view()
+        else:
+            w, h = self.image_size
+            self.fit_zoom = min(self.width / w, self.height / h)
+            self._clamp_view()
+    
+    # Touch handling
+    
+    def on_touch_down(self, touch):
+        if not self.collide_point(*touch.pos):
+            return super().on_touch_down(touch)
+        if touch.is_mouse_scrolling:
+            if touch.button == 'scrolldown':
+                self.zoom_at(1.15, touch.pos)
+            elif touch.button == 'scrollup':
+                self.zoom_at(1 / 1.15, touch.pos)
+            return True
+        if touch.is_double_tap:
+            self.reset_view()
+            return True
+        touch.grab(self)
+        self._touches[touch.uid] = touch.pos
+        return True
+    
+    def on_touch_move(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_move(touch)
+        if len(self._touches) >= 2:
+            other = next(t for uid, t in self._touches.items() if uid != touch.uid)
+            old = self._touches[touch.uid]
+            old_dist = max(1, np.hypot(old[0] - other[0], old[1] - other[1]))
+            new_dist = np.hypot(touch.x - other[0], touch.y - other[1])
+            anchor = ((touch.x + other[0]) / 2, (touch.y + other[1]) / 2)
+            self.zoom_at(new_dist / old_dist, anchor)
+            self.pan((touch.x - old[0]) / 2, (touch.y - old[1]) / 2)
+        else:
+            self.pan(touch.dx, touch.dy)
+        self._touches[touch.uid] = touch.pos
+        return True
+    
+    def on_touch_up(self, touch):
+        if touch.grab_current is not self:
+            return super().on_touch_up(touch)
+        touch.ungrab(self)
+        self._touches.pop(touch.uid, None)
+        return True
+    
+    # Drawing
+    
+    def _make_texture(self, rgb):
+        texture = Texture.create(size=(rgb.shape[1], rgb.shape[0]), colorfmt='rgb')
+        texture.blit_buffer(np.ascontiguousarray(rgb).tobytes(), colorfmt='rgb', bufferfmt='ubyte')
+        texture.flip_vertical()
+        return texture
+    
+    def _screen_rect(self, x, y, w, h):
+        # Full-resolution image rectangle (y down) to widget coordinates (y up)
+        sx = self.center_x + (x - self.view_x) * self.zoom
+        sy = self.center_y - (y + h - self.view_y) * self.zoom
+        return (sx, sy), (w * self.zoom, h * self.zoom)
+    
+    def _redraw(self, *args):
+        self.canvas.clear()
+        if self.base_texture is None:
+            return
+        w, h = self.image_size
+        pending = False
+        with self.canvas:
+            Color(1, 1, 1, 1)
+            pos, size = self._screen_rect(0, 0, w, h)
+            Rectangle(texture=self.base_texture, pos=pos, size=size)
+            
+            pyramid = self.pyramid
+            if pyramid is None:
+                return
+            level = pyramid.level_for_zoom(self.zoom)
+            if level == pyramid.level_count - 1:
+                return
+            
+            half_w = self.width / (2 * self.zoom)
+            half_h = self.height / (2 * self.zoom)
+            tiles = pyramid.visible_tiles(level, self.view_x - half_w, self.view_y - half_h,
+                                          self.view_x + half_w, self.view_y + half_h)
+            scale = pyramid.level_scale(level)
+            uploads = 0
+            for tx, ty in tiles:
+                key = (level, tx, ty)
+                texture = self.tile_cache.get(key)
+                if texture is None:
+                    if uploads >= self.uploads_per_frame:
+                        pending = True
+                        continue
+                    tile = pyramid.tile(level, tx, ty)
+                    texture = self._make_texture(tile)
+                    self.tile_cache.put(key, texture, tile.nbytes)
+                    uploads += 1
+                x, y, tw, th = pyramid.tile_rect(level, tx, ty)
+                pos, size = self._screen_rect(x / scale, y / scale, tw / scale, th / scale)
+                Rectangle(texture=texture, pos=pos, size=size)
+        if pending:
+            self._redraw_trigger()
+
 # ---------------- WELCOME SCREEN ---------------- #
 
 class WelcomeScreen(MDScreen):
     def on_enter(self):
+        MDApp.get_running_app().warm_camera()
         self.clear_widgets()
         
         # Main layout with gradient background
@@ -277,7 +624,7 @@ class WelcomeScreen(MDScreen):
             spacing=dp(25),
             padding=[dp(100), 0, dp(100), 0],
             size_hint_y=None,
-            height=dp(200)
+            height=dp(280)
         )
         
         # Start Examination Button
@@ -301,8 +648,27 @@ class WelcomeScreen(MDScreen):
             on_release=self.open_settings
         )
         
+        # Import a recorded exam video
+        self.import_button = MDRaisedButton(
+            text="🎞 IMPORT EXAM VIDEO",
+            size_hint=(1, None),
+            height=dp(50),
+            font_size=dp(16),
+            md_bg_color=get_color_from_hex("#8E44AD"),  # Purple
+            on_release=self.choose_video
+        )
+        
+        self.import_progress = MDProgressBar(
+            value=0,
+            size_hint_y=None,
+            height=dp(4),
+            opacity=0
+        )
+        
         buttons_layout.add_widget(start_button)
         buttons_layout.add_widget(settings_button)
+        buttons_layout.add_widget(self.import_button)
+        buttons_layout.add_widget(self.import_progress)
         
         # Add all widgets
         content.add_widget(header)
@@ -317,7 +683,71 @@ class WelcomeScreen(MDScreen):
         self.manager.switch_to(self.manager.get_screen("gaze"))
     
     def open_settings(self, *args):
+        MDApp.get_running_app().release_warm_camera()
         self.manager.switch_to(self.manager.get_screen("settings"))
+    
+    def choose_video(self, *args):
+        from kivymd.uix.filemanager import MDFileManager
+        app = MDApp.get_running_app()
+        # The import needs neither the camera nor its CPU time
+        app.release_warm_camera()
+        self.file_manager = MDFileManager(
+            exit_manager=lambda *a: (self.file_manager.close(), app.warm_camera()),
+            select_path=self.import_video,
+            ext=['.mp4', '.avi', '.mov', '.mkv', '.m4v']
+        )
+        self.file_manager.show(os.path.expanduser('~'))
+    
+    def import_video(self, path):
+        self.file_manager.close()
+        app = MDApp.get_running_app()
+        self.import_button.disabled = True
+        self.import_progress.value = 0
+        self.import_progress.opacity = 1
+        store = CaptureStore(budget_bytes=app.settings.get('capture_memory_mb', 64) * 1024 * 1024)
+        
+        def on_progress(fraction):
+            Clock.schedule_once(lambda dt: setattr(self.import_progress, 'value', fraction * 100))
+        
+        # Decoding and eye tracking fan out to the importer's own threads
+        app.tasks.submit(VideoImporter().extract, path, on_progress, store, priority=ENCODE,
+                         on_done=lambda result: self.on_video_imported(store, result[1], None),
+                         on_error=lambda e: self.on_video_imported(store, None, str(e)))
+    
+    def on_video_imported(self, store, report, error):
+        app = MDApp.get_running_app()
+        self.import_button.disabled = False
+        self.import_progress.opacity = 0
+        if report:
+            Logger.info(f"VideoImporter: {report}")
+            app.trace.new_exam()
+            app.trace.emit('video_import', duration_ms=round(report['elapsed_s'] * 1000, 1),
+                           realtime_factor=report['realtime_factor'])
+        if error or report['missing']:
+            store.close()
+            app.warm_camera()
+            text = (f"Could not import the video: {error}" if error else
+                    f"No steady fixation found for gaze positions "
+                    f"{', '.join(map(str, report['missing']))}.")
+            dialog = MDDialog(
+                title="Import Error",
+                text=text,
+                buttons=[
+                    MDFlatButton(
+                        text="OK",
+                        on_release=lambda x: dialog.dismiss()
+                    )
+                ]
+            )
+            dialog.open()
+            return
+        
+        # Same path as a finished live examination
+        if isinstance(app.captured_images, CaptureStore):
+            app.captured_images.close()
+        app.captured_images = store
+        app.analyser.submit(store)
+        self.manager.switch_to(self.manager.get_screen("result"))
 
 # ---------------- GAZE SCREEN ---------------- #
 
@@ -326,10 +756,39 @@ class GazeScreen(MDScreen):
         self.clear_widgets()
         
         # Initialize variables
-        self.camera = CameraController()
+        app = MDApp.get_running_app()
+        # Keep housekeeping off the disk and CPU while capturing
+        app.storage.pause()
+        self.entered_at = time.monotonic()
+        self.first_preview_ms = None
+        self.camera_warm = app.camera is not None and (app.camera.running or app.camera.opening)
+        self.camera = app.take_camera()
         self.current_gaze = 1
-        self.captured_images = {}
+        self.captured_images = CaptureStore(
+            budget_bytes=app.settings.get('capture_memory_mb', 64) * 1024 * 1024
+        )
         self.camera_update_event = None
+        self.pending_captures = {}
+        self.capture_tasks = {}
+        self.capture_hashes = DuplicateIndex()
+        self.duplicate_dialog = None
+        self.last_frame_seq = 0
+        self.preview_ticks = {'rendered': 0, 'skipped': 0}
+        self.recorder = None
+        if app.settings.get('record_clips', False):
+            self.recorder = ClipRecorder(
+                seconds=app.settings.get('record_seconds', 3),
+                post_seconds=app.settings.get('record_post_seconds', 1),
+                max_bytes=app.settings.get('record_memory_mb', 96) * 1024 * 1024,
+                scale=app.settings.get('record_scale', 0.5),
+                pool=app.tasks.lane(ENCODE)
+            )
+        self.streamer = app.preview_streamer() if app.settings.get('stream_preview', False) else None
+        # Slows the preview down while nothing moves between patients
+        self.governor = None
+        if app.settings.get('idle_preview', True):
+            self.governor = IdleGovernor(idle_fps=app.settings.get('idle_preview_fps', 2),
+                                         idle_after=app.settings.get('idle_after_seconds', 20))
         
         # Main layout
         main_layout = MDBoxLayout(
@@ -586,14 +1045,44 @@ class GazeScreen(MDScreen):
         content_layout.add_widget(left_panel)
         content_layout.add_widget(right_panel)
         
+        # Background post-processing status (patient queue mode)
+        self.queue_strip = MDBoxLayout(
+            orientation="horizontal",
+            spacing=dp(10),
+            size_hint_y=None,
+            height=dp(30)
+        )
+        
+        self.queue_label = MDLabel(
+            text="",
+            theme_text_color="Secondary",
+            font_style="Caption",
+            size_hint_x=0.7
+        )
+        
+        self.queue_progress = MDProgressBar(
+            value=0,
+            max=100,
+            size_hint_x=0.3
+        )
+        
+        self.queue_strip.add_widget(self.queue_label)
+        self.queue_strip.add_widget(self.queue_progress)
+        
         # Assemble main layout
         main_layout.add_widget(top_bar)
+        main_layout.add_widget(self.queue_strip)
         main_layout.add_widget(content_layout)
         
         self.add_widget(main_layout)
+        self.update_queue_status()
         
         # Start camera updates
         self.start_camera()
+        
+        app.trace.new_exam()
+        app.trace.emit('exam_start')
+        app.trace.emit('position_entered', position=self.current_gaze)
     
     def get_instruction(self):
         instructions = {
@@ -613,8 +1102,13 @@ class GazeScreen(MDScreen):
         if self.camera_update_event:
             self.camera_update_event.cancel()
         
+        if self.camera.opening:
+            # The welcome-screen warm-up is still opening the device
+            self.camera_update_event = Clock.schedule_once(lambda dt: self.start_camera(), 0.1)
+            return
         if self.camera.open_camera():
-            self.camera_update_event = Clock.schedule_interval(self.update_camera, 1/30)
+            interval = self.governor.interval if self.governor else 1/30
+            self.camera_update_event = Clock.schedule_interval(self.update_camera, interval)
         else:
             from kivymd.uix.dialog import MDDialog
             dialog = MDDialog(
@@ -630,14 +1124,31 @@ class GazeScreen(MDScreen):
             dialog.open()
     
     def update_camera(self, dt):
-        frame = self.camera.get_frame()
-        if frame is None:
+        seq, frame_time, frame = self.camera.read_tagged()
+        if frame is None or seq == self.last_frame_seq:
+            # No new frame since the last tick, nothing to redo
+            self.preview_ticks['skipped'] += 1
             return
+        self.last_frame_seq = seq
+        self.preview_ticks['rendered'] += 1
+        if self.first_preview_ms is None:
+            self.on_first_preview()
         
-        # Apply brightness from settings
+        if self.governor and self.governor.observe(frame):
+            self.on_idle_change()
+        
+        # Apply brightness from settings, unless the sensor already did
         app = MDApp.get_running_app()
-        brightness = app.settings.get('brightness', 50)
-        frame = self.adjust_brightness(frame, brightness)
+        if not self.camera.hardware_exposure:
+            frame = self.adjust_brightness(frame, app.settings.get('brightness', 50))
+        
+        # Keep recent frames for motion clips
+        if self.recorder:
+            self.recorder.push(frame)
+        
+        # Remote viewers; encoding happens on the streamer's own thread
+        if self.streamer:
+            self.streamer.publish(frame)
         
         # Convert to RGB
         rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -650,29 +1161,71 @@ class GazeScreen(MDScreen):
         self.camera_preview.texture = texture
     
     def adjust_brightness(self, image, brightness):
-        brightness = (brightness - 50) * 2
-        if brightness != 0:
-            if brightness > 0:
-                shadow = brightness
-                highlight = 255
-            else:
-                shadow = 0
-                highlight = 255 + brightness
-            alpha_b = (highlight - shadow)/255
-            gamma_b = shadow
-            image = cv2.addWeighted(image, alpha_b, image, 0, gamma_b)
-        return image
+        return software_brightness(image, brightness)
+    
+    def on_first_preview(self):
+        # Time from entering the screen to the first settled live frame
+        self.first_preview_ms = round((time.monotonic() - self.entered_at) * 1000, 1)
+        timings = {k: v for k, v in self.camera.timings.items() if k != 'opened_at'}
+        MDApp.get_running_app().trace.emit('first_preview', duration_ms=self.first_preview_ms,
+                                           warm=self.camera_warm, **timings)
+        Logger.info(f"Camera: first usable preview after {self.first_preview_ms} ms "
+                    f"({'warmed' if self.camera_warm else 'cold'} start, {timings})")
+    
+    def on_idle_change(self):
+        # Reschedule the preview tick, and stop decoding frames that the
+        # slower preview would never show
+        idle = self.governor.idle
+        self.camera.decode_stride = max(1, round(self.governor.active_fps / self.governor.idle_fps)) if idle else 1
+        if self.camera_update_event:
+            self.camera_update_event.cancel()
+            self.camera_update_event = Clock.schedule_interval(self.update_camera, self.governor.interval)
+        Logger.info(f"IdleGovernor: preview {'idle' if idle else 'active'}")
+    
+    def on_touch_down(self, touch):
+        if getattr(self, 'governor', None) and self.governor.touch():
+            self.on_idle_change()
+        return super().on_touch_down(touch)
     
     def capture_photo(self, *args):
+        started = time.monotonic()
         frame = self.camera.get_frame()
         if frame is None:
             return
+        frame_time = self.camera.frame_time
         
         # Store image
         app = MDApp.get_running_app()
         brightness = app.settings.get('brightness', 50)
-        frame = self.adjust_brightness(frame, brightness)
-        self.captured_images[self.current_gaze] = frame
+        if not self.camera.hardware_exposure:
+            frame = self.adjust_brightness(frame, brightness)
+        
+        # Hashing and lossless encoding run on a capture-priority worker; a
+        # retake of this position supersedes them
+        position = self.current_gaze
+        store = self.captured_images
+        captured_at = datetime.now().isoformat(timespec='milliseconds')
+        
+        def store_capture():
+            phash = perceptual_hash(frame)
+            store.put(position, frame, captured_at=captured_at, brightness=brightness,
+                      phash=hash_hex(phash))
+            return phash
+        
+        self.pending_captures[position] = frame
+        self.capture_tasks[position] = app.tasks.submit(
+            store_capture, priority=CAPTURE, key=('capture', id(store), position),
+            on_done=lambda phash: self.on_capture_stored(store, position, frame, phash)
+        )
+        
+        app.trace.emit('capture', position=self.current_gaze,
+                       latency_ms=round((time.monotonic() - started) * 1000, 1),
+                       frame_age_ms=round((started - frame_time) * 1000, 1))
+        
+        # Save the motion around this capture
+        if self.recorder:
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            self.recorder.trigger(f"gaze_clip_{stamp}_pos{self.current_gaze}.mp4")
         
         # Update thumbnail
         self.thumbnails[self.current_gaze - 1].set_image(frame)
@@ -681,38 +1234,126 @@ class GazeScreen(MDScreen):
         self.capture_button.disabled = True
         self.retake_button.disabled = False
         self.next_button.disabled = False
+    
+    def warn_duplicate(self, position, duplicates):
+        # Raised while the patient is still in place, so a retake is cheap
+        other, distance = duplicates[0]
+        MDApp.get_running_app().trace.emit('duplicate', position=position, matches=other,
+                                           distance=distance)
+        Logger.warning(f"DuplicateIndex: position {position} matches position {other} "
+                       f"({distance} of {HASH_BITS} bits differ)")
+        
+        def retake(*args):
+            dialog.dismiss()
+            if self.current_gaze == position:
+                self.retake_photo()
+        
+        dialog = MDDialog(
+            title="Possible Duplicate",
+            text=f"This capture looks the same as position {other}. "
+                 "Check that the patient followed the target before moving on.",
+            buttons=[
+                MDFlatButton(
+                    text="KEEP",
+                    on_release=lambda x: dialog.dismiss()
+                ),
+                MDFlatButton(
+                    text="RETAKE",
+                    on_release=retake
+                )
+            ]
+        )
+        dialog.bind(on_dismiss=lambda *args: setattr(self, 'duplicate_dialog', None))
+        self.duplicate_dialog = dialog
+        dialog.open()
+    
+    def on_capture_stored(self, store, position, frame, phash):
+        if store is not self.captured_images:
+            return
+        if self.pending_captures.get(position) is frame:
+            del self.pending_captures[position]
+            self.capture_tasks.pop(position, None)
+        app = MDApp.get_running_app()
+        
+        duplicates = self.capture_hashes.add(position, phash)
+        if duplicates and app.settings.get('duplicate_check', True):
+            self.warn_duplicate(position, duplicates)
+        
+        # Measure pupil and reflex off the UI thread while the exam continues
+        app.analyser.submit(store, position)
         
         # Check if all images captured
-        if len(self.captured_images) == 9:
+        if len(store) == 9 and not self.pending_captures:
             self.finish_button.disabled = False
+            
+            # Start aligning to the primary gaze while the operator reviews
+            if app.settings.get('align_images', False):
+                app.registrar.submit(store)
+    
+    def settle_captures(self, positions, then):
+        # Cancels queued store writes; `then` runs on the UI thread once none
+        # of them is still writing, so a retake never races the capture it
+        # replaces and the UI thread never waits on a worker
+        running = []
+        for position in positions:
+            self.pending_captures.pop(position, None)
+            task = self.capture_tasks.pop(position, None)
+            if task:
+                task.cancel()
+                if not task.done():
+                    running.append(task)
+        if not running:
+            then()
+            return
+        remaining = [len(running)]
+        
+        def settled(dt):
+            remaining[0] -= 1
+            if not remaining[0]:
+                then()
+        for task in running:
+            task.add_done_callback(lambda task: Clock.schedule_once(settled))
     
     def retake_photo(self, *args):
-        if self.current_gaze in self.captured_images:
-            del self.captured_images[self.current_gaze]
+        position = self.current_gaze
+        store = self.captured_images
+        self.capture_hashes.discard(position)
+        MDApp.get_running_app().trace.emit('retake', position=position)
+        self.retake_button.disabled = True
+        self.next_button.disabled = True
+        self.settle_captures([position], lambda: self.clear_capture(store, position))
+    
+    def clear_capture(self, store, position):
+        if store is not self.captured_images:
+            return
+        if position in store:
+            del store[position]
         
         # Reset thumbnail
-        self.thumbnails[self.current_gaze - 1].set_image(None)
+        self.thumbnails[position - 1].set_image(None)
         
         # Update UI
         self.capture_button.disabled = False
-        self.retake_button.disabled = True
-        self.next_button.disabled = True
-        self.finish_button.disabled = len(self.captured_images) != 9
+        self.finish_button.disabled = len(store) != 9
         
         # Restart camera
         self.start_camera()
     
     def next_gaze(self, *args):
         if self.current_gaze < 9:
+            MDApp.get_running_app().trace.emit('next', position=self.current_gaze)
             self.current_gaze += 1
             self.update_gaze_display()
     
     def previous_gaze(self, *args):
         if self.current_gaze > 1:
+            MDApp.get_running_app().trace.emit('previous', position=self.current_gaze)
             self.current_gaze -= 1
             self.update_gaze_display()
     
     def update_gaze_display(self):
+        MDApp.get_running_app().trace.emit('position_entered', position=self.current_gaze)
+        
         # Update progress
         self.progress_bar.value = self.current_gaze * 11.11
         self.progress_label.text = f"Progress: {self.current_gaze}/9"
@@ -725,19 +1366,22 @@ class GazeScreen(MDScreen):
         self.instruction_label.text = self.get_instruction()
         
         # Update buttons
-        self.capture_button.disabled = self.current_gaze in self.captured_images
-        self.retake_button.disabled = self.current_gaze not in self.captured_images
-        self.next_button.disabled = self.current_gaze not in self.captured_images
+        captured = self.current_gaze in self.captured_images or self.current_gaze in self.pending_captures
+        self.capture_button.disabled = captured
+        self.retake_button.disabled = not captured
+        self.next_button.disabled = not captured
         self.prev_button.disabled = self.current_gaze == 1
         self.finish_button.disabled = len(self.captured_images) != 9
         
         # Show captured image or live camera
-        if self.current_gaze in self.captured_images:
+        if captured:
             # Stop camera and show captured image
             if self.camera_update_event:
                 self.camera_update_event.cancel()
             
-            frame = self.captured_images[self.current_gaze]
+            frame = self.pending_captures.get(self.current_gaze)
+            if frame is None:
+                frame = self.captured_images[self.current_gaze]
             rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
             texture = Texture.create(size=(rgb.shape[1], rgb.shape[0]), colorfmt='rgb')
             texture.blit_buffer(rgb.tobytes(), colorfmt='rgb', bufferfmt='ubyte')
@@ -749,9 +1393,53 @@ class GazeScreen(MDScreen):
     def finish_examination(self, *args):
         if len(self.captured_images) == 9:
             app = MDApp.get_running_app()
+            Logger.info(f"CaptureStore: {self.captured_images.report()}")
+            app.trace.emit('finish')
+            app.exams_finished += 1
+            
+            if app.settings.get('queue_mode', False):
+                # Collage and export happen in the background; the camera
+                # stays open and the next patient starts right away
+                app.post_queue.submit(self.captured_images, app.settings)
+                self.start_next_exam()
+                return
+            
             app.captured_images = self.captured_images
             self.manager.switch_to(self.manager.get_screen("result"))
     
+    def start_next_exam(self):
+        app = MDApp.get_running_app()
+        self.current_gaze = 1
+        self.captured_images = CaptureStore(
+            budget_bytes=app.settings.get('capture_memory_mb', 64) * 1024 * 1024
+        )
+        self.pending_captures = {}
+        self.capture_tasks = {}
+        self.capture_hashes.clear()
+        for thumb in self.thumbnails:
+            thumb.set_image(None)
+        
+        app.trace.new_exam()
+        app.trace.emit('exam_start')
+        self.update_gaze_display()
+    
+    def update_queue_status(self, *args):
+        app = MDApp.get_running_app()
+        pending = app.post_queue.pending()
+        jobs = app.post_queue.snapshot()
+        
+        self.queue_strip.opacity = 1 if (jobs or app.settings.get('queue_mode', False)) else 0
+        if not pending:
+            failed = [job for job in jobs if job['status'] == 'failed']
+            self.queue_label.text = (f"⚠ {failed[-1]['label']} failed: {failed[-1]['error']}" if failed
+                                     else "✔ All examinations processed")
+            self.queue_progress.value = 100 if jobs else 0
+            return
+        
+        current = pending[0]
+        self.queue_label.text = (f"⏳ {len(pending)} pending — {current.label}: {current.status}")
+        self.queue_progress.value = current.progress * 100
+    
     def go_home(self, *args):
         # Confirm dialog
         dialog = MDDialog(
@@ -772,15 +1460,27 @@ class GazeScreen(MDScreen):
     
     def confirm_go_home(self, dialog):
         dialog.dismiss()
+        MDApp.get_running_app().trace.emit('abandon', position=self.current_gaze)
         if self.camera_update_event:
             self.camera_update_event.cancel()
         self.camera.release()
+        self.settle_captures(list(self.capture_tasks), self.captured_images.close)
         self.manager.switch_to(self.manager.get_screen("welcome"))
     
     def on_leave(self):
         if self.camera_update_event:
             self.camera_update_event.cancel()
+        if self.camera.exposure:
+            Logger.info(f"Exposure: {self.camera.exposure.stats()}")
+        if self.governor:
+            Logger.info(f"IdleGovernor: {self.governor.stats()}")
         self.camera.release()
+        Logger.info(f"Preview: {self.preview_ticks['rendered']} ticks rendered, "
+                    f"{self.preview_ticks['skipped']} skipped without a new frame")
+        if self.recorder:
+            self.recorder.flush()
+            Logger.info(f"ClipRecorder: {self.recorder.stats()}")
+        MDApp.get_running_app().storage.resume()
 
 # ---------------- RESULT SCREEN ---------------- #
 
@@ -860,13 +1560,73 @@ class ResultScreen(MDScreen):
             theme_text_color="Primary"
         )
         
-        self.collage_image = Image(
-            size_hint=(1, 0.9),
-            allow_stretch=True
+        self.collage_view = ZoomableImageView(
+            size_hint=(1, 0.9)
         )
         
+        # Overlay toggles only recomposite the cached tiles
+        overlay_layout = MDBoxLayout(
+            orientation="horizontal",
+            spacing=dp(10),
+            size_hint_y=None,
+            height=dp(40)
+        )
+        
+        app = MDApp.get_running_app()
+        for key, label in (('show_positions', "Positions"), ('show_timestamp', "Time"),
+                           ('show_header', "Header"), ('show_grid', "Grid"),
+                           ('show_arrows', "Arrows")):
+            checkbox = MDCheckbox(
+                size_hint=(None, None),
+                size=(dp(40), dp(40)),
+                active=app.settings.get(key, False)
+            )
+            checkbox.bind(active=lambda instance, value, key=key: self.toggle_overlay(key, value))
+            overlay_layout.add_widget(checkbox)
+            overlay_layout.add_widget(MDLabel(
+                text=label,
+                theme_text_color="Secondary"
+            ))
+        
         collage_card.add_widget(collage_title)
-        collage_card.add_widget(self.collage_image)
+        collage_card.add_widget(self.collage_view)
+        collage_card.add_widget(overlay_layout)
+        
+        # Reflex measurements next to the collage
+        analysis_card = MDCard(
+            orientation="vertical",
+            padding=dp(20),
+            spacing=dp(10),
+            size_hint_x=0.35,
+            elevation=3,
+            radius=[dp(20),],
+            md_bg_color=get_color_from_hex("#FFFFFF")
+        )
+        
+        analysis_title = MDLabel(
+            text="Reflex Displacement (px)",
+            halign="center",
+            font_style="H6",
+            bold=True,
+            theme_text_color="Primary",
+            size_hint_y=None,
+            height=dp(40)
+        )
+        
+        self.analysis_table = MDGridLayout(
+            cols=3,
+            spacing=dp(4)
+        )
+        
+        analysis_card.add_widget(analysis_title)
+        analysis_card.add_widget(self.analysis_table)
+        
+        collage_row = MDBoxLayout(
+            orientation="horizontal",
+            spacing=dp(20)
+        )
+        collage_row.add_widget(collage_card)
+        collage_row.add_widget(analysis_card)
         
         # Action buttons title
         actions_title = MDLabel(
@@ -886,28 +1646,43 @@ class ResultScreen(MDScreen):
         
         save_button = MDRaisedButton(
             text="💾 SAVE COLLAGE",
-            size_hint=(0.33, 1),
+            size_hint=(0.25, 1),
             md_bg_color=get_color_from_hex("#3498DB"),
             on_release=self.save_collage
         )
         
         share_button = MDRaisedButton(
             text="📤 SHARE RESULTS",
-            size_hint=(0.33, 1),
+            size_hint=(0.25, 1),
             md_bg_color=get_color_from_hex("#9B59B6"),
             on_release=self.share_collage
         )
         
         drive_button = MDRaisedButton(
             text="☁️ UPLOAD TO DRIVE",
-            size_hint=(0.33, 1),
+            size_hint=(0.25, 1),
             md_bg_color=get_color_from_hex("#27AE60"),
             on_release=self.upload_to_drive
         )
         
+        self.report_button = MDRaisedButton(
+            text="📄 PDF REPORT",
+            size_hint=(0.25, 1),
+            md_bg_color=get_color_from_hex("#E67E22"),
+            on_release=self.create_report
+        )
+        
         buttons_layout.add_widget(save_button)
         buttons_layout.add_widget(share_button)
         buttons_layout.add_widget(drive_button)
+        buttons_layout.add_widget(self.report_button)
+        
+        self.report_progress = MDProgressBar(
+            value=0,
+            size_hint_y=None,
+            height=dp(4),
+            opacity=0
+        )
         
         # Bottom navigation
         bottom_layout = MDBoxLayout(
@@ -937,17 +1712,50 @@ class ResultScreen(MDScreen):
         # Add all widgets
         main_layout.add_widget(top_bar)
         main_layout.add_widget(success_card)
-        main_layout.add_widget(collage_card)
+        main_layout.add_widget(collage_row)
         main_layout.add_widget(actions_title)
         main_layout.add_widget(buttons_layout)
+        main_layout.add_widget(self.report_progress)
         main_layout.add_widget(bottom_layout)
         
         self.add_widget(main_layout)
         
         # Create and display collage
         self.create_collage()
+        self.show_analysis()
+    
+    def show_analysis(self, *args):
+        app = MDApp.get_running_app()
+        store = app.captured_images
+        results = app.analyser.results_for(store) if len(store) == 9 else None
+        
+        self.analysis_table.clear_widgets()
+        if results is None:
+            self.analysis_table.add_widget(MDLabel(text="Analysing…", theme_text_color="Secondary"))
+            if len(store) == 9:
+                app.analyser.submit(store, on_done=lambda: Clock.schedule_once(
+                    lambda dt: self.on_analysis_done(store)))
+            return
+        
+        for heading in ("Pos", "OD (dx, dy)", "OS (dx, dy)"):
+            self.analysis_table.add_widget(MDLabel(text=heading, bold=True, theme_text_color="Primary"))
+        for position in range(1, 10):
+            eyes = results[position]['eyes']
+            self.analysis_table.add_widget(MDLabel(text=str(position), theme_text_color="Secondary"))
+            for eye in ("OD", "OS"):
+                displacement = (eyes.get(eye) or {}).get('displacement')
+                text = f"{displacement[0]:+.0f}, {displacement[1]:+.0f}" if displacement else "—"
+                self.analysis_table.add_widget(MDLabel(text=text, theme_text_color="Secondary"))
+        
+        runtime = sum(r['runtime'] for r in results.values())
+        Logger.info(f"ReflexAnalyser: 9 frames analysed in {runtime * 1000:.0f} ms of worker time")
     
-    def create_collage(self):
+    def on_analysis_done(self, store):
+        app = MDApp.get_running_app()
+        if self.manager.current == self.name and app.captured_images is store:
+            self.show_analysis()
+    
+    def create_collage(self, offload=True):
         app = MDApp.get_running_app()
         images = app.captured_images
         
@@ -966,106 +1774,358 @@ class ResultScreen(MDScreen):
             dialog.open()
             return
         
-        try:
-            # Create 3x3 grid
-            collage = np.zeros((900, 1200, 3), dtype=np.uint8)
-            positions = {
-                1: (300, 0, 600, 300),   # Top middle
-                2: (600, 0, 900, 300),   # Top right
-                3: (600, 300, 900, 600), # Middle right
-                4: (600, 600, 900, 900), # Bottom right
-                5: (300, 600, 600, 900), # Bottom middle
-                6: (0, 600, 300, 900),   # Bottom left
-                7: (0, 300, 300, 600),   # Middle left
-                8: (0, 0, 300, 300),     # Top left
-                9: (300, 300, 600, 600)  # Center
-            }
-            
-            for gaze_pos, (x1, y1, x2, y2) in positions.items():
-                img = images[gaze_pos]
-                img = cv2.resize(img, (300, 300))
-                collage[y1:y2, x1:x2] = img
-            
-            # Add timestamp
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cv2.putText(collage, timestamp, (10, 890), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
-            
-            # Add position labels if enabled
-            app = MDApp.get_running_app()
-            if app.settings.get('show_positions', True):
-                labels = ["1", "2", "3", "4", "5", "6", "7", "8", "9"]
-                label_positions = [(450, 50), (750, 50), (750, 350), (750, 650),
-                                  (450, 650), (150, 650), (150, 350), (150, 50),
-                                  (450, 350)]
-                
-                for label, (x, y) in zip(labels, label_positions):
-                    cv2.putText(collage, label, (x, y), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 2, (0, 0, 255), 3)
-            
-            self.collage_result = collage
-            self.display_collage(collage)
-            
-        except Exception as e:
-            dialog = MDDialog(
-                title="Error",
-                text=f"Failed to create collage: {str(e)}",
-                buttons=[
-                    MDFlatButton(
-                        text="OK",
-                        on_release=lambda x: (dialog.dismiss(), 
-                                             self.manager.switch_to(self.manager.get_screen("gaze")))
-                    )
-                ]
-            )
-            dialog.open()
+        # A clinic workstation renders (and aligns) the collage when one is set up
+        client = app.collage_client()
+        if offload and client:
+            self.offload_collage(client, images)
+            return
+        self.collage_offloaded = False
+        self.collage_rendering = True
+        store = images
+        
+        # Use frames registered to the primary gaze once they are ready
+        align = app.settings.get('align_images', False)
+        if align and not app.registrar.is_current(store):
+            app.registrar.submit(store, on_done=lambda: Clock.schedule_once(
+                lambda dt: self.on_alignment_done(store)))
+            align = False
+        settings = dict(app.settings)
+        normalize = self.tile_normalizer()
+        previous = (getattr(self, 'collage_key', None), getattr(self, 'collage_timestamp', None))
+        started = time.monotonic()
+        
+        def render():
+            # Warping, hashing and rendering all stay off the UI thread
+            frames = (app.registrar.aligned_images(store) if align else None) or store
+            rendered = render_cache.tiles_rendered
+            key = render_cache.key(frames)
+            # Unchanged frames keep their timestamp, so the cached collage
+            # for them still matches
+            timestamp = previous[1] if key == previous[0] else datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            tiles = render_cache.tiles(frames, COLLAGE_CELL, normalize, key)
+            collage = render_cache.collage(frames, overlay_settings(settings, timestamp), COLLAGE_CELL,
+                                           normalize, key)
+            return frames, key, timestamp, tiles, collage, render_cache.tiles_rendered - rendered
+        
+        app.tasks.submit(render, priority=PREVIEW, key='collage',
+                         on_done=lambda result: self.on_collage_rendered(store, result, started),
+                         on_error=self.on_collage_failed)
     
-    def display_collage(self, collage):
-        rgb = cv2.cvtColor(collage, cv2.COLOR_BGR2RGB)
-        texture = Texture.create(size=(rgb.shape[1], rgb.shape[0]), colorfmt='rgb')
-        texture.blit_buffer(rgb.tobytes(), colorfmt='rgb', bufferfmt='ubyte')
-        self.collage_image.texture = texture
+    def on_collage_rendered(self, store, result, started):
+        app = MDApp.get_running_app()
+        self.collage_rendering = False
+        if self.manager.current != self.name or app.captured_images is not store:
+            return
+        self.collage_frames, self.collage_key, self.collage_timestamp, self.collage_tiles, collage, rendered = result
+        self.collage_result = collage
+        self.display_collage(collage)
+        app.trace.emit('collage', duration_ms=round((time.monotonic() - started) * 1000, 1),
+                       tiles=rendered)
+    
+    def on_collage_failed(self, e):
+        self.collage_rendering = False
+        dialog = MDDialog(
+            title="Error",
+            text=f"Failed to create collage: {str(e)}",
+            buttons=[
+                MDFlatButton(
+                    text="OK",
+                    on_release=lambda x: (dialog.dismiss(), 
+                                         self.manager.switch_to(self.manager.get_screen("gaze")))
+                )
+            ]
+        )
+        dialog.open()
+    
+    def offload_collage(self, client, store):
+        app = MDApp.get_running_app()
+        self.collage_offloaded = True
+        self.collage_rendering = False
+        self.collage_frames = store
+        self.collage_tiles = self.collage_key = None
+        self.collage_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        settings = dict(app.settings)
+        timestamp = self.collage_timestamp
+        started = time.monotonic()
+        
+        def render():
+            if not client.available():
+                raise OSError(f"{client.base_url} is not reachable")
+            return client.render(store, settings, timestamp)
+        
+        def on_error(e):
+            Logger.warning(f"CollageClient: {e}; rendering locally")
+            self.on_remote_collage(store, None, started)
+        
+        app.tasks.submit(render, priority=PREVIEW, key='collage',
+                         on_done=lambda collage: self.on_remote_collage(store, collage, started),
+                         on_error=on_error)
+    
+    def on_remote_collage(self, store, collage, started):
+        app = MDApp.get_running_app()
+        if self.manager.current != self.name or app.captured_images is not store:
+            return
+        if collage is None:
+            self.create_collage(offload=False)
+            return
+        self.collage_result = collage
+        self.display_collage(collage, full_resolution=False)
+        app.trace.emit('collage', duration_ms=round((time.monotonic() - started) * 1000, 1),
+                       remote=True)
+    
+    def on_alignment_done(self, images):
+        app = MDApp.get_running_app()
+        Logger.info(f"Registration: {app.registrar.report(images)}")
+        if self.manager.current == self.name and app.captured_images is images:
+            self.create_collage()
+    
+    def collage_layers(self):
+        app = MDApp.get_running_app()
+        return overlay_settings(app.settings, self.collage_timestamp)
+    
+    def tile_normalizer(self):
+        # In-place photometric pass for the render cache, or None when off
+        app = MDApp.get_running_app()
+        if not app.settings.get('normalize_tiles', False):
+            return None
+        store = app.captured_images
+        return lambda canvas, cell_size: app.normalizer.apply(canvas, store, cell_size)
+    
+    def toggle_overlay(self, key, value):
+        app = MDApp.get_running_app()
+        app.settings[key] = value
+        # A local render still running would be superseded by the composite
+        # below, so it is restarted with the new overlays instead
+        if getattr(self, 'collage_offloaded', False) or getattr(self, 'collage_rendering', False):
+            self.create_collage()
+            return
+        if getattr(self, 'collage_tiles', None) is None:
+            return
+        frames, collage_key = self.collage_frames, self.collage_key
+        layers, normalize = self.collage_layers(), self.tile_normalizer()
+        started = time.monotonic()
+        
+        def composite():
+            return render_cache.collage(frames, layers, COLLAGE_CELL, normalize, collage_key)
+        
+        app.tasks.submit(composite, priority=PREVIEW, key='collage',
+                         on_done=lambda collage: self.on_overlays_composited(collage, started),
+                         on_error=lambda e: Logger.warning(f"Collage: overlay composite failed: {e}"))
+    
+    def on_overlays_composited(self, collage, started):
+        self.collage_result = collage
+        self.display_collage(collage)
+        Logger.info(f"Collage: recomposited overlays in {(time.monotonic() - started) * 1000:.1f} ms")
+    
+    def display_collage(self, collage, full_resolution=True):
+        images = self.collage_frames
+        layers = self.collage_layers()
+        normalize = self.tile_normalizer()
+        self.pyramid_generation = getattr(self, 'pyramid_generation', 0) + 1
+        generation = self.pyramid_generation
+        
+        # Coming back to an unchanged exam reuses its texture and pyramid
+        key = (self.collage_key, tuple(layers), normalize is not None) if full_resolution else None
+        shown = getattr(self, 'shown_collages', {}).get(key)
+        if shown is not None:
+            texture, size, pyramid = shown
+            self.collage_view.set_texture(texture, size, pyramid)
+            self.remember_collage(key, pyramid)
+            if pyramid is not None:
+                return
+        else:
+            self.collage_view.set_image(collage)
+            self.remember_collage(key)
+        
+        # Build the full-resolution pyramid off the UI thread; the tiles come
+        # from the render cache and are reused when only the overlays change
+        if not full_resolution:
+            return
+        app = MDApp.get_running_app()
+        
+        def build():
+            tiles = render_cache.tiles(images, native_cell_size(images), normalize)
+            cell_size = (tiles.shape[1] // 3, tiles.shape[0] // 3)
+            full = overlay_cache.composite(tiles, layers, cell_size)
+            return ImagePyramid(cv2.cvtColor(full, cv2.COLOR_BGR2RGB))
+        
+        # A newer build (e.g. after an overlay toggle) supersedes this one
+        app.tasks.submit(build, priority=PREVIEW, key='pyramid',
+                         on_done=lambda pyramid: self.on_pyramid_ready(generation, key, pyramid),
+                         on_error=lambda e: Logger.warning(f"Collage: pyramid build failed: {e}"))
+    
+    def on_pyramid_ready(self, generation, key, pyramid):
+        if generation == self.pyramid_generation:
+            self.collage_view.set_pyramid(pyramid)
+            self.remember_collage(key, pyramid)
+    
+    def remember_collage(self, key, pyramid=None):
+        # The last two displayed collages keep their texture (and pyramid)
+        if key is None:
+            return
+        if not hasattr(self, 'shown_collages'):
+            self.shown_collages = OrderedDict()
+        view = self.collage_view
+        self.shown_collages[key] = (view.base_texture, view.image_size, pyramid)
+        self.shown_collages.move_to_end(key)
+        while len(self.shown_collages) > 2:
+            self.shown_collages.popitem(last=False)
+    
+    def collage_bytes(self, collage=None):
+        # The collage is JPEG-encoded once and reused by every export.
+        # Workers pass the collage taken on the UI thread when they were
+        # submitted, so an overlay toggle meanwhile cannot swap it.
+        collage = self.collage_result if collage is None else collage
+        cached = getattr(self, 'collage_jpeg', None)
+        if cached is not None and cached[0] is collage:
+            return cached[1]
+        ok, buf = cv2.imencode('.jpg', collage, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok:
+            raise ValueError("could not encode the collage as JPEG")
+        self.collage_jpeg = (collage, buf.tobytes())
+        return self.collage_jpeg[1]
     
     def save_collage(self, *args):
         if hasattr(self, 'collage_result'):
-            filename = f"gaze_collage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
+            started = time.monotonic()
+            app = MDApp.get_running_app()
+            stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"gaze_collage_{stamp}.jpg"
             path = os.path.join(os.getcwd(), filename)
-            cv2.imwrite(path, self.collage_result)
+            exam_path = os.path.join(os.getcwd(), f"gaze_exam_{stamp}{EXAM_EXTENSION}")
+            store = app.captured_images
+            settings = dict(app.settings)
+            collage = self.collage_result
             
-            dialog = MDDialog(
-                title="Success",
-                text=f"Collage saved to:\n{path}",
-                buttons=[
-                    MDFlatButton(
-                        text="OK",
-                        on_release=lambda x: dialog.dismiss()
-                    )
-                ]
-            )
-            dialog.open()
+            def write():
+                data = self.collage_bytes(collage)
+                with open(path, 'wb') as f:
+                    f.write(data)
+                
+                # Keep the nine originals alongside the collage in one exam file
+                try:
+                    write_exam(exam_path, store, collage_bytes=data, settings=settings)
+                except Exception as e:
+                    Logger.warning(f"ExamFile: could not write {exam_path}: {e}")
+                    return None
+                return exam_path
+            
+            app.tasks.submit(write, priority=ENCODE,
+                             on_done=lambda exam: self.on_collage_saved(path, exam, started),
+                             on_error=lambda e: self.on_collage_saved(None, None, started, e))
+    
+    def on_collage_saved(self, path, exam_path, started, error=None):
+        app = MDApp.get_running_app()
+        app.trace.emit('save', duration_ms=round((time.monotonic() - started) * 1000, 1))
+        
+        # Not eligible for archiving or clean-up until it has been uploaded
+        if exam_path and app.settings.get('drive_link', ''):
+            app.uploads.add(exam_path)
+        self.saved_exam = exam_path
+        
+        text = f"Collage saved to:\n{path}" if path else f"Failed to save collage: {error}"
+        if exam_path:
+            text += f"\n\nExam saved to:\n{exam_path}"
+        dialog = MDDialog(
+            title="Success" if path else "Error",
+            text=text,
+            buttons=[
+                MDFlatButton(
+                    text="OK",
+                    on_release=lambda x: dialog.dismiss()
+                )
+            ]
+        )
+        dialog.open()
+    
+    def create_report(self, *args):
+        if not hasattr(self, 'collage_result'):
+            return
+        app = MDApp.get_running_app()
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        path = os.path.join(os.getcwd(), f"gaze_report_{stamp}.pdf")
+        store = app.captured_images
+        info = {
+            'Hospital': app.settings.get('header_text', ''),
+            'Examined': self.collage_timestamp,
+            'Exam ID': app.trace.exam_id or "-",
+            'Alignment': "on" if app.settings.get('align_images', False) else "off",
+            'Generated': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        
+        self.report_button.disabled = True
+        self.report_progress.value = 0
+        self.report_progress.opacity = 1
+        started = time.monotonic()
+        
+        def on_progress(fraction):
+            Clock.schedule_once(lambda dt: setattr(self.report_progress, 'value', fraction * 100))
+        
+        def on_done(result, error):
+            duration_ms = round((time.monotonic() - started) * 1000, 1)
+            Clock.schedule_once(lambda dt: self.on_report_done(result, error, duration_ms))
+        
+        app.reports.submit(path, store, collage_bytes=self.collage_bytes(), info=info,
+                           analysis=app.analyser.results_for(store),
+                           on_progress=on_progress, on_done=on_done)
+    
+    def on_report_done(self, path, error, duration_ms):
+        MDApp.get_running_app().trace.emit('report', duration_ms=duration_ms)
+        self.report_button.disabled = False
+        self.report_progress.opacity = 0
+        
+        dialog = MDDialog(
+            title="Report" if path else "Report Error",
+            text=f"Report saved to:\n{path}" if path else f"Failed to create report: {error}",
+            buttons=[
+                MDFlatButton(
+                    text="OK",
+                    on_release=lambda x: dialog.dismiss()
+                )
+            ]
+        )
+        dialog.open()
     
     def share_collage(self, *args):
         if hasattr(self, 'collage_result'):
             temp_file = f"temp_share_collage_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
-            cv2.imwrite(temp_file, self.collage_result)
+            collage = self.collage_result
             
-            dialog = MDDialog(
-                title="Share",
-                text=f"Collage saved to:\n{temp_file}\n\nReady for sharing.",
-                buttons=[
-                    MDFlatButton(
-                        text="OK",
-                        on_release=lambda x: dialog.dismiss()
-                    )
-                ]
-            )
-            dialog.open()
+            def write():
+                data = self.collage_bytes(collage)
+                with open(temp_file, 'wb') as f:
+                    f.write(data)
+            
+            MDApp.get_running_app().tasks.submit(write, priority=ENCODE,
+                                                 on_done=lambda result: self.on_collage_shared(temp_file),
+                                                 on_error=lambda e: self.on_collage_shared(None, e))
+    
+    def on_collage_shared(self, temp_file, error=None):
+        if temp_file:
+            MDApp.get_running_app().trace.emit('share')
+        
+        dialog = MDDialog(
+            title="Share" if temp_file else "Share Error",
+            text=(f"Collage saved to:\n{temp_file}\n\nReady for sharing." if temp_file
+                  else f"Failed to share collage: {error}"),
+            buttons=[
+                MDFlatButton(
+                    text="OK",
+                    on_release=lambda x: dialog.dismiss()
+                )
+            ]
+        )
+        dialog.open()
     
     def upload_to_drive(self, *args):
         app = MDApp.get_running_app()
         drive_link = app.settings.get('drive_link', '')
         
         if drive_link:
+            app.trace.emit('upload', destination='drive')
+            # Nothing is sent yet, so the exam stays in the upload ledger and
+            # storage_manager keeps it; remove it only once a real upload
+            # has confirmed
             dialog = MDDialog(
                 title="Drive Upload",
                 text=f"Would upload to:\n{drive_link}",
@@ -1095,9 +2155,79 @@ class ResultScreen(MDScreen):
     
     def retake_all(self, *args):
         app = MDApp.get_running_app()
+        if isinstance(app.captured_images, CaptureStore):
+            app.captured_images.close()
         app.captured_images = {}
+        self.collage_tiles = self.collage_key = None
         self.manager.switch_to(self.manager.get_screen("gaze"))
 
+# ---------------- SOAK TEST ---------------- #
+
+class SoakDriver:
+    # Diagnostics mode: runs `exams` complete examinations through the real
+    # screens on synthetic camera frames, then writes the leak report and
+    # quits. Each step of run() yields a condition to wait for; the Clock
+    # polls it, so the UI keeps rendering exactly as in normal use.
+    def __init__(self, app, exams, report_path='leak_report.json'):
+        self.app = app
+        self.exams = exams
+        self.report_path = report_path
+        self.exam = 0
+        self._script = None
+        self._waiting = None
+        self._event = None
+    
+    def start(self, *args):
+        self._script = self.run()
+        self._event = Clock.schedule_interval(self.tick, 0.1)
+    
+    def tick(self, dt):
+        if self._waiting is not None and not self._waiting():
+            return
+        try:
+            self._waiting = next(self._script)
+        except StopIteration:
+            self._event.cancel()
+            self.finish()
+    
+    def run(self):
+        app = self.app
+        sm = app.sm
+        gaze = sm.get_screen("gaze")
+        result = sm.get_screen("result")
+        for exam in range(1, self.exams + 1):
+            self.exam = exam
+            sm.get_screen("welcome").start_examination()
+            yield lambda: sm.current == "gaze" and gaze.camera.get_frame() is not None
+            for position in range(1, 10):
+                gaze.capture_photo()
+                if gaze.duplicate_dialog:
+                    # Synthetic frames all look alike; keep them
+                    gaze.duplicate_dialog.dismiss()
+                yield lambda: not gaze.pending_captures
+                if position < 9:
+                    gaze.next_gaze()
+                    yield lambda: gaze.camera.get_frame() is not None
+            gaze.finish_examination()
+            if app.settings.get('queue_mode', False):
+                yield lambda: not app.post_queue.pending()
+                gaze.captured_images.close()
+            else:
+                yield lambda: sm.current == "result" and result.collage_view.pyramid is not None
+                # Exercise the overlay and texture paths once per exam
+                result.toggle_overlay('show_grid', not app.settings.get('show_grid', False))
+                result.toggle_overlay('show_grid', not app.settings.get('show_grid', False))
+            sm.switch_to(sm.get_screen("welcome"))
+            yield lambda: sm.current == "welcome"
+            app.profiler.checkpoint('exam_end', exam)
+    
+    def finish(self):
+        report = self.app.profiler.report()
+        self.app.profiler.save(self.report_path)
+        Logger.info(f"Soak: {self.exams} exams, report written to {self.report_path}\n"
+                    f"{format_report(report)}")
+        self.app.stop()
+
 # ---------------- SETTINGS SCREEN ---------------- #
 
 class SettingsScreen(MDScreen):
@@ -1252,6 +2382,124 @@ class SettingsScreen(MDScreen):
         position_card.add_widget(position_info)
         position_card.add_widget(checkbox_layout)
         
+        # Motion clip recording
+        record_card, self.record_checkbox = self.toggle_card(
+            title="🎥 Motion Clips",
+            info=f"Save the last {settings.get('record_seconds', 3)} seconds of preview around each capture "
+                 "to review nystagmus, overshoot or lid lag.",
+            label="Record motion clips",
+            active=settings.get('record_clips', False),
+            color="#E67E22",
+            background="#FDF2E9"
+        )
+        
+        # Image alignment
+        align_card, self.align_checkbox = self.toggle_card(
+            title="🎯 Image Alignment",
+            info="Register every gaze image to the primary position so head movement "
+                 "between captures does not shift the collage tiles.",
+            label="Align images to primary gaze",
+            active=settings.get('align_images', False),
+            color="#16A085",
+            background="#E8F8F5"
+        )
+        
+        # Photometric normalization
+        normalize_card, self.normalize_checkbox = self.toggle_card(
+            title="🌗 Tile Normalization",
+            info="Match the brightness and colour balance of every gaze tile to the "
+                 "primary position, evening out changes in lighting between captures.",
+            label="Normalize collage tiles",
+            active=settings.get('normalize_tiles', False),
+            color="#7D6608",
+            background="#FEF9E7"
+        )
+        
+        # Patient queue
+        queue_card, self.queue_checkbox = self.toggle_card(
+            title="👥 Patient Queue",
+            info="Finishing an examination saves it in the background and starts "
+                 "the next patient immediately, keeping the camera running.",
+            label="Enable patient queue mode",
+            active=settings.get('queue_mode', False),
+            color="#8E44AD",
+            background="#F4ECF7"
+        )
+        
+        # Idle preview
+        idle_card, self.idle_checkbox = self.toggle_card(
+            title="🔋 Idle Preview",
+            info=f"Slow the camera preview to {settings.get('idle_preview_fps', 2)} fps after "
+                 f"{settings.get('idle_after_seconds', 20)} s without movement; any motion or "
+                 "touch restores full rate.",
+            label="Save power when idle",
+            active=settings.get('idle_preview', True),
+            color="#1E8449",
+            background="#E9F7EF"
+        )
+        
+        # Duplicate capture check
+        duplicate_card, self.duplicate_checkbox = self.toggle_card(
+            title="🔁 Duplicate Check",
+            info="Warn right after a capture that looks the same as another position's, "
+                 "e.g. when the patient did not follow the target.",
+            label="Warn on duplicate captures",
+            active=settings.get('duplicate_check', True),
+            color="#B9770E",
+            background="#FEF5E7"
+        )
+        
+        # Live preview stream
+        stream_card, self.stream_checkbox = self.toggle_card(
+            title="📡 Live Preview Stream",
+            info=f"Stream the examination preview to browsers at "
+                 f"http://{settings.get('stream_host', '127.0.0.1')}:{settings.get('stream_port', 8766)}/"
+                 f"?token={settings.get('stream_token', '')}",
+            label="Stream live preview",
+            active=settings.get('stream_preview', False),
+            color="#C0392B",
+            background="#FDEDEC"
+        )
+        
+        # Re-render past collages with the current layout
+        rerender_card = MDCard(
+            orientation="vertical",
+            padding=dp(25),
+            spacing=dp(15),
+            elevation=2,
+            radius=[dp(20),],
+            md_bg_color=get_color_from_hex("#EBF5FB")
+        )
+        
+        rerender_card.add_widget(MDLabel(
+            text="🖼️ Past Collages",
+            theme_text_color="Custom",
+            text_color=get_color_from_hex("#2E86C1"),
+            font_style="H6",
+            bold=True
+        ))
+        rerender_card.add_widget(MDLabel(
+            text="Rebuild the collages of chosen examinations (or every exam in a chosen folder) "
+                 "from their original images using the current display settings. Exams already "
+                 "up to date are skipped.",
+            theme_text_color="Secondary",
+            font_style="Body2"
+        ))
+        
+        self.rerender_status = MDLabel(
+            text="",
+            theme_text_color="Secondary",
+            font_style="Caption"
+        )
+        self.rerender_button = MDRaisedButton(
+            text="🔁 RE-RENDER PAST COLLAGES",
+            md_bg_color=get_color_from_hex("#2E86C1"),
+            on_release=self.rerender_collages
+        )
+        
+        rerender_card.add_widget(self.rerender_button)
+        rerender_card.add_widget(self.rerender_status)
+        
         # Drive settings
         drive_card = MDCard(
             orientation="vertical",
@@ -1284,9 +2532,28 @@ class SettingsScreen(MDScreen):
             height=dp(50)
         )
         
+        self.server_input = MDTextField(
+            hint_text="Collage server, e.g. http://192.168.1.20:8765",
+            mode="rectangle",
+            text=settings.get('collage_server', ''),
+            size_hint_y=None,
+            height=dp(50)
+        )
+        
+        self.server_token_input = MDTextField(
+            hint_text="Collage server token",
+            mode="rectangle",
+            password=True,
+            text=settings.get('collage_server_token', ''),
+            size_hint_y=None,
+            height=dp(50)
+        )
+        
         drive_card.add_widget(drive_title)
         drive_card.add_widget(drive_info)
         drive_card.add_widget(self.drive_input)
+        drive_card.add_widget(self.server_input)
+        drive_card.add_widget(self.server_token_input)
         
         # Save button
         save_button = MDRaisedButton(
@@ -1301,6 +2568,14 @@ class SettingsScreen(MDScreen):
         # Add all cards
         settings_container.add_widget(brightness_card)
         settings_container.add_widget(position_card)
+        settings_container.add_widget(record_card)
+        settings_container.add_widget(align_card)
+        settings_container.add_widget(normalize_card)
+        settings_container.add_widget(queue_card)
+        settings_container.add_widget(idle_card)
+        settings_container.add_widget(duplicate_card)
+        settings_container.add_widget(stream_card)
+        settings_container.add_widget(rerender_card)
         settings_container.add_widget(drive_card)
         settings_container.add_widget(save_button)
         
@@ -1312,6 +2587,105 @@ class SettingsScreen(MDScreen):
         
         self.add_widget(main_layout)
     
+    def toggle_card(self, title, info, label, active, color, background):
+        card = MDCard(
+            orientation="vertical",
+            padding=dp(25),
+            spacing=dp(15),
+            elevation=2,
+            radius=[dp(20),],
+            md_bg_color=get_color_from_hex(background)
+        )
+        
+        card.add_widget(MDLabel(
+            text=title,
+            theme_text_color="Custom",
+            text_color=get_color_from_hex(color),
+            font_style="H6",
+            bold=True
+        ))
+        card.add_widget(MDLabel(
+            text=info,
+            theme_text_color="Secondary",
+            font_style="Body2"
+        ))
+        
+        checkbox = MDCheckbox(
+            size_hint=(None, None),
+            size=(dp(40), dp(40)),
+            active=active
+        )
+        
+        checkbox_layout = MDBoxLayout(
+            orientation="horizontal",
+            spacing=dp(10)
+        )
+        checkbox_layout.add_widget(checkbox)
+        checkbox_layout.add_widget(MDLabel(
+            text=label,
+            theme_text_color="Primary"
+        ))
+        card.add_widget(checkbox_layout)
+        
+        return card, checkbox
+    
+    def rerender_collages(self, *args):
+        app = MDApp.get_running_app()
+        if getattr(app, 'rerenderer', None):
+            app.rerenderer.cancel()
+            self.rerender_status.text = "Stopping…"
+            return
+        
+        from kivymd.uix.filemanager import MDFileManager
+        self.file_manager = MDFileManager(
+            exit_manager=lambda *a: self.file_manager.close(),
+            select_path=self.rerender_selected,
+            selector='multi',
+            ext=[EXAM_EXTENSION]
+        )
+        self.file_manager.show(os.getcwd())
+    
+    def rerender_selected(self, paths):
+        self.file_manager.close()
+        app = MDApp.get_running_app()
+        exams = []
+        for path in ([paths] if isinstance(paths, str) else paths):
+            # A folder stands for every exam in it
+            exams.extend(find_exams(path) if os.path.isdir(path) else
+                         [path] if path.endswith(EXAM_EXTENSION) else [])
+        exams = sorted(set(exams))
+        if not exams:
+            self.rerender_status.text = "No exams selected"
+            return
+        
+        # Exams render on the analysis workers forked at startup (or on
+        # threads once a worker has died); forking here would copy the
+        # camera, executor and trace threads' state
+        pool = app.analysis_pool if app.analysis_pool and not app.analysis_pool.broken else None
+        rerenderer = app.rerenderer = CollageRerenderer(app.settings, pool=pool, processes=False)
+        self.rerender_button.text = "⏹ STOP"
+        self.rerender_status.text = f"{len(rerenderer.plan(exams))} of {len(exams)} exams need re-rendering"
+        
+        def on_progress(done, total):
+            Clock.schedule_once(lambda dt: setattr(self.rerender_status, 'text', f"Re-rendered {done}/{total}"))
+        
+        app.tasks.submit(rerenderer.run, exams, on_progress, priority=HOUSEKEEPING,
+                         on_done=self.on_rerender_done,
+                         on_error=lambda e: self.on_rerender_done({'error': str(e)}))
+    
+    def on_rerender_done(self, summary):
+        app = MDApp.get_running_app()
+        app.rerenderer = None
+        self.rerender_button.text = "🔁 RE-RENDER PAST COLLAGES"
+        if 'error' in summary:
+            self.rerender_status.text = f"Re-render failed: {summary['error']}"
+            return
+        Logger.info(f"Rerender: {summary}")
+        self.rerender_status.text = (
+            f"{'Stopped' if summary['cancelled'] else 'Done'}: {summary['rendered']} re-rendered, "
+            f"{summary['skipped']} up to date, {len(summary['failed'])} failed"
+        )
+    
     def on_brightness_change(self, instance, value):
         # Update settings in real-time
         app = MDApp.get_running_app()
@@ -1322,14 +2696,30 @@ class SettingsScreen(MDScreen):
         app.settings['brightness'] = int(self.brightness_slider.value)
         app.settings['show_positions'] = self.position_checkbox.active
         app.settings['drive_link'] = self.drive_input.text
+        app.settings['collage_server'] = self.server_input.text.strip()
+        app.settings['collage_server_token'] = self.server_token_input.text.strip()
+        app.settings['record_clips'] = self.record_checkbox.active
+        app.settings['align_images'] = self.align_checkbox.active
+        app.settings['normalize_tiles'] = self.normalize_checkbox.active
+        app.settings['queue_mode'] = self.queue_checkbox.active
+        app.settings['idle_preview'] = self.idle_checkbox.active
+        app.settings['duplicate_check'] = self.duplicate_checkbox.active
+        app.settings['stream_preview'] = self.stream_checkbox.active
         
         # Save to file
-        try:
-            with open('kivy_settings.json', 'w') as f:
-                json.dump(app.settings, f)
-        except:
-            pass
+        settings = dict(app.settings)
+        
+        def write():
+            try:
+                with open('kivy_settings.json', 'w') as f:
+                    json.dump(settings, f)
+            except:
+                pass
         
+        app.tasks.submit(write, priority=HOUSEKEEPING, key='settings',
+                         on_done=lambda result: self.on_settings_saved())
+    
+    def on_settings_saved(self):
         dialog = MDDialog(
             title="Settings Saved",
             text="All settings have been saved successfully!",
@@ -1348,11 +2738,39 @@ class SettingsScreen(MDScreen):
 # ---------------- MAIN APP ---------------- #
 
 class NineGazeApp(MDApp):
-    captured_images = DictProperty({})
+    captured_images = ObjectProperty({})
     settings = DictProperty({
         'brightness': 50,
         'show_positions': True,
-        'drive_link': ''
+        'show_timestamp': True,
+        'show_header': False,
+        'header_text': 'Aravind Eye Hospitals',
+        'show_grid': False,
+        'show_arrows': False,
+        'drive_link': '',
+        'capture_memory_mb': 64,
+        'record_clips': False,
+        'record_seconds': 3,
+        'record_post_seconds': 1,
+        'record_memory_mb': 96,
+        'record_scale': 0.5,
+        'align_images': False,
+        'normalize_tiles': False,
+        'queue_mode': False,
+        'storage_quota_mb': 2048,
+        'archive_after_days': 30,
+        'collage_server': '',
+        'collage_server_token': '',
+        'stream_preview': False,
+        'stream_host': '127.0.0.1',
+        'stream_port': 8766,
+        'stream_token': '',
+        'idle_preview': True,
+        'idle_preview_fps': 2,
+        'idle_after_seconds': 20,
+        'warm_camera_seconds': 60,
+        'process_analysis': False,
+        'duplicate_check': True
     })
     
     def build(self):
@@ -1366,6 +2784,66 @@ class NineGazeApp(MDApp):
                 self.settings.update(loaded_settings)
         except:
             pass
+        if not self.settings.get('stream_token'):
+            # Saved with the other settings, so viewer links keep working
+            self.settings['stream_token'] = secrets.token_urlsafe(12)
+        
+        # Opt-in: registration and reflex analysis in worker processes on
+        # shared frames. The workers are forked after the window and GL
+        # context exist, which is only safe on desktop test setups; Android
+        # has neither fork nor shared memory and always analyses in-process.
+        self.analysis_pool = None
+        if self.settings.get('process_analysis', False) and analysis_pool_available():
+            try:
+                self.analysis_pool = AnalysisPool()
+                self.analysis_pool.warm()
+            except Exception as e:
+                Logger.warning(f"AnalysisPool: {e}; analysing in-process")
+                self.analysis_pool = None
+        
+        # Shared background workers; results come back on the Clock
+        self.tasks = TaskExecutor(
+            max_workers=min(8, (os.cpu_count() or 2) + 1),
+            dispatch=lambda fn: Clock.schedule_once(lambda dt: fn())
+        )
+        
+        # Aligns gaze images to the primary position in the background
+        self.registrar = Registrar(pool=self.tasks.lane(PREVIEW), offload=self.analysis_pool)
+        self.analyser = ReflexAnalyser(pool=self.tasks.lane(PREVIEW), offload=self.analysis_pool)
+        self.normalizer = PhotometricNormalizer()
+        self.trace = ExamTrace()
+        self.reports = ReportGenerator(pool=self.tasks.lane(ENCODE))
+        self.post_queue = PostQueue(
+            registrar=self.registrar,
+            normalizer=self.normalizer,
+            on_change=lambda job: Clock.schedule_once(lambda dt: self.on_queue_change(job))
+        )
+        
+        # Disk quota and retention, run in small background slices
+        self.uploads = UploadLedger()
+        self.storage = StorageManager(
+            quota_bytes=self.settings.get('storage_quota_mb', 2048) * 1024 * 1024,
+            archive_after_days=self.settings.get('archive_after_days', 30),
+            protected=self.uploads.paths
+        )
+        self.storage.start()
+        
+        # Leak profiling: NINEGAZE_PROFILE=1 records memory at every screen
+        # change, NINEGAZE_SOAK=<exams> also runs a scripted soak test on a
+        # simulated camera
+        self.camera_source = None
+        self.camera = None
+        self.profiler = None
+        self.soak = None
+        self.exams_finished = 0
+        soak_exams = int(os.environ.get('NINEGAZE_SOAK', 0) or 0)
+        if soak_exams or os.environ.get('NINEGAZE_PROFILE'):
+            self.profiler = LeakProfiler(warmup=max(1, soak_exams // 2))
+            self.profiler.start()
+        if soak_exams:
+            self.camera_source = lambda: SimulatedCamera(fps=30)
+            self.soak = SoakDriver(self, soak_exams)
+            Clock.schedule_once(self.soak.start, 1)
         
         # Create screen manager
         self.sm = MDScreenManager()
@@ -1375,8 +2853,126 @@ class NineGazeApp(MDApp):
         self.sm.add_widget(GazeScreen(name="gaze"))
         self.sm.add_widget(ResultScreen(name="result"))
         self.sm.add_widget(SettingsScreen(name="settings"))
+        if self.profiler:
+            self.sm.bind(current=self.on_screen_change)
         
         return self.sm
+    
+    def on_screen_change(self, manager, name):
+        # Measured on the next frame, after the new screen has been built
+        exam = self.exams_finished
+        Clock.schedule_once(lambda dt: self.profiler.checkpoint(f"screen:{name}", exam))
+        if not self.soak and name == "welcome" and exam and \
+                not any(c['label'] == 'exam_end' and c['exam'] == exam for c in self.profiler.checkpoints):
+            Clock.schedule_once(lambda dt: self.profiler.checkpoint('exam_end', exam))
+    
+    def warm_camera(self):
+        # Opens the camera in the background while the welcome screen is up,
+        # so the examination starts on a settled live image. Until it is
+        # taken only every third frame is decoded. Left unused for
+        # `warm_camera_seconds` it is released, and warmed again on the
+        # next visit to the welcome screen.
+        if self.camera is None:
+            self.camera = CameraController(source=self.camera_source,
+                                           brightness=self.settings.get('brightness', 50), open=False)
+            self.camera.decode_stride = 3
+        self._warm_generation = getattr(self, '_warm_generation', 0) + 1
+        if not self.camera.running:
+            self._warm_task = self.tasks.submit(self.camera.open_camera, priority=CAPTURE)
+        if getattr(self, '_warm_timeout', None):
+            self._warm_timeout.cancel()
+        self._warm_timeout = Clock.schedule_once(self.release_warm_camera,
+                                                 self.settings.get('warm_camera_seconds', 60))
+        return self.camera
+    
+    def release_warm_camera(self, *args):
+        # Closes the device, but keeps the controller: its open lock orders
+        # this release against a warm-up still opening and the next one,
+        # and a camera warmed again or taken meanwhile stays open
+        if getattr(self, '_warm_timeout', None):
+            self._warm_timeout.cancel()
+            self._warm_timeout = None
+        camera = self.camera
+        if camera is None:
+            return
+        if getattr(self, '_warm_task', None):
+            self._warm_task.cancel()
+        generation = getattr(self, '_warm_generation', 0)
+        
+        def release():
+            with camera.open_lock:
+                if self._warm_generation == generation:
+                    camera.release()
+        self.tasks.submit(release, priority=CAPTURE)
+    
+    def take_camera(self):
+        # Hands the warmed camera to the examination; the next visit to the
+        # welcome screen warms a new one. One released while idle is opened
+        # again by GazeScreen.start_camera like a cold one.
+        if getattr(self, '_warm_timeout', None):
+            self._warm_timeout.cancel()
+            self._warm_timeout = None
+        self._warm_generation = getattr(self, '_warm_generation', 0) + 1
+        camera, self.camera = self.camera, None
+        if camera is None:
+            return CameraController(source=self.camera_source,
+                                    brightness=self.settings.get('brightness', 50))
+        camera.decode_stride = 1
+        camera.set_brightness(self.settings.get('brightness', 50))
+        return camera
+    
+    def preview_streamer(self):
+        # Started on first use and kept running, so viewers stay connected
+        # between examinations
+        if getattr(self, '_streamer', None) is None:
+            streamer = PreviewStreamer(self.settings['stream_token'],
+                                       host=self.settings.get('stream_host', '127.0.0.1'),
+                                       port=self.settings.get('stream_port', 8766))
+            try:
+                streamer.start()
+            except OSError as e:
+                Logger.warning(f"PreviewStreamer: could not listen on port {streamer.port}: {e}")
+                return None
+            self._streamer = streamer
+        return self._streamer
+    
+    def collage_client(self):
+        url = self.settings.get('collage_server', '')
+        token = self.settings.get('collage_server_token', '')
+        if not url or not token:
+            return None
+        client = getattr(self, '_collage_client', None)
+        if client is None or client.base_url != url.rstrip('/') or client.token != token:
+            self._collage_client = CollageClient(url, token)
+        return self._collage_client
+    
+    def on_queue_change(self, job=None):
+        if job is not None and job.status == 'done' and self.settings.get('drive_link', ''):
+            self.uploads.add(job.outputs.get('exam'))
+        gaze = self.sm.get_screen("gaze")
+        if hasattr(gaze, 'queue_strip'):
+            gaze.update_queue_status()
+    
+    def on_stop(self):
+        if getattr(self, 'rerenderer', None):
+            self.rerenderer.cancel()
+        if self.camera:
+            self.camera.release()
+        # Let queued saves and clip encodes finish before exiting
+        self.tasks.shutdown(wait=True)
+        Logger.info(f"TaskExecutor: {self.tasks.metrics()}")
+        if self.analysis_pool:
+            Logger.info(f"AnalysisPool: {self.analysis_pool.stats()}")
+            self.analysis_pool.shutdown()
+        self.trace.close()
+        self.storage.stop()
+        if getattr(self, '_streamer', None):
+            Logger.info(f"PreviewStreamer: {self._streamer.stats()}")
+            self._streamer.stop()
+        Logger.info(f"Storage: {self.storage.report()}")
+        if self.profiler and not self.soak:
+            self.profiler.save('leak_report.json')
+            Logger.info(f"LeakProfiler:\n{format_report(self.profiler.report())}")
 
 if __name__ == "__main__":
     NineGazeApp().run()
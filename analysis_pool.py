@@ -0,0 +1,311 @@
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # No POSIX shared memory (e.g. Android): analysis stays in-process
+    shared_memory = None
+
+def available():
+    # Workers are forked: a spawned worker would re-import the GUI script
+    # and open a window of its own
+    return shared_memory is not None and 'fork' in multiprocessing.get_all_start_methods()
+
+# ---------------- SHARED FRAMES ---------------- #
+
+# What travels to a worker instead of the pixels
+FrameHandle = namedtuple('FrameHandle', 'name shape dtype')
+
+class SharedFrame:
+    # One frame copied into a shared-memory block. The block lives until
+    # the pool retires it and the last job using it has finished.
+    
+    def __init__(self, frame):
+        frame = np.ascontiguousarray(frame)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, frame.nbytes))
+        self.array = np.ndarray(frame.shape, frame.dtype, buffer=self.shm.buf)
+        self.array[...] = frame
+        self.handle = FrameHandle(self.shm.name, frame.shape, frame.dtype.str)
+        self.nbytes = frame.nbytes
+        self.jobs = 0
+        self.retired = False
+    
+    def close(self):
+        self.array = None
+        self.shm.close()
+        self.shm.unlink()
+
+def _attach(handle):
+    shm = shared_memory.SharedMemory(name=handle.name)
+    # Before Python 3.13 attaching also registers the block with the
+    # resource tracker, which would unlink it when this worker exits
+    if sys.version_info < (3, 13):
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _view(arg, blocks):
+    if not isinstance(arg, FrameHandle):
+        return arg
+    shm = _attach(arg)
+    blocks.append(shm)
+    return np.ndarray(arg.shape, np.dtype(arg.dtype), buffer=shm.buf)
+
+def _call(fn, args):
+    # Runs in a worker: maps the frame handles and calls fn on the views
+    blocks = []
+    views = [_view(arg, blocks) for arg in args]
+    try:
+        return fn(*views)
+    finally:
+        # The views must be gone before their blocks can close
+        del views[:]
+        for shm in blocks:
+            shm.close()
+
+def _init_worker():
+    # One OpenCV thread per worker; the pool provides the parallelism
+    cv2.setNumThreads(1)
+
+def _ping():
+    return os.getpid()
+
+# ---------------- ANALYSIS POOL ---------------- #
+
+class AnalysisPool:
+    # Persistent worker processes for CPU-heavy analysis (registration,
+    # reflex detection) that would otherwise contend for the GIL. Frames
+    # are shared once per capture version: share() copies a capture into a
+    # shared-memory block and jobs receive only its handle, so nothing
+    # larger than a result dict is pickled. The last `max_frames` blocks are
+    # kept for reuse by later jobs. Workers start on warm() and stay up
+    # across exams. If one dies the pool is `broken` and every job raises
+    # BrokenProcessPool; it is not re-forked from the running app.
+    
+    def __init__(self, workers=None, max_frames=10):
+        self.workers = workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.max_frames = max_frames
+        self.started_ms = None
+        self.jobs = 0
+        self.shared_bytes = 0
+        self.broken = False
+        self._frames = OrderedDict()   # capture version -> SharedFrame
+        self._lock = threading.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('fork'),
+                                             initializer=_init_worker)
+    
+    def warm(self):
+        # Forks every worker now, before the app starts its own threads
+        started = time.perf_counter()
+        futures = [self._executor.submit(_ping) for _ in range(self.workers)]
+        self.started_ms = round((time.perf_counter() - started) * 1000, 1)
+        return futures
+    
+    def share(self, store, position):
+        # The block comes with a job reference taken, so it cannot be
+        # evicted and closed before the submit() it is for takes that
+        # reference over: share once per job
+        version = store.version(position) if hasattr(store, 'version') else None
+        with self._lock:
+            shared = self._frames.get(version) if version is not None else None
+            if shared is not None:
+                self._frames.move_to_end(version)
+                shared.jobs += 1
+                return shared
+        shared = SharedFrame(store[position])
+        shared.jobs = 1
+        with self._lock:
+            self.shared_bytes += shared.nbytes
+            if version is None:
+                # Not reusable: freed once its jobs are done
+                shared.retired = True
+                return shared
+            if version in self._frames:
+                existing = self._frames[version]
+                existing.jobs += 1
+            else:
+                self._frames[version] = shared
+                existing = None
+                while len(self._frames) > self.max_frames:
+                    _, old = self._frames.popitem(last=False)
+                    self._retire(old)
+        if existing is not None:
+            shared.close()
+            return existing
+        return shared
+    
+    def _retire(self, shared):
+        # Called with the lock held
+        shared.retired = True
+        if not shared.jobs:
+            shared.close()
+    
+    def submit(self, fn, *args):
+        # fn must be a module-level function; SharedFrame arguments, each
+        # from its own share(), arrive in the worker as ndarrays over the
+        # shared block
+        frames = [arg for arg in args if isinstance(arg, SharedFrame)]
+        with self._lock:
+            self.jobs += 1
+        handles = tuple(arg.handle if isinstance(arg, SharedFrame) else arg for arg in args)
+        try:
+            future = self._executor.submit(_call, fn, handles)
+        except BrokenProcessPool:
+            self.broken = True
+            self._release(frames)
+            raise
+        future.add_done_callback(lambda f: self._done(f, frames))
+        return future
+    
+    def submit_shared(self, fn, store, positions, *args):
+        # fn(frame at each of `positions`, *args), sharing the frames first
+        frames = []
+        try:
+            for position in positions:
+                frames.append(self.share(store, position))
+        except Exception:
+            self._release(frames)
+            raise
+        return self.submit(fn, *frames, *args)
+    
+    def run(self, fn, *args):
+        # Blocking submit, for callers already on a worker thread
+        return self.submit(fn, *args).result()
+    
+    def run_shared(self, fn, store, positions, *args):
+        return self.submit_shared(fn, store, positions, *args).result()
+    
+    def _done(self, future, frames):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self.broken = True
+        self._release(frames)
+    
+    def _release(self, frames):
+        with self._lock:
+            for shared in frames:
+                shared.jobs -= 1
+                if shared.retired and not shared.jobs:
+                    shared.close()
+    
+    def stats(self):
+        with self._lock:
+            return {'workers': self.workers, 'started_ms': self.started_ms, 'jobs': self.jobs,
+                    'broken': self.broken, 'frames': len(self._frames),
+                    'resident_bytes': sum(s.nbytes for s in self._frames.values()),
+                    'shared_bytes': self.shared_bytes}
+    
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        with self._lock:
+            frames, self._frames = list(self._frames.values()), OrderedDict()
+            for shared in frames:
+                self._retire(shared)
+
+# ---------------- BENCHMARK ---------------- #
+
+def _exam_frames(size):
+    from capture_store import CaptureStore
+    from exposure import SimulatedCamera
+    
+    store = CaptureStore()
+    for position in range(1, 10):
+        camera = SimulatedCamera(size=size, seed=position)
+        store.put(position, camera.read()[1])
+    return store
+
+def _timed(submit, jobs):
+    # (wall seconds, per-job latencies). All jobs of an exam are ready at
+    # once, so latency runs from the start of the batch to each result.
+    started = time.perf_counter()
+    latencies = []
+    futures = []
+    for fn, args in jobs:
+        future = submit(fn, *args)
+        future.add_done_callback(lambda f: latencies.append(time.perf_counter() - started))
+        futures.append(future)
+    for future in futures:
+        future.result()
+    return time.perf_counter() - started, latencies
+
+def benchmark(exams=5, size=(1920, 1080), workers=None):
+    # Reflex analysis and registration of whole exams on the main process,
+    # on a process pool that pickles the frames, and on the shared-memory
+    # pool. Jobs are submitted all at once, as the app does when an exam is
+    # finished; latency is per job.
+    from concurrent.futures import Future
+    
+    from reflex_analysis import analyse_frame
+    from registration import register_frames
+    
+    def inline(fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+    
+    stores = [_exam_frames(size) for _ in range(exams)]
+    results = {}
+    pool = AnalysisPool(workers)
+    pool.warm()
+    pickled = ProcessPoolExecutor(max_workers=pool.workers,
+                                  mp_context=multiprocessing.get_context('fork'),
+                                  initializer=_init_worker)
+    for _ in range(pool.workers):
+        pickled.submit(_ping).result()
+    try:
+        for mode in ('main', 'pickled', 'shared'):
+            wall, latencies = 0.0, []
+            for store in stores:
+                if mode == 'shared':
+                    # One share per job; the frames are copied only once
+                    frame = lambda p: pool.share(store, p)
+                    submit = pool.submit
+                else:
+                    frame = store.__getitem__
+                    submit = inline if mode == 'main' else pickled.submit
+                jobs = [(analyse_frame, (frame(p),)) for p in store.keys()]
+                jobs += [(register_frames, (frame(1), frame(p))) for p in store.keys() if p != 1]
+                seconds, exam_latencies = _timed(submit, jobs)
+                wall += seconds
+                latencies += exam_latencies
+            latencies.sort()
+            results[mode] = {
+                'jobs_per_s': round(len(latencies) / wall, 1),
+                'exam_s': round(wall / exams, 3),
+                'latency_ms': round(1000 * sum(latencies) / len(latencies), 1),
+                'latency_p95_ms': round(1000 * latencies[int(0.95 * (len(latencies) - 1))], 1)
+            }
+    finally:
+        pickled.shutdown()
+        pool.shutdown()
+        for store in stores:
+            store.close()
+    results['pool'] = pool.stats()
+    return results
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not available():
+        print("shared-memory process pool not available on this platform")
+        return 1
+    exams = int(argv[0]) if argv else 5
+    results = benchmark(exams)
+    pool = results.pop('pool')
+    print(f"{pool['workers']} workers, started in {pool['started_ms']} ms")
+    for mode, r in results.items():
+        print(f"{mode:>8}: {r['jobs_per_s']:6.1f} jobs/s, {r['exam_s']:.3f} s/exam, "
+              f"latency {r['latency_ms']} ms (p95 {r['latency_p95_ms']} ms)")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+import itertools
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+# ---------------- MEMORY HELPERS ---------------- #
+
+def current_rss():
+    # Resident set size in bytes, or 0 when the platform does not expose it
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except Exception:
+        pass
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+        return usage if os.uname().sysname == 'Darwin' else usage * 1024
+    except Exception:
+        return 0
+
+# ---------------- CAPTURE STORE ---------------- #
+
+# Every stored frame gets a process-wide unique version, so caches keyed on
+# (position, version) stay valid across retakes and across exams
+_versions = itertools.count(1)
+
+class CaptureStore:
+    # Dict-like store for the nine gaze frames. Frames are kept as lossless
+    # PNG blobs, decoded on demand into a small LRU cache, and blobs are
+    # spilled to disk once the resident footprint exceeds the memory budget.
+
+    def __init__(self, budget_bytes=64 * 1024 * 1024, cache_size=2,
+                 compression=1, spill_dir=None):
+        self.budget_bytes = budget_bytes
+        self.cache_size = max(1, cache_size)
+        self.compression = compression
+        self._spill_root = spill_dir
+        self._spill_dir = None
+        self._encoded = OrderedDict()   # position -> PNG bytes (in memory)
+        self._spilled = {}              # position -> (path, size)
+        self._decoded = OrderedDict()   # position -> ndarray (LRU)
+        self._shapes = {}
+        self._meta = {}
+        self._versions = {}
+        self._lock = threading.RLock()
+        self.peak_rss = current_rss()
+        self.peak_footprint = 0
+
+    # Dict protocol, so screens can keep treating captures as a mapping
+
+    def __setitem__(self, position, frame):
+        self.put(position, frame)
+
+    def __getitem__(self, position):
+        frame = self.get(position)
+        if frame is None:
+            raise KeyError(position)
+        return frame
+
+    def __delitem__(self, position):
+        if not self.discard(position):
+            raise KeyError(position)
+
+    def __contains__(self, position):
+        with self._lock:
+            return position in self._encoded or position in self._spilled
+
+    def __len__(self):
+        with self._lock:
+            return len(self._encoded) + len(self._spilled)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        with self._lock:
+            return sorted(list(self._encoded) + list(self._spilled))
+
+    def items(self):
+        return [(position, self.get(position)) for position in self.keys()]
+
+    def values(self):
+        return [frame for _, frame in self.items()]
+
+    # Storage
+
+    def put(self, position, frame, **meta):
+        ok, buf = cv2.imencode('.png', frame,
+                               [cv2.IMWRITE_PNG_COMPRESSION, self.compression])
+        if not ok:
+            raise ValueError(f"Could not encode frame for position {position}")
+        with self._lock:
+            self._drop(position)
+            self._encoded[position] = buf.tobytes()
+            self._shapes[position] = frame.shape
+            self._meta[position] = meta
+            self._versions[position] = next(_versions)
+            self._cache(position, frame)
+            self._enforce_budget()
+            self._sample()
+
+    def get(self, position):
+        with self._lock:
+            if position in self._decoded:
+                self._decoded.move_to_end(position)
+                if position in self._encoded:
+                    self._encoded.move_to_end(position)
+                return self._decoded[position]
+            data = self.encoded(position)
+            if data is None:
+                return None
+            frame = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+            self._cache(position, frame)
+            self._enforce_budget()
+            self._sample()
+            return frame
+
+    def encoded(self, position):
+        # Raw PNG bytes for a position, without decoding
+        with self._lock:
+            if position in self._encoded:
+                self._encoded.move_to_end(position)
+                return self._encoded[position]
+            if position in self._spilled:
+                path, _ = self._spilled[position]
+                with open(path, 'rb') as f:
+                    return f.read()
+            return None
+
+    def shape(self, position):
+        return self._shapes.get(position)
+
+    def version(self, position):
+        return self._versions.get(position)
+
+    def metadata(self, position):
+        return dict(self._meta.get(position, {}))
+
+    def discard(self, position):
+        with self._lock:
+            found = position in self
+            self._drop(position)
+            return found
+
+    def clear(self):
+        with self._lock:
+            for position in list(self.keys()):
+                self._drop(position)
+
+    def close(self):
+        self.clear()
+        if self._spill_dir:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+
+    # Reporting
+
+    def footprint(self):
+        with self._lock:
+            encoded = sum(len(data) for data in self._encoded.values())
+            decoded = sum(frame.nbytes for frame in self._decoded.values())
+            spilled = sum(size for _, size in self._spilled.values())
+            return {
+                'encoded_bytes': encoded,
+                'decoded_bytes': decoded,
+                'resident_bytes': encoded + decoded,
+                'spilled_bytes': spilled,
+                'frames': len(self),
+                'cached_frames': len(self._decoded)
+            }
+
+    def report(self):
+        report = self.footprint()
+        report['budget_bytes'] = self.budget_bytes
+        report['peak_resident_bytes'] = self.peak_footprint
+        report['peak_rss_bytes'] = self.peak_rss
+        report['raw_bytes'] = sum(int(np.prod(s)) for s in self._shapes.values())
+        return report
+
+    # Internals
+
+    def _cache(self, position, frame):
+        self._decoded[position] = frame
+        self._decoded.move_to_end(position)
+        while len(self._decoded) > self.cache_size:
+            self._decoded.popitem(last=False)
+
+    def _drop(self, position):
+        self._encoded.pop(position, None)
+        self._decoded.pop(position, None)
+        self._shapes.pop(position, None)
+        self._meta.pop(position, None)
+        self._versions.pop(position, None)
+        spilled = self._spilled.pop(position, None)
+        if spilled:
+            try:
+                os.remove(spilled[0])
+            except OSError:
+                pass
+
+    def _resident(self):
+        return (sum(len(data) for data in self._encoded.values()) +
+                sum(frame.nbytes for frame in self._decoded.values()))
+
+    def _enforce_budget(self):
+        # Shed decoded frames first (keeping the most recent one), then
+        # spill the least recently used blobs to disk
+        while self._resident() > self.budget_bytes and len(self._decoded) > 1:
+            self._decoded.popitem(last=False)
+        while self._resident() > self.budget_bytes and len(self._encoded) > 1:
+            position, data = self._encoded.popitem(last=False)
+            self._spill(position, data)
+
+    def _spill(self, position, data):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix='gaze_spill_', dir=self._spill_root)
+        path = os.path.join(self._spill_dir, f"gaze_{position}.png")
+        with open(path, 'wb') as f:
+            f.write(data)
+        self._spilled[position] = (path, len(data))
+
+    def _sample(self):
+        self.peak_footprint = max(self.peak_footprint, self._resident())
+        self.peak_rss = max(self.peak_rss, current_rss())
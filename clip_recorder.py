@@ -0,0 +1,156 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+# ---------------- FRAME RING ---------------- #
+
+class FrameRing:
+    # Fixed number of preallocated frame slots; the oldest frame is
+    # overwritten once the ring is full, so pushing never allocates
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.frames = None
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.head = 0
+        self.count = 0
+    
+    def push(self, frame, timestamp):
+        if self.frames is None or self.frames.shape[1:] != frame.shape:
+            self.frames = np.empty((self.capacity,) + frame.shape, dtype=frame.dtype)
+            self.reset()
+        np.copyto(self.frames[self.head], frame)
+        self.times[self.head] = timestamp
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+    
+    def reset(self):
+        self.head = 0
+        self.count = 0
+    
+    def ordered(self):
+        # Slot indices from oldest to newest
+        return [(self.head - self.count + i) % self.capacity for i in range(self.count)]
+    
+    @property
+    def nbytes(self):
+        return 0 if self.frames is None else self.frames.nbytes
+
+# ---------------- CLIP RECORDER ---------------- #
+
+class ClipRecorder:
+    # Keeps the last `seconds` of preview frames. trigger() marks a capture;
+    # `post_seconds` later the ring is handed to a background encoder and
+    # recording continues into a second ring. The two rings together never
+    # exceed max_bytes. Clips are encoded on `pool` when given, otherwise
+    # on a thread of their own.
+    
+    def __init__(self, seconds=3, post_seconds=1, max_bytes=96 * 1024 * 1024,
+                 scale=0.5, fps=30, fourcc='mp4v', pool=None):
+        self.seconds = seconds
+        self.post_seconds = post_seconds
+        self.max_bytes = max_bytes
+        self.scale = scale
+        self.fps = fps
+        self.fourcc = fourcc
+        self.pool = pool
+        self.capacity = None
+        self._ring = None
+        self._spare = None
+        self._pending = None
+        self._encoding = None
+        self._lock = threading.Lock()
+        self.clips_saved = 0
+        self.triggers_dropped = 0
+        self.last_clip = None
+        self.encode_seconds = 0.0
+        self.encoded_frames = 0
+    
+    def push(self, frame):
+        now = time.monotonic()
+        if self.scale != 1:
+            frame = cv2.resize(frame, None, fx=self.scale, fy=self.scale,
+                               interpolation=cv2.INTER_AREA)
+        if self._ring is None:
+            frame_bytes = frame.nbytes
+            by_time = max(1, int(self.seconds * self.fps))
+            by_memory = max(1, self.max_bytes // (2 * frame_bytes))
+            self.capacity = min(by_time, by_memory)
+            self._ring = FrameRing(self.capacity)
+        self._ring.push(frame, now)
+        
+        if self._pending and now >= self._pending[1]:
+            self._freeze()
+    
+    def trigger(self, path):
+        # Returns False when the previous clip is still being encoded
+        with self._lock:
+            busy = self._encoding is not None
+        if busy or self._pending or self._ring is None:
+            self.triggers_dropped += 1
+            return False
+        self._pending = (path, time.monotonic() + self.post_seconds)
+        return True
+    
+    def flush(self):
+        if self._pending:
+            self._freeze()
+    
+    def _freeze(self):
+        path, _ = self._pending
+        self._pending = None
+        ring = self._ring
+        if ring.count == 0:
+            return
+        self._ring = self._spare or FrameRing(self.capacity)
+        self._spare = None
+        self._ring.reset()
+        with self._lock:
+            self._encoding = ring
+        if self.pool:
+            self.pool.submit(self._encode, ring, path)
+        else:
+            threading.Thread(target=self._encode, args=(ring, path)).start()
+    
+    def _encode(self, ring, path):
+        started = time.perf_counter()
+        order = ring.ordered()
+        frames = 0
+        try:
+            span = ring.times[order[-1]] - ring.times[order[0]]
+            fps = (len(order) - 1) / span if span > 0 else self.fps
+            h, w = ring.frames.shape[1:3]
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.fourcc), fps, (w, h))
+            try:
+                for index in order:
+                    writer.write(ring.frames[index])
+                    frames += 1
+            finally:
+                writer.release()
+        except Exception:
+            path = None
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self._encoding = None
+            self._spare = ring
+            self.encode_seconds += elapsed
+            self.encoded_frames += frames
+            if path:
+                self.clips_saved += 1
+                self.last_clip = path
+    
+    def stats(self):
+        with self._lock:
+            rings = (self._ring, self._spare, self._encoding)
+            resident = sum(r.nbytes for r in rings if r is not None)
+            return {
+                'capacity_frames': self.capacity or 0,
+                'buffered_frames': self._ring.count if self._ring else 0,
+                'resident_bytes': resident,
+                'max_bytes': self.max_bytes,
+                'clips_saved': self.clips_saved,
+                'triggers_dropped': self.triggers_dropped,
+                'encoding': self._encoding is not None,
+                'encode_fps': self.encoded_frames / self.encode_seconds if self.encode_seconds else 0.0
+            }
@@ -0,0 +1,383 @@
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# ---------------- COLLAGE LAYOUT ---------------- #
+
+# (column, row) of each gaze position in the 3x3 collage grid
+COLLAGE_GRID = {
+    1: (1, 0),  # Top middle
+    2: (2, 0),  # Top right
+    3: (2, 1),  # Middle right
+    4: (2, 2),  # Bottom right
+    5: (1, 2),  # Bottom middle
+    6: (0, 2),  # Bottom left
+    7: (0, 1),  # Middle left
+    8: (0, 0),  # Top left
+    9: (1, 1)   # Center
+}
+
+COLLAGE_CELL = (300, 300)
+
+def cell_rect(gaze_pos, cell_size=COLLAGE_CELL):
+    cw, ch = cell_size
+    col, row = COLLAGE_GRID[gaze_pos]
+    return col * cw, row * ch, (col + 1) * cw, (row + 1) * ch
+
+def native_cell_size(images):
+    # Largest frame size among the captures, so no tile is downscaled
+    h = max(images[pos].shape[0] for pos in COLLAGE_GRID)
+    w = max(images[pos].shape[1] for pos in COLLAGE_GRID)
+    return w, h
+
+# ---------------- TILES ---------------- #
+
+def render_tiles(images, cell_size=COLLAGE_CELL):
+    # The bare 3x3 canvas, without any annotation
+    cw, ch = cell_size
+    canvas = np.zeros((3 * ch, 3 * cw, 3), dtype=np.uint8)
+    
+    for gaze_pos in COLLAGE_GRID:
+        x1, y1, x2, y2 = cell_rect(gaze_pos, cell_size)
+        img = images[gaze_pos]
+        if img.shape[1] != cw or img.shape[0] != ch:
+            img = cv2.resize(img, (cw, ch))
+        canvas[y1:y2, x1:x2] = img
+    
+    return canvas
+
+def render_tile(canvas, gaze_pos, image, cell_size=COLLAGE_CELL):
+    # Replace a single tile in place, e.g. after a retake
+    cw, ch = cell_size
+    x1, y1, x2, y2 = cell_rect(gaze_pos, cell_size)
+    if image.shape[1] != cw or image.shape[0] != ch:
+        image = cv2.resize(image, (cw, ch))
+    canvas[y1:y2, x1:x2] = image
+    return canvas
+
+# ---------------- OVERLAY LAYERS ---------------- #
+
+# Gaze direction of each position, as drawn by the arrows layer
+GAZE_VECTORS = {
+    1: (0, 0), 2: (1, -1), 3: (1, 0), 4: (1, 1), 5: (0, 1),
+    6: (-1, 1), 7: (-1, 0), 8: (-1, -1), 9: (0, -1)
+}
+
+OVERLAY_COLORS = {
+    'grid': (255, 255, 255),
+    'arrows': (0, 255, 255),
+    'timestamp': (255, 255, 255),
+    'patient': (255, 255, 255),
+    'header': (255, 255, 255),
+    'positions': (0, 0, 255)
+}
+
+# Drawing order, bottom to top
+OVERLAY_ORDER = ['grid', 'arrows', 'timestamp', 'patient', 'header', 'positions']
+
+def _draw_grid(mask, cw, ch, scale):
+    thickness = max(1, int(2 * scale))
+    for i in (1, 2):
+        cv2.line(mask, (i * cw, 0), (i * cw, 3 * ch), 255, thickness)
+        cv2.line(mask, (0, i * ch), (3 * cw, i * ch), 255, thickness)
+
+def _draw_arrows(mask, cw, ch, scale):
+    length = int(40 * scale)
+    thickness = max(1, int(3 * scale))
+    for gaze_pos, (dx, dy) in GAZE_VECTORS.items():
+        x1, y1, x2, y2 = cell_rect(gaze_pos, (cw, ch))
+        cx, cy = x2 - int(40 * scale), y2 - int(40 * scale)
+        if (dx, dy) == (0, 0):
+            cv2.circle(mask, (cx, cy), int(10 * scale), 255, thickness, cv2.LINE_AA)
+            continue
+        norm = (dx * dx + dy * dy) ** 0.5
+        tip = (int(cx + dx / norm * length / 2), int(cy + dy / norm * length / 2))
+        tail = (int(cx - dx / norm * length / 2), int(cy - dy / norm * length / 2))
+        cv2.arrowedLine(mask, tail, tip, 255, thickness, cv2.LINE_AA, tipLength=0.4)
+
+def _draw_timestamp(mask, cw, ch, scale, text):
+    cv2.putText(mask, text, (int(10 * scale), 3 * ch - int(10 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, scale, 255, max(1, int(2 * scale)))
+
+def _draw_patient(mask, cw, ch, scale, text):
+    cv2.putText(mask, text, (int(10 * scale), 3 * ch - int(45 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, scale, 255, max(1, int(2 * scale)))
+
+def _draw_header(mask, cw, ch, scale, text):
+    font_scale = 0.8 * scale
+    thickness = max(1, int(2 * scale))
+    (w, _), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, font_scale, thickness)
+    cv2.putText(mask, text, (3 * cw - w - int(10 * scale), 3 * ch - int(10 * scale)),
+                cv2.FONT_HERSHEY_SIMPLEX, font_scale, 255, thickness, cv2.LINE_AA)
+
+def _draw_positions(mask, cw, ch, scale):
+    for gaze_pos in sorted(COLLAGE_GRID):
+        x1, y1, _, _ = cell_rect(gaze_pos, (cw, ch))
+        cv2.putText(mask, str(gaze_pos), (x1 + cw // 2, y1 + ch // 6),
+                    cv2.FONT_HERSHEY_SIMPLEX, 2 * scale, 255, max(1, int(3 * scale)))
+
+_DRAWERS = {
+    'grid': _draw_grid,
+    'arrows': _draw_arrows,
+    'timestamp': _draw_timestamp,
+    'patient': _draw_patient,
+    'header': _draw_header,
+    'positions': _draw_positions
+}
+
+class OverlayCache:
+    # Each annotation layer is rendered once per layout into an alpha mask.
+    # The enabled layers are merged into one colour + alpha pair (also
+    # cached) and blended over the tiles in a single vectorized pass, so
+    # toggling a layer never re-renders tiles or other layers. The timestamp
+    # differs for every exam, so merged entries (3 MB each at full size) are
+    # kept only for the last few layouts.
+    
+    def __init__(self, max_layers=16, max_merged=4):
+        self.max_layers = max_layers
+        self.max_merged = max_merged
+        self._layers = OrderedDict()
+        self._merged = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _cached(self, cache, key, build, limit):
+        with self._lock:
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+        value = build()
+        with self._lock:
+            cache[key] = value
+            while len(cache) > limit:
+                cache.popitem(last=False)
+        return value
+    
+    def layer(self, name, cell_size, text=None):
+        def build():
+            cw, ch = cell_size
+            mask = np.zeros((3 * ch, 3 * cw), dtype=np.uint8)
+            scale = ch / COLLAGE_CELL[1]
+            if text is None:
+                _DRAWERS[name](mask, cw, ch, scale)
+            else:
+                _DRAWERS[name](mask, cw, ch, scale, text)
+            return mask
+        return self._cached(self._layers, (name, cell_size, text), build, self.max_layers)
+    
+    def merged(self, layers, cell_size):
+        # layers: ordered list of (name, text) pairs
+        def build():
+            cw, ch = cell_size
+            color = np.zeros((3 * ch, 3 * cw, 3), dtype=np.uint8)
+            alpha = np.zeros((3 * ch, 3 * cw), dtype=np.uint8)
+            for name, text in layers:
+                mask = self.layer(name, cell_size, text)
+                drawn = mask > 0
+                color[drawn] = OVERLAY_COLORS[name]
+                np.maximum(alpha, mask, out=alpha)
+            return color, alpha
+        return self._cached(self._merged, (tuple(layers), cell_size), build, self.max_merged)
+    
+    def composite(self, canvas, layers, cell_size):
+        if not layers:
+            return canvas.copy()
+        color, alpha = self.merged(layers, cell_size)
+        a = alpha[..., None].astype(np.uint16)
+        blended = (canvas.astype(np.uint16) * (255 - a) + color.astype(np.uint16) * a + 127) // 255
+        return blended.astype(np.uint8)
+
+overlay_cache = OverlayCache()
+
+def overlay_layers(show_positions=True, timestamp=None, show_timestamp=True, header=None,
+                   patient_id=None, show_grid=False, show_arrows=False):
+    # Ordered (name, text) list describing the enabled annotation layers
+    enabled = {
+        'grid': (show_grid, None),
+        'arrows': (show_arrows, None),
+        'timestamp': (show_timestamp and timestamp, timestamp),
+        'patient': (bool(patient_id), f"ID: {patient_id}" if patient_id else None),
+        'header': (bool(header), header),
+        'positions': (show_positions, None)
+    }
+    return [(name, enabled[name][1]) for name in OVERLAY_ORDER if enabled[name][0]]
+
+def overlay_settings(settings, timestamp, patient_id=None):
+    # Layer list for the app settings dict
+    return overlay_layers(
+        show_positions=settings.get('show_positions', True),
+        timestamp=timestamp,
+        show_timestamp=settings.get('show_timestamp', True),
+        header=settings.get('header_text', '') if settings.get('show_header', False) else None,
+        patient_id=patient_id,
+        show_grid=settings.get('show_grid', False),
+        show_arrows=settings.get('show_arrows', False)
+    )
+
+# Settings that change how a collage looks; anything else (drive link,
+# brightness, queue mode...) does not invalidate a rendered collage
+LAYOUT_SETTINGS = {
+    'show_positions': True,
+    'show_timestamp': True,
+    'show_header': False,
+    'header_text': '',
+    'show_grid': False,
+    'show_arrows': False
+}
+
+def layout_hash(settings):
+    layout = {key: settings.get(key, default) for key, default in LAYOUT_SETTINGS.items()}
+    if not layout['show_header']:
+        # A hidden header's text does not change the collage
+        del layout['header_text']
+    layout['cell'] = list(COLLAGE_CELL)
+    return hashlib.sha1(json.dumps(layout, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+# ---------------- RENDER CACHE ---------------- #
+
+def frame_digest(images, position):
+    # Content hash of one capture: the PNG blob when the store keeps one,
+    # else the pixels and shape
+    data = images.encoded(position) if hasattr(images, 'encoded') else None
+    digest = hashlib.blake2b(digest_size=16)
+    if data is None:
+        frame = np.ascontiguousarray(images[position])
+        digest.update(repr(frame.shape).encode('ascii'))
+        data = memoryview(frame).cast('B')
+    digest.update(data)
+    return digest.hexdigest()
+
+class RenderCache:
+    # Tile canvases and finished collages keyed by the content hash of the
+    # nine frames (plus cell size, normalization and overlay layers), so an
+    # unchanged exam is never rendered twice. A tile canvas that misses is
+    # built from the cached canvas sharing the most frames, re-rendering only
+    # the tiles that differ: a retake costs one tile. Digests of CaptureStore
+    # frames are memoized by capture version. Entries are evicted least
+    # recently used once they exceed `max_bytes`; cached arrays are
+    # read-only, copy them before drawing.
+    
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_digests=64):
+        self.max_bytes = max_bytes
+        self.max_digests = max_digests
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.tiles_rendered = 0
+        self._entries = OrderedDict()
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def key(self, images):
+        # Digests of the nine frames in position order
+        versioned = hasattr(images, 'version')
+        digests = []
+        for position in sorted(COLLAGE_GRID):
+            version = images.version(position) if versioned else None
+            with self._lock:
+                digest = self._digests.get(version) if version is not None else None
+            if digest is None:
+                digest = frame_digest(images, position)
+                if version is not None:
+                    with self._lock:
+                        self._digests[version] = digest
+                        while len(self._digests) > self.max_digests:
+                            self._digests.popitem(last=False)
+            digests.append(digest)
+        return tuple(digests)
+    
+    def _get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def _put(self, key, value):
+        value.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+            self._entries[key] = value
+            self.nbytes += value.nbytes
+            while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return value
+    
+    def _nearest(self, cell_size, digests):
+        # Cached bare canvas of the same size sharing the most frames
+        best, shared = None, 0
+        with self._lock:
+            for key, canvas in self._entries.items():
+                if key[:3] != ('tiles', cell_size, False):
+                    continue
+                same = sum(a == b for a, b in zip(key[3], digests))
+                if same > shared:
+                    best, shared = (key[3], canvas), same
+        return best
+    
+    def tiles(self, images, cell_size=COLLAGE_CELL, normalize=None, key=None):
+        # normalize: optional in-place pass over the canvas, e.g.
+        # PhotometricNormalizer.apply bound to the store
+        key = key or self.key(images)
+        entry = ('tiles', cell_size, normalize is not None, key)
+        canvas = self._get(entry)
+        if canvas is not None:
+            return canvas
+        if normalize is not None:
+            canvas = self.tiles(images, cell_size, key=key).copy()
+            normalize(canvas, cell_size)
+            return self._put(entry, canvas)
+        nearest = self._nearest(cell_size, key)
+        if nearest is None:
+            canvas = render_tiles(images, cell_size)
+            rendered = len(COLLAGE_GRID)
+        else:
+            digests, base = nearest
+            canvas = base.copy()
+            changed = [position for position, a, b in zip(sorted(COLLAGE_GRID), digests, key) if a != b]
+            for position in changed:
+                render_tile(canvas, position, images[position], cell_size)
+            rendered = len(changed)
+        with self._lock:
+            self.tiles_rendered += rendered
+        return self._put(entry, canvas)
+    
+    def collage(self, images, layers, cell_size=COLLAGE_CELL, normalize=None, key=None):
+        key = key or self.key(images)
+        entry = ('collage', cell_size, normalize is not None, tuple(layers), key)
+        collage = self._get(entry)
+        if collage is not None:
+            return collage
+        tiles = self.tiles(images, cell_size, normalize, key)
+        return self._put(entry, overlay_cache.composite(tiles, layers, cell_size))
+    
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.nbytes, 'hits': self.hits,
+                    'misses': self.misses, 'tiles_rendered': self.tiles_rendered}
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+render_cache = RenderCache()
+
+# ---------------- RENDERING ---------------- #
+
+def render_collage(images, cell_size=COLLAGE_CELL, show_positions=True, timestamp=None,
+                   layers=None):
+    if timestamp is None:
+        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if layers is None:
+        layers = overlay_layers(show_positions=show_positions, timestamp=timestamp)
+    return overlay_cache.composite(render_tiles(images, cell_size), layers, cell_size)
@@ -0,0 +1,383 @@
+import hmac
+import itertools
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import cv2
+import numpy as np
+
+from collage import COLLAGE_CELL, render_tiles, overlay_cache, overlay_settings
+from exam_file import ExamReader, encode_exam, EXAM_EXTENSION
+from photometric import PhotometricNormalizer
+from registration import Registrar
+from storage_manager import StorageManager
+
+DEFAULT_PORT = 8765
+TOKEN_HEADER = 'X-Gaze-Token'
+
+# ---------------- EXAM FRAMES ---------------- #
+
+_exam_versions = itertools.count(1)
+
+class ExamFrames:
+    # Read-only, store-like view of an uploaded exam, so the Registrar can
+    # align it exactly as it aligns a live CaptureStore
+    
+    def __init__(self, reader):
+        self.reader = reader
+        self._frames = {}
+        self._version = next(_exam_versions)
+    
+    def keys(self):
+        return self.reader.positions
+    
+    def __len__(self):
+        return len(self.reader.positions)
+    
+    def __iter__(self):
+        return iter(self.keys())
+    
+    def __getitem__(self, position):
+        if position not in self._frames:
+            self._frames[position] = self.reader.frame(position)
+        return self._frames[position]
+    
+    def version(self, position):
+        # Unique per upload, so cached registrations never leak across exams
+        return (self._version, position)
+
+# ---------------- RENDER SERVICE ---------------- #
+
+class CollageService:
+    # Renders and exports uploaded exams on a bounded worker pool. At most
+    # `max_queue` jobs may be waiting; beyond that uploads are refused so a
+    # busy workstation pushes back instead of piling up work. The stored
+    # exams and collages get the same retention as the tablet's own.
+    
+    def __init__(self, out_dir=None, max_workers=2, max_queue=16, keep_jobs=200,
+                 quota_bytes=8 * 1024 ** 3, archive_after_days=30):
+        self.out_dir = out_dir or os.path.join(os.getcwd(), 'served')
+        os.makedirs(self.out_dir, exist_ok=True)
+        self.storage = StorageManager(self.out_dir, quota_bytes=quota_bytes,
+                                      archive_after_days=archive_after_days, protected=self.unfinished)
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.keep_jobs = keep_jobs
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='collage-service')
+        # Jobs share one Registrar, which keeps results per exam
+        self.align_pool = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 2),
+                                             thread_name_prefix='collage-align')
+        self.registrar = Registrar(pool=self.align_pool)
+        self.normalizer = PhotometricNormalizer()
+        self.jobs = {}
+        self.started = time.time()
+        self._ids = itertools.count(1)
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._completed = deque(maxlen=500)
+        self._counts = {'accepted': 0, 'rejected': 0, 'done': 0, 'failed': 0}
+        self._lock = threading.Lock()
+    
+    def submit(self, data, timestamp=None, settings=None):
+        # Returns the job, or None when the queue is full
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._counts['rejected'] += 1
+            return None
+        job_id = next(self._ids)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        job = {'id': job_id, 'status': 'queued', 'submitted': time.time(), 'timestamp': timestamp,
+               'settings': settings, 'exam': os.path.join(self.out_dir, f"gaze_exam_{stamp}_{job_id}{EXAM_EXTENSION}"),
+               'collage': None, 'aligned': None, 'error': None, 'done': threading.Event()}
+        try:
+            with open(job['exam'], 'wb') as f:
+                f.write(data)
+        except Exception:
+            self._slots.release()
+            raise
+        with self._lock:
+            self.jobs[job_id] = job
+            self._counts['accepted'] += 1
+            for old in sorted(self.jobs)[:-self.keep_jobs]:
+                if self.jobs[old]['done'].is_set():
+                    del self.jobs[old]
+        self.pool.submit(self._process, job)
+        return job
+    
+    def _process(self, job):
+        job['started'] = time.time()
+        job['status'] = 'rendering'
+        try:
+            self._render(job)
+            job['status'] = 'done'
+        except Exception as e:
+            job['status'] = 'failed'
+            job['error'] = str(e)
+        finally:
+            job['finished'] = time.time()
+            with self._lock:
+                self._counts[job['status']] += 1
+                if job['status'] == 'done':
+                    self._completed.append((job['finished'], job['started'] - job['submitted'],
+                                            job['finished'] - job['started']))
+            self._slots.release()
+            job['done'].set()
+    
+    def _render(self, job):
+        with ExamReader(job['exam']) as reader:
+            settings = dict(reader.settings, **(job['settings'] or {}))
+            frames = ExamFrames(reader)
+            if len(frames) != 9:
+                raise ValueError(f"expected 9 frames, got {len(frames)}")
+            images = frames
+            if settings.get('align_images', False):
+                finished = threading.Event()
+                self.registrar.submit(frames, on_done=finished.set)
+                finished.wait(timeout=30)
+                images = self.registrar.aligned_images(frames)
+                job['aligned'] = images is not None
+                if images is None:
+                    # Never hand back an unaligned collage as aligned
+                    raise TimeoutError("alignment did not finish within 30 s")
+            timestamp = job['timestamp'] or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            tiles = render_tiles(images)
+            if settings.get('normalize_tiles', False):
+                self.normalizer.apply(tiles, frames, COLLAGE_CELL)
+            collage = overlay_cache.composite(tiles, overlay_settings(settings, timestamp), COLLAGE_CELL)
+        ok, buf = cv2.imencode('.jpg', collage, [cv2.IMWRITE_JPEG_QUALITY, 95])
+        if not ok:
+            raise ValueError("could not encode collage")
+        job['collage'] = job['exam'].replace('gaze_exam_', 'gaze_collage_').replace(EXAM_EXTENSION, '.jpg')
+        with open(job['collage'], 'wb') as f:
+            f.write(buf.tobytes())
+    
+    def unfinished(self):
+        # Exams still waiting to render are never archived under a job
+        with self._lock:
+            return {job['exam'] for job in self.jobs.values() if not job['done'].is_set()}
+    
+    def describe(self, job):
+        return {key: job.get(key) for key in ('id', 'status', 'error', 'aligned', 'submitted', 'started',
+                                              'finished')}
+    
+    def metrics(self):
+        now = time.time()
+        with self._lock:
+            active = sum(1 for job in self.jobs.values() if job['status'] == 'rendering')
+            queued = sum(1 for job in self.jobs.values() if job['status'] == 'queued')
+            recent = [c for c in self._completed if now - c[0] <= 60]
+            waits = [c[1] for c in self._completed]
+            renders = [c[2] for c in self._completed]
+            return dict(
+                self._counts,
+                active=active,
+                queued=queued,
+                workers=self.max_workers,
+                max_queue=self.max_queue,
+                exams_per_minute=len(recent),
+                mean_wait_ms=round(1000 * sum(waits) / len(waits), 1) if waits else None,
+                mean_render_ms=round(1000 * sum(renders) / len(renders), 1) if renders else None,
+                uptime_s=round(now - self.started, 1)
+            )
+    
+    def shutdown(self):
+        self.storage.stop()
+        self.pool.shutdown(wait=True)
+        self.align_pool.shutdown(wait=False)
+
+# ---------------- HTTP API ---------------- #
+#
+#   Every request carries the shared token in an X-Gaze-Token header;
+#   anything else gets 401.
+#
+#   POST /exams[?wait=1]   body: .ngx exam; headers X-Collage-Timestamp and
+#                          X-Collage-Settings (JSON) are optional.
+#                          202 {job} or, with wait=1, 200 image/jpeg
+#   GET  /exams/<id>       job status
+#   GET  /exams/<id>/collage
+#   GET  /metrics
+#   GET  /health
+
+class CollageRequestHandler(BaseHTTPRequestHandler):
+    service = None
+    token = None
+    # Nine full-resolution PNG frames plus thumbnails come to ~40 MB
+    max_body = 64 * 1024 * 1024
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def _send(self, status, body, content_type='application/json', headers=None):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _authorized(self):
+        supplied = self.headers.get(TOKEN_HEADER) or ''
+        if self.token and hmac.compare_digest(supplied.encode('utf-8'), self.token.encode('utf-8')):
+            return True
+        self._send(401, {'error': 'missing or wrong token'})
+        return False
+    
+    def _send_collage(self, job):
+        with open(job['collage'], 'rb') as f:
+            self._send(200, f.read(), 'image/jpeg', {'X-Job-Id': str(job['id'])})
+    
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts = [p for p in urlparse(self.path).path.split('/') if p]
+        if parts == ['health']:
+            return self._send(200, {'ok': True})
+        if parts == ['metrics']:
+            return self._send(200, self.service.metrics())
+        if len(parts) >= 2 and parts[0] == 'exams' and parts[1].isdigit():
+            job = self.service.jobs.get(int(parts[1]))
+            if job is None:
+                return self._send(404, {'error': 'unknown job'})
+            if parts[2:] == ['collage']:
+                if job['status'] != 'done':
+                    return self._send(409, self.service.describe(job))
+                return self._send_collage(job)
+            if not parts[2:]:
+                return self._send(200, self.service.describe(job))
+        self._send(404, {'error': 'not found'})
+    
+    def do_POST(self):
+        if not self._authorized():
+            return
+        url = urlparse(self.path)
+        if url.path.rstrip('/') != '/exams':
+            return self._send(404, {'error': 'not found'})
+        length = int(self.headers.get('Content-Length') or 0)
+        if not 0 < length <= self.max_body:
+            return self._send(413 if length else 411, {'error': 'bad body length'})
+        data = self.rfile.read(length)
+        try:
+            settings = json.loads(self.headers.get('X-Collage-Settings') or 'null')
+        except ValueError:
+            return self._send(400, {'error': 'bad settings header'})
+        try:
+            job = self.service.submit(data, self.headers.get('X-Collage-Timestamp'), settings)
+        except OSError as e:
+            return self._send(507, {'error': f"could not store exam: {e}"})
+        if job is None:
+            return self._send(503, {'error': 'queue full'}, headers={'Retry-After': '2'})
+        if parse_qs(url.query).get('wait') == ['1']:
+            job['done'].wait()
+            if job['status'] != 'done':
+                return self._send(422, self.service.describe(job))
+            return self._send_collage(job)
+        self._send(202, self.service.describe(job))
+
+def serve(token, host='127.0.0.1', port=DEFAULT_PORT, out_dir=None, max_workers=2, max_queue=16,
+          quota_bytes=8 * 1024 ** 3):
+    # Listens on loopback unless a host is given, e.g. '0.0.0.0' to take
+    # uploads from tablets on the clinic network
+    if not token:
+        raise ValueError("a shared token is required")
+    service = CollageService(out_dir, max_workers=max_workers, max_queue=max_queue,
+                             quota_bytes=quota_bytes)
+    handler = type('Handler', (CollageRequestHandler,), {'service': service, 'token': token})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    service.storage.start()
+    return server, service
+
+# ---------------- CLIENT ---------------- #
+
+class CollageClient:
+    # Used by the tablet app to offload collage rendering. available() is
+    # cached briefly so a missing server costs one short probe, not one per
+    # exam.
+    
+    def __init__(self, base_url, token, timeout=30, probe_timeout=0.5, probe_interval=30):
+        self.base_url = base_url.rstrip('/')
+        self.token = token
+        self.timeout = timeout
+        self.probe_timeout = probe_timeout
+        self.probe_interval = probe_interval
+        self._probe = (0.0, False)
+    
+    def available(self):
+        checked, ok = self._probe
+        if time.monotonic() - checked < self.probe_interval:
+            return ok
+        request = urllib.request.Request(f"{self.base_url}/health", headers={TOKEN_HEADER: self.token})
+        try:
+            with urllib.request.urlopen(request, timeout=self.probe_timeout) as r:
+                ok = r.status == 200
+        except (OSError, urllib.error.URLError, ValueError):
+            ok = False
+        self._probe = (time.monotonic(), ok)
+        return ok
+    
+    def render(self, frames, settings=None, timestamp=None):
+        # Uploads the exam and returns the rendered collage (BGR ndarray)
+        body = encode_exam(frames, settings=settings)
+        headers = {'Content-Type': 'application/octet-stream', TOKEN_HEADER: self.token,
+                   'X-Collage-Settings': json.dumps(dict(settings or {}))}
+        if timestamp:
+            headers['X-Collage-Timestamp'] = timestamp
+        request = urllib.request.Request(f"{self.base_url}/exams?wait=1", data=body,
+                                         headers=headers, method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as r:
+                data = r.read()
+        except (OSError, urllib.error.URLError):
+            self._probe = (time.monotonic(), False)
+            raise
+        collage = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+        if collage is None:
+            raise ValueError("server returned no image")
+        return collage
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    options = {'--host': '127.0.0.1', '--port': DEFAULT_PORT, '--workers': 2, '--queue': 16, '--out': None,
+               '--token': os.environ.get('GAZE_SERVER_TOKEN'), '--quota-mb': 8192}
+    args = iter(argv)
+    for arg in args:
+        if arg not in options:
+            print("usage: collage_server.py [--host ADDR] [--port N] [--token T] [--workers N] "
+                  "[--queue N] [--out DIR] [--quota-mb N]")
+            return 2
+        options[arg] = next(args)
+    token = options['--token'] or secrets.token_urlsafe(16)
+    server, service = serve(token, host=options['--host'], port=int(options['--port']),
+                            out_dir=options['--out'], max_workers=int(options['--workers']),
+                            max_queue=int(options['--queue']),
+                            quota_bytes=int(options['--quota-mb']) * 1024 * 1024)
+    host, port = server.server_address[:2]
+    print(f"collage server listening on {host}:{port}, writing to {service.out_dir}")
+    if not options['--token']:
+        print(f"token: {token}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import gc
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from capture_store import current_rss
+
+# ---------------- LIVE OBJECT COUNTS ---------------- #
+
+def count_live_objects():
+    # Textures, widgets, dialogs and numpy buffers reachable from tracked
+    # objects. ndarrays are not tracked by the gc, so they are found as
+    # referents of the containers that are.
+    gc.collect()
+    counts = {'textures': 0, 'widgets': 0, 'dialogs': 0, 'arrays': 0, 'array_bytes': 0}
+    objects = gc.get_objects()
+    for obj in objects:
+        mro = {cls.__name__ for cls in type(obj).__mro__}
+        if 'Texture' in mro:
+            counts['textures'] += 1
+        elif 'Widget' in mro:
+            counts['widgets'] += 1
+            if 'MDDialog' in mro:
+                counts['dialogs'] += 1
+    seen = set()
+    for obj in gc.get_referents(*objects):
+        if isinstance(obj, np.ndarray) and id(obj) not in seen:
+            seen.add(id(obj))
+            counts['arrays'] += 1
+            if obj.base is None:
+                counts['array_bytes'] += obj.nbytes
+    return counts
+
+# ---------------- LEAK PROFILER ---------------- #
+
+class LeakProfiler:
+    # Records tracemalloc usage, RSS and live object counts at checkpoints
+    # (screen transitions, end of each exam). Growth per exam is the slope
+    # of each metric over the end-of-exam checkpoints after a warm-up (caches
+    # filling up to their bounds), so a steady leak shows up however noisy
+    # single exams are.
+    
+    def __init__(self, frames=25, top=15, warmup=1):
+        self.frames = frames
+        self.warmup = warmup
+        self.top = top
+        self.checkpoints = []
+        self._baseline = None
+        self._latest = None
+        self._lock = threading.Lock()
+    
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self.checkpoint('start')
+    
+    def stop(self):
+        tracemalloc.stop()
+    
+    def checkpoint(self, label, exam=None):
+        counts = count_live_objects()
+        current, peak = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>')
+        ])
+        record = dict(counts, label=label, exam=exam, time=round(time.time(), 3),
+                      traced_bytes=current, traced_peak=peak, rss_bytes=current_rss())
+        with self._lock:
+            self.checkpoints.append(record)
+            if self._baseline is None or exam == self.warmup:
+                self._baseline = snapshot
+            self._latest = snapshot
+        return record
+    
+    def growth_per_exam(self):
+        exams = [c for c in self.checkpoints
+                 if c['label'] == 'exam_end' and (c['exam'] or 0) >= self.warmup]
+        if len(exams) < 3:
+            return {}
+        x = np.array([c['exam'] for c in exams], dtype=np.float64)
+        growth = {}
+        for key in ('traced_bytes', 'rss_bytes', 'textures', 'widgets', 'dialogs',
+                    'arrays', 'array_bytes'):
+            y = np.array([c[key] for c in exams], dtype=np.float64)
+            growth[key] = round(float(np.polyfit(x, y, 1)[0]), 1)
+        return growth
+    
+    def top_growth(self):
+        if self._baseline is None or self._latest is None:
+            return []
+        stats = self._latest.compare_to(self._baseline, 'lineno')
+        rows = []
+        for stat in stats[:self.top]:
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            rows.append({'where': f"{frame.filename}:{frame.lineno}",
+                         'size_diff': stat.size_diff, 'count_diff': stat.count_diff})
+        return rows
+    
+    def report(self):
+        exams = max((c['exam'] or 0) for c in self.checkpoints) if self.checkpoints else 0
+        return {
+            'exams': exams,
+            'warmup': self.warmup,
+            'growth_per_exam': self.growth_per_exam(),
+            'top_growth': self.top_growth(),
+            'checkpoints': self.checkpoints
+        }
+    
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.report(), f, indent=1)
+        return path
+
+def format_report(report):
+    lines = [f"Exams: {report['exams']}", f"Growth per exam after {report['warmup']}:"]
+    for key, value in report['growth_per_exam'].items():
+        lines.append(f"  {key:>12}: {value:+,.1f}")
+    lines.append("Largest allocation growth since then:")
+    for row in report['top_growth']:
+        lines.append(f"  {row['size_diff']:>+10,} B {row['count_diff']:>+6}  {row['where']}")
+    return '\n'.join(lines)
+
+# ---------------- HEADLESS SOAK ---------------- #
+
+def soak(exams=20, profiler=None, out_dir=None):
+    # Runs the non-GUI exam pipeline (capture store, registration, reflex
+    # analysis, collage, exam file) on synthetic frames, checkpointing after
+    # every exam. The GUI soak in 9gaze_3.py drives the screens the same way.
+    from capture_store import CaptureStore
+    from collage import COLLAGE_CELL, render_tiles, overlay_cache, overlay_layers
+    from exam_file import write_exam
+    from exposure import SimulatedCamera
+    from reflex_analysis import ReflexAnalyser
+    from registration import Registrar
+    
+    profiler = profiler or LeakProfiler(warmup=max(1, exams // 2))
+    # Exam files written to a directory of our own are removed afterwards
+    own_dir = out_dir is None
+    out_dir = out_dir or tempfile.mkdtemp(prefix='gaze_soak_')
+    camera = SimulatedCamera()
+    registrar = Registrar()
+    analyser = ReflexAnalyser()
+    profiler.start()
+    try:
+        for exam in range(1, exams + 1):
+            store = CaptureStore()
+            for position in range(1, 10):
+                _, frame = camera.read()
+                store.put(position, frame, captured_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+                analyser.submit(store, position)
+            done = threading.Event()
+            registrar.submit(store, on_done=done.set)
+            done.wait(30)
+            images = registrar.aligned_images(store) or store
+            tiles = render_tiles(images)
+            collage = overlay_cache.composite(tiles, overlay_layers(timestamp=f"exam {exam}"),
+                                              COLLAGE_CELL)
+            write_exam(os.path.join(out_dir, f"gaze_exam_soak_{exam}.ngx"), store, collage=collage)
+            store.close()
+            profiler.checkpoint('exam_end', exam)
+    finally:
+        registrar.shutdown()
+        analyser.shutdown()
+        profiler.stop()
+        if own_dir:
+            shutil.rmtree(out_dir, ignore_errors=True)
+    return profiler.report()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    exams = int(argv[0]) if argv else 20
+    report = soak(exams)
+    print(format_report(report))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# Single-file exam container (.ngx)
+#
+#   MAGIC (4s) | VERSION (H) | HEADER_LEN (I) | JSON header | blob data
+#
+# The JSON header indexes every blob (original frames, thumbnails and the
+# rendered collage) by offset and length relative to the start of the blob
+# data, so a reader can memory-map the file and decode one frame without
+# touching the rest.
+
+MAGIC = b'NGEX'
+VERSION = 1
+PREAMBLE = struct.Struct('<4sHI')
+EXAM_EXTENSION = '.ngx'
+THUMB_SIZE = (160, 120)
+
+# ---------------- WRITER ---------------- #
+
+def _encode(image, ext, params=None):
+    ok, buf = cv2.imencode(ext, image, params or [])
+    if not ok:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buf.tobytes()
+
+def _build_exam(frames, collage=None, settings=None, collage_bytes=None,
+                thumb_size=THUMB_SIZE, created=None):
+    # frames may be a plain {position: ndarray} mapping or a CaptureStore,
+    # whose already-encoded PNG blobs and per-position metadata are reused
+    blobs = []
+    entries = {}
+    positions = {}
+    
+    def add(name, data, fmt, **extra):
+        offset = sum(len(b) for b in blobs)
+        blobs.append(data)
+        entries[name] = dict(offset=offset, length=len(data), format=fmt, **extra)
+    
+    for position in sorted(frames.keys()):
+        frame = frames[position]
+        encoded = frames.encoded(position) if hasattr(frames, 'encoded') else None
+        if encoded is None:
+            encoded = _encode(frame, '.png', [cv2.IMWRITE_PNG_COMPRESSION, 1])
+        shape = list(frame.shape)
+        add(f"frame/{position}", encoded, 'png', shape=shape)
+        thumb = cv2.resize(frame, thumb_size)
+        add(f"thumb/{position}", _encode(thumb, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 85]),
+            'jpg', shape=list(thumb.shape))
+        meta = frames.metadata(position) if hasattr(frames, 'metadata') else {}
+        positions[str(position)] = dict(meta, shape=shape)
+    
+    if collage_bytes is None and collage is not None:
+        collage_bytes = _encode(collage, '.jpg', [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if collage_bytes is not None:
+        add('collage', collage_bytes, 'jpg')
+    
+    header = json.dumps({
+        'version': VERSION,
+        'created': created or datetime.now().isoformat(timespec='seconds'),
+        'settings': dict(settings or {}),
+        'positions': positions,
+        'entries': entries
+    }).encode('utf-8')
+    return header, blobs
+
+def write_exam(path, frames, collage=None, settings=None, collage_bytes=None,
+               thumb_size=THUMB_SIZE, created=None):
+    header, blobs = _build_exam(frames, collage, settings, collage_bytes, thumb_size, created)
+    
+    # Write next to the target and rename, so a crash never leaves a torn file
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for data in blobs:
+            f.write(data)
+    os.replace(tmp_path, path)
+    return path
+
+def encode_exam(frames, collage=None, settings=None, collage_bytes=None,
+                thumb_size=THUMB_SIZE, created=None):
+    # The same container as write_exam, in memory (e.g. for an HTTP upload)
+    header, blobs = _build_exam(frames, collage, settings, collage_bytes, thumb_size, created)
+    return b''.join([PREAMBLE.pack(MAGIC, VERSION, len(header)), header] + blobs)
+
+# ---------------- READER ---------------- #
+
+class ExamReader:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            magic, version, header_len = PREAMBLE.unpack_from(self._mm, 0)
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not an exam file")
+            if version > VERSION:
+                raise ValueError(f"Unsupported exam file version {version}")
+            start = PREAMBLE.size
+            self.header = json.loads(self._mm[start:start + header_len].decode('utf-8'))
+            self._data_start = start + header_len
+        except Exception:
+            self.close()
+            raise
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+    
+    def close(self):
+        if getattr(self, '_mm', None) is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file:
+            self._file.close()
+            self._file = None
+    
+    @property
+    def created(self):
+        return self.header.get('created')
+    
+    @property
+    def settings(self):
+        return self.header.get('settings', {})
+    
+    @property
+    def positions(self):
+        return sorted(int(p) for p in self.header.get('positions', {}))
+    
+    def metadata(self, position):
+        return self.header['positions'][str(position)]
+    
+    def has(self, name):
+        return name in self.header['entries']
+    
+    def entry_bytes(self, name):
+        entry = self.header['entries'][name]
+        offset = self._data_start + entry['offset']
+        return self._mm[offset:offset + entry['length']]
+    
+    def _decode(self, name, flags=cv2.IMREAD_UNCHANGED):
+        entry = self.header['entries'][name]
+        # Decode straight out of the mapping; only this blob's pages are read
+        buf = np.frombuffer(self._mm, dtype=np.uint8, count=entry['length'],
+                            offset=self._data_start + entry['offset'])
+        image = cv2.imdecode(buf, flags)
+        del buf
+        return image
+    
+    def frame(self, position):
+        return self._decode(f"frame/{position}")
+    
+    def frame_bytes(self, position):
+        return self.entry_bytes(f"frame/{position}")
+    
+    def thumbnail(self, position):
+        return self._decode(f"thumb/{position}", cv2.IMREAD_COLOR)
+    
+    def collage(self):
+        if not self.has('collage'):
+            return None
+        return self._decode('collage', cv2.IMREAD_COLOR)
+    
+    def collage_bytes(self):
+        if not self.has('collage'):
+            return None
+        return self.entry_bytes('collage')
+
+def read_exam_header(path):
+    with ExamReader(path) as reader:
+        return reader.header
+
+def compact_exam(path, quality=85):
+    # Rewrites the original frames of an exam as JPEG for long-term storage;
+    # thumbnails, collage and metadata are copied over untouched. Returns
+    # the number of bytes saved (0 if the exam was already archived).
+    steps = compact_exam_steps(path, quality)
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+def compact_exam_steps(path, quality=85):
+    # compact_exam as a generator that yields after every re-encoded frame,
+    # for callers working in short time slices; returns the bytes saved
+    with ExamReader(path) as reader:
+        if reader.header.get('archived'):
+            return 0
+        stat = os.stat(path)
+        blobs = []
+        entries = {}
+        offset = 0
+        for name, entry in sorted(reader.header['entries'].items(), key=lambda e: e[1]['offset']):
+            entry = dict(entry)
+            data = reader.entry_bytes(name)
+            if name.startswith('frame/') and entry['format'] == 'png':
+                data = _encode(reader._decode(name), '.jpg', [cv2.IMWRITE_JPEG_QUALITY, quality])
+                entry['format'] = 'jpg'
+                yield
+            entry.update(offset=offset, length=len(data))
+            offset += len(data)
+            blobs.append(data)
+            entries[name] = entry
+        header = dict(reader.header, entries=entries, archived={
+            'quality': quality, 'at': datetime.now().isoformat(timespec='seconds')})
+    
+    header = json.dumps(header).encode('utf-8')
+    tmp_path = path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(PREAMBLE.pack(MAGIC, VERSION, len(header)))
+        f.write(header)
+        for data in blobs:
+            f.write(data)
+    os.replace(tmp_path, path)
+    # Keep the original age so retention policies still see the exam as old
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    return stat.st_size - os.path.getsize(path)
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) < 2 or argv[0] not in ('info', 'extract'):
+        print("usage: exam_file.py info EXAM.ngx\n"
+              "       exam_file.py extract EXAM.ngx POSITION|collage OUT.png")
+        return 2
+    with ExamReader(argv[1]) as reader:
+        if argv[0] == 'info':
+            print(f"created:   {reader.created}")
+            print(f"settings:  {json.dumps(reader.settings)}")
+            for position in reader.positions:
+                print(f"position {position}: {json.dumps(reader.metadata(position))}")
+            print(f"collage:   {'yes' if reader.has('collage') else 'no'}")
+            return 0
+        if len(argv) < 4:
+            print("extract needs a position and an output path")
+            return 2
+        image = reader.collage() if argv[2] == 'collage' else reader.frame(int(argv[2]))
+        if image is None:
+            print("nothing to extract")
+            return 1
+        cv2.imwrite(argv[3], image)
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,356 @@
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import cv2
+import numpy as np
+
+# ---------------- EMBEDDED IMAGES ---------------- #
+
+# PDF readers decode JPEG (DCTDecode) natively, and an 8-bit non-interlaced
+# PNG's IDAT stream is exactly a FlateDecode stream with PNG predictors, so
+# the blobs already encoded for export are copied into the report as-is.
+
+def jpeg_size(data):
+    # (width, height, components) from the first SOF marker
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        length = struct.unpack('>H', data[i + 2:i + 4])[0]
+        if marker in (0xC0, 0xC1, 0xC2):
+            height, width = struct.unpack('>HH', data[i + 5:i + 9])
+            return width, height, data[i + 9]
+        i += 2 + length
+    raise ValueError("No JPEG frame header found")
+
+def png_stream(data):
+    # (width, height, components, idat) or None when the PNG cannot be
+    # passed through (palette, alpha, 16-bit or interlaced)
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        return None
+    i = 8
+    idat = []
+    header = None
+    while i < len(data):
+        length, kind = struct.unpack('>I4s', data[i:i + 8])
+        body = data[i + 8:i + 8 + length]
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', body)
+        elif kind == b'IDAT':
+            idat.append(body)
+        elif kind == b'IEND':
+            break
+        i += 12 + length
+    if header is None:
+        return None
+    width, height, depth, colour, _, _, interlace = header
+    components = {0: 1, 2: 3}.get(colour)
+    if depth != 8 or interlace or components is None:
+        return None
+    return width, height, components, b''.join(idat)
+
+def image_object(data=None, image=None, quality=90):
+    # PDF image dictionary + stream for encoded bytes, re-encoding only as
+    # a last resort
+    if data is not None:
+        data = bytes(data)
+        if data[:2] == b'\xff\xd8':
+            width, height, components = jpeg_size(data)
+            return _image_dict(width, height, components, '/DCTDecode', None), data
+        png = png_stream(data)
+        if png is not None:
+            width, height, components, idat = png
+            params = f"<< /Predictor 15 /Colors {components} /BitsPerComponent 8 /Columns {width} >>"
+            return _image_dict(width, height, components, '/FlateDecode', params), idat
+        if image is None:
+            image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    ok, buf = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    if not ok:
+        raise ValueError("Could not encode image for the report")
+    return image_object(buf.tobytes())
+
+def _image_dict(width, height, components, filter_name, params):
+    colour = '/DeviceGray' if components == 1 else '/DeviceRGB'
+    entries = (f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+               f"/ColorSpace {colour} /BitsPerComponent 8 /Filter {filter_name}")
+    if params:
+        entries += f" /DecodeParms {params}"
+    return {'width': width, 'height': height, 'entries': entries}
+
+# ---------------- PDF WRITER ---------------- #
+
+A4 = (595, 842)
+MARGIN = 40
+
+def _text(value):
+    value = str(value).encode('latin-1', 'replace').decode('latin-1')
+    return value.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+class PdfDocument:
+    # Minimal PDF 1.4 writer: Helvetica text, lines and image XObjects
+    
+    def __init__(self, page_size=A4):
+        self.page_size = page_size
+        self.objects = []
+        self.pages = []
+        self.images = {}
+        self._content = None
+        self._font = self._add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica "
+                               b"/Encoding /WinAnsiEncoding >>")
+        self._bold = self._add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold "
+                               b"/Encoding /WinAnsiEncoding >>")
+    
+    def _add(self, body):
+        self.objects.append(body)
+        return len(self.objects)
+    
+    def _stream(self, entries, data):
+        return self._add(f"<< {entries} /Length {len(data)} >>\nstream\n".encode('latin-1')
+                         + data + b"\nendstream")
+    
+    def add_image(self, name, data=None, image=None):
+        info, stream = image_object(data, image)
+        info['id'] = self._stream(info['entries'], stream)
+        self.images[name] = info
+        return info
+    
+    def new_page(self):
+        self._content = []
+        self.pages.append((self._content, set()))
+    
+    def text(self, x, y, value, size=10, bold=False):
+        font = '/F2' if bold else '/F1'
+        self._content.append(f"BT {font} {size} Tf {x:.1f} {y:.1f} Td ({_text(value)}) Tj ET")
+    
+    def line(self, x1, y1, x2, y2, width=0.5, grey=0.6):
+        self._content.append(f"{grey} G {width} w {x1:.1f} {y1:.1f} m {x2:.1f} {y2:.1f} l S")
+    
+    def draw_image(self, name, x, y, width, height):
+        self._content.append(f"q {width:.2f} 0 0 {height:.2f} {x:.2f} {y:.2f} cm /{name} Do Q")
+        self.pages[-1][1].add(name)
+    
+    def fit_image(self, name, x, top, max_width, max_height):
+        # Draws the image scaled to fit the box below `top`; returns its height
+        info = self.images[name]
+        scale = min(max_width / info['width'], max_height / info['height'])
+        width, height = info['width'] * scale, info['height'] * scale
+        self.draw_image(name, x + (max_width - width) / 2, top - height, width, height)
+        return height
+    
+    def save(self, path):
+        width, height = self.page_size
+        font_ids = f"/Font << /F1 {self._font} 0 R /F2 {self._bold} 0 R >>"
+        pages_id = self._add(None)
+        page_ids = []
+        for content, used in self.pages:
+            stream = zlib.compress('\n'.join(content).encode('latin-1'), 6)
+            content_id = self._stream('/Filter /FlateDecode', stream)
+            xobjects = ' '.join(f"/{name} {self.images[name]['id']} 0 R" for name in sorted(used))
+            page_ids.append(self._add(
+                f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {width} {height}] "
+                f"/Resources << {font_ids} /XObject << {xobjects} >> >> "
+                f"/Contents {content_id} 0 R >>".encode('latin-1')))
+        kids = ' '.join(f"{i} 0 R" for i in page_ids)
+        self.objects[pages_id - 1] = (f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+                                      .encode('latin-1'))
+        catalog = self._add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode('latin-1'))
+        
+        tmp_path = path + '.part'
+        with open(tmp_path, 'wb') as f:
+            f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+            offsets = []
+            for number, body in enumerate(self.objects, 1):
+                offsets.append(f.tell())
+                f.write(f"{number} 0 obj\n".encode('latin-1'))
+                f.write(body)
+                f.write(b"\nendobj\n")
+            xref = f.tell()
+            f.write(f"xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n".encode('latin-1'))
+            for offset in offsets:
+                f.write(f"{offset:010d} 00000 n \n".encode('latin-1'))
+            f.write(f"trailer\n<< /Size {len(self.objects) + 1} /Root {catalog} 0 R >>\n"
+                    f"startxref\n{xref}\n%%EOF\n".encode('latin-1'))
+        
+        os.replace(tmp_path, path)
+        return path
+
+# ---------------- CAPTURE QUALITY ---------------- #
+
+def capture_quality(frame, work_width=320):
+    # Sharpness (variance of the Laplacian), mean brightness and the share
+    # of clipped pixels, measured on a downscaled grey copy
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    scale = min(1.0, work_width / gray.shape[1])
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    clipped = np.count_nonzero((gray <= 2) | (gray >= 253)) / gray.size
+    return {
+        'sharpness': round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 1),
+        'brightness': round(float(gray.mean()), 1),
+        'clipped': round(100 * clipped, 1)
+    }
+
+def _frame_sources(frames):
+    # (position, encoded bytes or None, metadata, loader) for a CaptureStore,
+    # an ExamReader or a plain {position: ndarray} mapping
+    sources = []
+    if hasattr(frames, 'frame_bytes'):
+        for position in frames.positions:
+            sources.append((position, frames.frame_bytes(position), frames.metadata(position),
+                            lambda p=position: frames.frame(p)))
+        return sources
+    for position in sorted(frames.keys()):
+        encoded = frames.encoded(position) if hasattr(frames, 'encoded') else None
+        meta = frames.metadata(position) if hasattr(frames, 'metadata') else {}
+        sources.append((position, encoded, meta, lambda p=position: frames[p]))
+    return sources
+
+# ---------------- REPORT LAYOUT ---------------- #
+
+def build_report(path, frames, collage_bytes=None, collage=None, info=None, analysis=None,
+                 progress=None):
+    # frames: CaptureStore, ExamReader or {position: ndarray}
+    # info: ordered {label: value} pairs printed under the title
+    # analysis: ReflexAnalyser results by position, if available
+    # progress: callable receiving a fraction in [0, 1]
+    progress = progress or (lambda fraction: None)
+    info = dict(info or {})
+    sources = _frame_sources(frames)
+    steps = 2 * len(sources) + 3
+    done = [0]
+    
+    def step():
+        done[0] += 1
+        progress(done[0] / steps)
+    
+    doc = PdfDocument()
+    width, height = doc.page_size
+    content_width = width - 2 * MARGIN
+    
+    if collage_bytes is None and collage is None and hasattr(frames, 'collage_bytes'):
+        collage_bytes = frames.collage_bytes()
+    if collage_bytes is not None or collage is not None:
+        doc.add_image('Collage', collage_bytes, collage)
+    step()
+    
+    quality = {}
+    for position, encoded, meta, load in sources:
+        frame = load()
+        quality[position] = capture_quality(frame)
+        step()
+        doc.add_image(f"Frame{position}", encoded, frame)
+        step()
+    
+    # Page 1: summary, collage and per-position quality table
+    doc.new_page()
+    y = height - MARGIN - 10
+    doc.text(MARGIN, y, info.pop('Title', "9-Gaze Examination Report"), size=18, bold=True)
+    y -= 24
+    for label, value in info.items():
+        doc.text(MARGIN, y, f"{label}:", size=10, bold=True)
+        doc.text(MARGIN + 110, y, value, size=10)
+        y -= 14
+    y -= 6
+    if 'Collage' in doc.images:
+        y -= doc.fit_image('Collage', MARGIN, y, content_width, 360) + 16
+    
+    columns = [("Pos", 0), ("Captured", 30), ("Sharpness", 140), ("Brightness", 205),
+               ("Clipped %", 270), ("OD reflex (px)", 335), ("OS reflex (px)", 425)]
+    for title, offset in columns:
+        doc.text(MARGIN + offset, y, title, size=9, bold=True)
+    y -= 4
+    doc.line(MARGIN, y, width - MARGIN, y)
+    y -= 12
+    for position, _, meta, _ in sources:
+        score = quality[position]
+        captured = meta.get('captured_at', '')
+        eyes = ((analysis or {}).get(position) or {}).get('eyes', {})
+        cells = [str(position), captured.replace('T', ' ')[11:23] if captured else "-",
+                 score['sharpness'], score['brightness'], score['clipped']]
+        for eye in ('OD', 'OS'):
+            displacement = (eyes.get(eye) or {}).get('displacement')
+            cells.append(f"{displacement[0]:+.0f}, {displacement[1]:+.0f}" if displacement else "-")
+        for (_, offset), value in zip(columns, cells):
+            doc.text(MARGIN + offset, y, value, size=9)
+        y -= 13
+    
+    # Following pages: the original frames, six per page
+    per_page, cols = 6, 2
+    cell_w = (content_width - 20) / cols
+    cell_h = (height - 2 * MARGIN - 40) / (per_page // cols)
+    for index, (position, _, meta, _) in enumerate(sources):
+        if index % per_page == 0:
+            doc.new_page()
+            doc.text(MARGIN, height - MARGIN - 10, "Original Captures", size=14, bold=True)
+        slot = index % per_page
+        x = MARGIN + (slot % cols) * (cell_w + 20)
+        top = height - MARGIN - 40 - (slot // cols) * cell_h
+        drawn = doc.fit_image(f"Frame{position}", x, top, cell_w, cell_h - 24)
+        caption = f"Position {position}"
+        if meta.get('captured_at'):
+            caption += f"  -  {meta['captured_at'].replace('T', ' ')}"
+        doc.text(x, top - drawn - 12, caption, size=8)
+    
+    doc.save(path)
+    step()
+    progress(1.0)
+    return path
+
+# ---------------- BACKGROUND GENERATOR ---------------- #
+
+class ReportGenerator:
+    # Builds reports on a worker thread; progress and completion callbacks
+    # are invoked from that thread
+    
+    def __init__(self, max_workers=1, pool=None):
+        self.pool = pool or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='report')
+        self.last_runtime = None
+        self._lock = threading.Lock()
+    
+    def submit(self, path, frames, on_progress=None, on_done=None, **kwargs):
+        return self.pool.submit(self._build, path, frames, on_progress, on_done, kwargs)
+    
+    def _build(self, path, frames, on_progress, on_done, kwargs):
+        started = time.perf_counter()
+        error = None
+        try:
+            build_report(path, frames, progress=on_progress, **kwargs)
+        except Exception as e:
+            error = str(e)
+            path = None
+        with self._lock:
+            self.last_runtime = time.perf_counter() - started
+        if on_done:
+            on_done(path, error)
+        return path
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        print("usage: exam_report.py EXAM.ngx OUT.pdf")
+        return 2
+    from exam_file import ExamReader
+    started = time.perf_counter()
+    with ExamReader(argv[0]) as reader:
+        info = {'Examined': (reader.created or '').replace('T', ' '),
+                'Source': argv[0],
+                'Generated': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        build_report(argv[1], reader, info=info)
+    print(f"wrote {argv[1]} in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+import glob
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+import uuid
+
+# ---------------- TRACE WRITER ---------------- #
+
+class ExamTrace:
+    # Buffers timing events in memory; a background thread appends them to
+    # a JSONL log, rotating it once it grows past max_bytes.
+    
+    def __init__(self, path='exam_trace.jsonl', max_bytes=1024 * 1024, backups=5,
+                 flush_interval=2.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.exam_id = None
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._running = True
+        self._writer = threading.Thread(target=self._run, name='exam-trace', daemon=True)
+        self._writer.start()
+    
+    def new_exam(self):
+        self.exam_id = uuid.uuid4().hex[:12]
+        return self.exam_id
+    
+    def emit(self, event, **fields):
+        record = {'t': round(time.monotonic(), 4), 'wall': round(time.time(), 3),
+                  'exam': self.exam_id, 'event': event}
+        record.update(fields)
+        with self._lock:
+            self._buffer.append(record)
+        return record
+    
+    def flush(self):
+        self._wake.set()
+    
+    def close(self):
+        self._running = False
+        self._wake.set()
+        self._writer.join(timeout=2)
+        self._write_pending()
+    
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._write_pending()
+    
+    def _write_pending(self):
+        with self._lock:
+            records, self._buffer = self._buffer, []
+        if not records:
+            return
+        try:
+            self._rotate_if_needed()
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in records:
+                    f.write(json.dumps(record) + '\n')
+        except OSError:
+            pass
+    
+    def _rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            src = f"{self.path}.{index}"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+# ---------------- SUMMARISER ---------------- #
+
+def read_events(paths):
+    events = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        try:
+                            events.append(json.loads(line))
+                        except ValueError:
+                            pass
+        except OSError:
+            pass
+    return events
+
+def summarise_exam(events):
+    events = sorted(events, key=lambda e: e['t'])
+    dwell = {}
+    retakes = {}
+    latencies = []
+    current = None
+    entered = None
+    result = {'finished': False}
+    
+    for event in events:
+        name = event['event']
+        if name == 'position_entered':
+            if current is not None:
+                dwell[current] = dwell.get(current, 0) + event['t'] - entered
+            current, entered = event['position'], event['t']
+        elif name == 'retake':
+            retakes[event['position']] = retakes.get(event['position'], 0) + 1
+        elif name == 'capture' and 'latency_ms' in event:
+            latencies.append(event['latency_ms'])
+        elif name in ('finish', 'abandon'):
+            if current is not None:
+                dwell[current] = dwell.get(current, 0) + event['t'] - entered
+                current = None
+            result['finished'] = name == 'finish'
+            result['capture_seconds'] = event['t'] - events[0]['t']
+        elif name in ('collage', 'save', 'upload') and 'duration_ms' in event:
+            result[f"{name}_ms"] = result.get(f"{name}_ms", 0) + event['duration_ms']
+    
+    result.update(dwell=dwell, retakes=retakes, capture_latency_ms=latencies,
+                  total_seconds=events[-1]['t'] - events[0]['t'])
+    return result
+
+def summarise(events):
+    exams = {}
+    for event in events:
+        if event.get('exam'):
+            exams.setdefault(event['exam'], []).append(event)
+    per_exam = {exam: summarise_exam(evts) for exam, evts in exams.items()}
+    finished = [s for s in per_exam.values() if s['finished']]
+    
+    positions = {}
+    for position in range(1, 10):
+        dwell = [s['dwell'][position] for s in finished if position in s['dwell']]
+        retakes = [s['retakes'].get(position, 0) for s in finished]
+        positions[position] = {
+            'mean_dwell_s': round(statistics.mean(dwell), 2) if dwell else None,
+            'mean_retakes': round(statistics.mean(retakes), 2) if retakes else None
+        }
+    
+    capture_times = [s['capture_seconds'] for s in finished]
+    latencies = [ms for s in finished for ms in s['capture_latency_ms']]
+    
+    def mean_of(key):
+        values = [s[key] for s in finished if key in s]
+        return round(statistics.mean(values), 1) if values else None
+    
+    return {
+        'exams': len(per_exam),
+        'finished': len(finished),
+        'mean_capture_s': round(statistics.mean(capture_times), 1) if capture_times else None,
+        'median_capture_s': round(statistics.median(capture_times), 1) if capture_times else None,
+        'exams_per_hour': round(3600 / statistics.mean(capture_times), 1) if capture_times else None,
+        'mean_capture_latency_ms': round(statistics.mean(latencies), 1) if latencies else None,
+        'mean_collage_ms': mean_of('collage_ms'),
+        'mean_save_ms': mean_of('save_ms'),
+        'mean_upload_ms': mean_of('upload_ms'),
+        'positions': positions
+    }
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    paths = []
+    for pattern in argv or ['exam_trace.jsonl*']:
+        paths.extend(sorted(glob.glob(pattern)) or [pattern])
+    summary = summarise(read_events(paths))
+    print(f"Exams: {summary['exams']} ({summary['finished']} finished)")
+    print(f"Capture phase: mean {summary['mean_capture_s']} s, median {summary['median_capture_s']} s, "
+          f"{summary['exams_per_hour']} exams/hour")
+    print(f"Capture latency: {summary['mean_capture_latency_ms']} ms")
+    print(f"Collage: {summary['mean_collage_ms']} ms  Save: {summary['mean_save_ms']} ms  "
+          f"Upload: {summary['mean_upload_ms']} ms")
+    print("Position  Dwell (s)  Retakes")
+    for position, stats in summary['positions'].items():
+        print(f"{position:>8}  {str(stats['mean_dwell_s']):>9}  {str(stats['mean_retakes']):>7}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+import math
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# ---------------- SOFTWARE BRIGHTNESS ---------------- #
+
+def software_brightness(image, brightness):
+    # Slider value 0..100 mapped to a linear stretch of the output range;
+    # 50 leaves the frame untouched
+    brightness = (brightness - 50) * 2
+    if brightness != 0:
+        if brightness > 0:
+            shadow = brightness
+            highlight = 255
+        else:
+            shadow = 0
+            highlight = 255 + brightness
+        alpha_b = (highlight - shadow)/255
+        gamma_b = shadow
+        image = cv2.addWeighted(image, alpha_b, image, 0, gamma_b)
+    return image
+
+def brightness_target(brightness, base=118):
+    # Mean grey level the sensor should deliver for a slider value: the
+    # level the software stretch would have turned `base` into
+    offset = (brightness - 50) * 2
+    shadow, highlight = (offset, 255) if offset > 0 else (0, 255 + offset)
+    return shadow + base * (highlight - shadow) / 255
+
+def luminance_stats(frame, step=8):
+    # Mean level and share of clipped highlights on a decimated green
+    # channel; a 640x480 frame becomes 80x60 samples
+    sample = frame[::step, ::step, 1] if frame.ndim == 3 else frame[::step, ::step]
+    hist = np.bincount(sample.ravel(), minlength=256)
+    total = sample.size
+    mean = float(np.dot(hist, np.arange(256))) / total
+    return mean, float(hist[250:].sum()) / total
+
+# ---------------- CLOSED-LOOP CONTROLLER ---------------- #
+
+class ExposureController:
+    # Drives the sensor's own exposure (then gain, once exposure is at its
+    # limit) towards a target mean level. observe() is called from the
+    # camera reader thread for every frame but only measures every
+    # `interval` frames, leaving the sensor time to settle between steps.
+    # If the device ignores the properties, `hardware` is False and callers
+    # keep adjusting brightness in software.
+    
+    def __init__(self, cap, target=118, interval=4, damping=0.6, deadband=0.06,
+                 max_clipped=0.02, exposure_limits=(1.0, 10000.0), gain_limits=(0.0, 100.0),
+                 gain_step=4.0):
+        self.cap = cap
+        self.target = target
+        self.interval = interval
+        self.damping = damping
+        self.deadband = deadband
+        self.max_clipped = max_clipped
+        self.exposure_limits = exposure_limits
+        self.gain_limits = gain_limits
+        self.gain_step = gain_step
+        self.frames = 0
+        self.adjustments = 0
+        self.mean = None
+        self.clipped = 0.0
+        self.log_scale = False
+        self.hardware = self._probe()
+    
+    def _probe(self):
+        # Switch to manual exposure and check that a new exposure value
+        # sticks; restore automatic exposure if it does not
+        try:
+            auto = self.cap.get(cv2.CAP_PROP_AUTO_EXPOSURE)
+            for manual in (1, 0.25):
+                if self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, manual):
+                    break
+            exposure = self.cap.get(cv2.CAP_PROP_EXPOSURE)
+            # DirectShow-style devices report log2 seconds (<= 0)
+            self.log_scale = exposure <= 0
+            probe = exposure - 1 if self.log_scale else max(exposure * 0.5, self.exposure_limits[0])
+            if self.cap.set(cv2.CAP_PROP_EXPOSURE, probe) and \
+                    abs(self.cap.get(cv2.CAP_PROP_EXPOSURE) - probe) < 1e-3 and probe != exposure:
+                self.cap.set(cv2.CAP_PROP_EXPOSURE, exposure)
+                return True
+            self.cap.set(cv2.CAP_PROP_AUTO_EXPOSURE, auto)
+        except Exception:
+            pass
+        return False
+    
+    def set_brightness(self, brightness):
+        self.target = brightness_target(brightness)
+    
+    @property
+    def converged(self):
+        # Last measurement within twice the deadband of the target
+        return self.mean is not None and \
+            abs(math.log2(self.target / max(self.mean, 1.0))) < 2 * self.deadband
+    
+    def observe(self, frame):
+        self.frames += 1
+        if not self.hardware or self.frames % self.interval:
+            return
+        self.mean, self.clipped = luminance_stats(frame)
+        error = math.log2(self.target / max(self.mean, 1.0))
+        if self.clipped > self.max_clipped:
+            # Protect highlights even if the mean is still below target
+            error = min(error, -0.25)
+        if abs(error) < self.deadband:
+            return
+        self._step(error * self.damping)
+    
+    def _step(self, stops):
+        exposure = self.cap.get(cv2.CAP_PROP_EXPOSURE)
+        lo, hi = (-13.0, 0.0) if self.log_scale else self.exposure_limits
+        wanted = exposure + stops if self.log_scale else exposure * 2 ** stops
+        new_exposure = min(max(wanted, lo), hi)
+        if new_exposure != exposure:
+            self.cap.set(cv2.CAP_PROP_EXPOSURE, new_exposure)
+            self.adjustments += 1
+        # Exposure exhausted: make up the rest with analogue gain
+        gain = self.cap.get(cv2.CAP_PROP_GAIN)
+        if (stops > 0 and new_exposure >= hi) or (stops < 0 and gain > self.gain_limits[0]):
+            step = self.gain_step if stops > 0 else -self.gain_step
+            new_gain = min(max(gain + step, self.gain_limits[0]), self.gain_limits[1])
+            if new_gain != gain:
+                self.cap.set(cv2.CAP_PROP_GAIN, new_gain)
+                self.adjustments += 1
+    
+    def stats(self):
+        return {
+            'hardware': self.hardware,
+            'target': round(self.target, 1),
+            'mean': None if self.mean is None else round(self.mean, 1),
+            'clipped': round(self.clipped, 4),
+            'exposure': self.cap.get(cv2.CAP_PROP_EXPOSURE) if self.hardware else None,
+            'gain': self.cap.get(cv2.CAP_PROP_GAIN) if self.hardware else None,
+            'adjustments': self.adjustments
+        }
+
+# ---------------- SIMULATED CAMERA ---------------- #
+
+class SimulatedCamera:
+    # cv2.VideoCapture stand-in for testing exposure control without a
+    # device. Frame brightness follows exposure and gain with a delay of
+    # `latency` frames, like a real sensor; with supports_exposure=False the
+    # properties are ignored, as on many webcams. With `fps` set, read()
+    # blocks like a real device instead of returning frames back to back;
+    # `open_delay` and `ramp_frames` imitate device start-up and the dark
+    # first frames of auto-exposure.
+    
+    def __init__(self, size=(640, 480), exposure=50.0, gain=0.0, supports_exposure=True,
+                 latency=2, scene_level=1.0, seed=0, fps=None, open_delay=0.0, ramp_frames=0):
+        time.sleep(open_delay)
+        w, h = size
+        rng = np.random.default_rng(seed)
+        scene = cv2.GaussianBlur(rng.random((h, w)).astype(np.float32), (0, 0), 12)
+        scene = cv2.normalize(scene, None, 0.05, 1.0, cv2.NORM_MINMAX)
+        scene[h // 3:h // 3 + 8, w // 4:w // 4 + 8] = 4.0  # specular reflex
+        self.scene = np.dstack([scene * 0.8, scene, scene * 0.9]) * scene_level
+        self.props = {cv2.CAP_PROP_EXPOSURE: exposure, cv2.CAP_PROP_GAIN: gain,
+                      cv2.CAP_PROP_AUTO_EXPOSURE: 3.0}
+        self.supports_exposure = supports_exposure
+        self.pending = [(exposure, gain)] * (latency + 1)
+        self.opened = True
+        self.fps = fps
+        self.ramp_frames = ramp_frames
+        self.frames_read = 0
+        self._next_frame = 0.0
+    
+    def isOpened(self):
+        return self.opened
+    
+    def grab(self):
+        if self.fps:
+            now = time.monotonic()
+            if now < self._next_frame:
+                time.sleep(self._next_frame - now)
+            self._next_frame = max(now, self._next_frame) + 1 / self.fps
+        self._grabbed = self.pending.pop(0)
+        self.pending.append((self.props[cv2.CAP_PROP_EXPOSURE], self.props[cv2.CAP_PROP_GAIN]))
+        return True
+    
+    def retrieve(self):
+        exposure, gain = self._grabbed
+        self.frames_read += 1
+        response = exposure / 100.0 * (1 + gain / 32.0) * 160
+        if self.frames_read < self.ramp_frames:
+            response *= (self.frames_read / self.ramp_frames) ** 2
+        frame = np.clip(self.scene * response, 0, 255).astype(np.uint8)
+        return True, frame
+    
+    def read(self):
+        self.grab()
+        return self.retrieve()
+    
+    def get(self, prop):
+        return self.props.get(prop, 0.0)
+    
+    def set(self, prop, value):
+        if not self.supports_exposure and prop in self.props:
+            return False
+        self.props[prop] = float(value)
+        return True
+    
+    def release(self):
+        self.opened = False
+
+# ---------------- BENCHMARK ---------------- #
+
+def benchmark(frames=300, brightness=70):
+    # Per-frame CPU of the reader + preview work with software brightness
+    # versus closed-loop hardware control, on the simulated camera
+    results = {}
+    for supported in (False, True):
+        cap = SimulatedCamera(supports_exposure=supported)
+        controller = ExposureController(cap)
+        controller.set_brightness(brightness)
+        cpu = 0.0
+        for _ in range(frames):
+            _, frame = cap.read()
+            started = time.perf_counter()
+            frame = cv2.flip(frame, 1)
+            controller.observe(frame)
+            if not controller.hardware:
+                frame = software_brightness(frame, brightness)
+            cpu += time.perf_counter() - started
+        mean, _ = luminance_stats(frame)
+        results['hardware' if controller.hardware else 'software'] = {
+            'ms_per_frame': round(1000 * cpu / frames, 3),
+            'final_mean': round(mean, 1),
+            'target': round(controller.target, 1),
+            'adjustments': controller.adjustments
+        }
+    return results
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    frames = int(argv[0]) if argv else 300
+    for mode, stats in benchmark(frames).items():
+        print(f"{mode:>8}: {stats['ms_per_frame']:.3f} ms/frame, mean {stats['final_mean']} "
+              f"(target {stats['target']}), {stats['adjustments']} adjustments")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
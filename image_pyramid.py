@@ -0,0 +1,71 @@
+import math
+
+import cv2
+
+# ---------------- IMAGE PYRAMID ---------------- #
+
+class ImagePyramid:
+    # Level 0 is the full-resolution image; each further level halves it
+    # until the longest side fits in min_size. Levels are cut into
+    # tile_size x tile_size tiles that can be uploaded one at a time.
+    
+    def __init__(self, image, tile_size=256, min_size=512):
+        self.tile_size = tile_size
+        self.levels = [image]
+        while max(self.levels[-1].shape[:2]) > min_size:
+            prev = self.levels[-1]
+            h, w = prev.shape[:2]
+            self.levels.append(cv2.resize(prev, ((w + 1) // 2, (h + 1) // 2),
+                                          interpolation=cv2.INTER_AREA))
+    
+    @property
+    def size(self):
+        h, w = self.levels[0].shape[:2]
+        return w, h
+    
+    @property
+    def level_count(self):
+        return len(self.levels)
+    
+    @property
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+    
+    def level_size(self, level):
+        h, w = self.levels[level].shape[:2]
+        return w, h
+    
+    def level_scale(self, level):
+        # Level pixels per full-resolution pixel
+        return self.levels[level].shape[1] / self.levels[0].shape[1]
+    
+    def level_for_zoom(self, zoom):
+        # Coarsest level that still has at least one pixel per screen pixel
+        if zoom >= 1:
+            return 0
+        level = int(math.floor(math.log2(1 / zoom)))
+        return max(0, min(level, self.level_count - 1))
+    
+    def tile_grid(self, level):
+        w, h = self.level_size(level)
+        return (w + self.tile_size - 1) // self.tile_size, (h + self.tile_size - 1) // self.tile_size
+    
+    def tile_rect(self, level, tx, ty):
+        w, h = self.level_size(level)
+        x = tx * self.tile_size
+        y = ty * self.tile_size
+        return x, y, min(self.tile_size, w - x), min(self.tile_size, h - y)
+    
+    def tile(self, level, tx, ty):
+        x, y, w, h = self.tile_rect(level, tx, ty)
+        return self.levels[level][y:y + h, x:x + w]
+    
+    def visible_tiles(self, level, x0, y0, x1, y1):
+        # Tiles of a level covering the full-resolution rectangle (x0, y0)-(x1, y1)
+        scale = self.level_scale(level) / self.tile_size
+        cols, rows = self.tile_grid(level)
+        tx0 = max(0, int(x0 * scale))
+        ty0 = max(0, int(y0 * scale))
+        tx1 = min(cols - 1, int(x1 * scale))
+        ty1 = min(rows - 1, int(y1 * scale))
+        return [(tx, ty) for ty in range(ty0, ty1 + 1) for tx in range(tx0, tx1 + 1)]
@@ -0,0 +1,186 @@
+import json
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from reflex_analysis import eye_regions
+
+HASH_BITS = 64
+
+# ---------------- EYE CROPS ---------------- #
+
+def eye_opening(roi):
+    # (cx, cy, width) of the eye opening in one eye region: the largest
+    # patch of sclera and iris standing out from the smoothed skin around
+    # it. It follows the head but not the gaze, so crops around it keep the
+    # iris where the patient looked.
+    # Two box passes approximate a wide Gaussian at a fraction of the cost
+    box = (roi.shape[1] // 3 | 1,) * 2
+    background = cv2.blur(cv2.blur(roi, box), box)
+    _, mask = cv2.threshold(cv2.absdiff(roi, background), 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    k = max(3, roi.shape[1] // 40) | 1
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((k, k), np.uint8))
+    count, _, stats, centroids = cv2.connectedComponentsWithStats(mask)
+    if count < 2:
+        return roi.shape[1] / 2, roi.shape[0] / 2, roi.shape[1]
+    largest = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+    cx, cy = centroids[largest]
+    return cx, cy, stats[largest, cv2.CC_STAT_WIDTH]
+
+def eye_crops(frame, size=(32, 16), work_width=320, widen=1.1):
+    # Both eye openings, each scaled to `size` with `widen` times its width
+    # in view, as float32 greyscale (green channel)
+    step = max(1, frame.shape[1] // (work_width * 2))
+    small = frame[::step, ::step]
+    if small.ndim == 3:
+        small = small[..., 1]
+    scale = work_width / small.shape[1]
+    gray = cv2.resize(small, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    crops = []
+    for x, y, w, h in eye_regions(gray, work_width):
+        roi = gray[y:y + h, x:x + w]
+        cx, cy, width = eye_opening(roi)
+        s = size[0] / (width * widen)
+        roi = cv2.GaussianBlur(roi, (0, 0), max(0.5, 0.5 / s))
+        matrix = np.float32([[s, 0, size[0] / 2 - s * cx], [0, s, size[1] / 2 - s * cy]])
+        crops.append(cv2.warpAffine(roi, matrix, size, flags=cv2.INTER_LINEAR,
+                                    borderMode=cv2.BORDER_REPLICATE).astype(np.float32))
+    return crops
+
+# ---------------- HASHING ---------------- #
+
+def perceptual_hash(frame):
+    # 64-bit DCT hash, 32 bits per eye crop: whether each of the 4x8 lowest
+    # frequency coefficients is above the median of that eye's AC ones
+    bits = []
+    for crop in eye_crops(frame):
+        coefficients = cv2.dct(crop)[:4, :8].ravel()
+        bits.append(coefficients > np.median(coefficients[1:]))
+    return int.from_bytes(np.packbits(np.concatenate(bits)).tobytes(), 'big')
+
+def hash_hex(value):
+    return f"{value:0{HASH_BITS // 4}x}"
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+# ---------------- DUPLICATE INDEX ---------------- #
+
+class DuplicateIndex:
+    # Hashes of one exam's captures. add() returns the other positions whose
+    # capture is within `max_distance` bits of the new one, closest first: a
+    # capture taken twice without the patient changing gaze. The limit sits
+    # in the middle of the gap in tests/fixtures/phash_distances.json (see
+    # record_distances()).
+    
+    def __init__(self, max_distance=8):
+        self.max_distance = max_distance
+        self.hashes = {}
+    
+    def add(self, position, value):
+        # `value` is perceptual_hash() of the capture, computed off the UI thread
+        self.hashes[position] = value
+        return self.matches(position)
+    
+    def matches(self, position):
+        value = self.hashes[position]
+        found = [(other, hamming(value, h)) for other, h in self.hashes.items() if other != position]
+        return sorted([(other, d) for other, d in found if d <= self.max_distance], key=lambda m: m[1])
+    
+    def discard(self, position):
+        self.hashes.pop(position, None)
+    
+    def clear(self):
+        self.hashes.clear()
+
+# ---------------- BENCHMARK ---------------- #
+
+GAZES = [(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)]
+
+def face_scene(size=(1920, 1080), gaze=(0, 0), seed=0, texture=3.0):
+    # Both eyes as framed for an exam: smooth, unevenly lit skin with faint
+    # texture, brows, and irises and upper lids following `gaze` (dx, dy
+    # each in -1..1)
+    w, h = size
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    skin = (140 + 45 * np.exp(-((x - 0.45 * w) / (0.5 * w)) ** 2 - ((y - 0.5 * h) / (0.7 * h)) ** 2)
+            + 25 * x / w - 20 * y / h)
+    grain = cv2.GaussianBlur(np.random.default_rng(seed).random((h, w)).astype(np.float32), (0, 0), 25)
+    skin += texture * (grain - grain.mean()) / grain.std()
+    frame = np.dstack([skin * 0.72, skin * 0.85, skin])
+    r = int(0.11 * h)
+    for cx, cy in ((int(0.3 * w), int(0.52 * h)), (int(0.7 * w), int(0.5 * h))):
+        cv2.rectangle(frame, (cx - 23 * r // 10, cy - 21 * r // 10), (cx + 23 * r // 10, cy - 17 * r // 10),
+                      (60, 70, 85), -1)
+        eye = np.zeros((h, w), np.uint8)
+        cv2.ellipse(eye, (cx, cy), (21 * r // 10, r), 0, 0, 360, 255, -1)
+        eye[:cy - int(r * (0.75 - 0.35 * gaze[1]))] = 0
+        ball = np.full_like(frame, (220, 224, 228))
+        iris = (cx + int(gaze[0] * r), cy + int(gaze[1] * r / 2))
+        cv2.circle(ball, iris, r, (55, 85, 105), -1)
+        cv2.circle(ball, iris, int(0.42 * r), (18, 18, 20), -1)
+        cv2.circle(ball, (cx + r // 5, cy - r // 10), r // 8, (255, 255, 255), -1)
+        frame[eye > 0] = ball[eye > 0]
+    return np.clip(cv2.GaussianBlur(frame, (0, 0), 2), 0, 255).astype(np.uint8)
+
+def reshoot(frame, rng):
+    # Another capture of the same scene: the head moved up to 12 px and 2%
+    # in scale, exposure within 8%, sensor noise sigma 2-5
+    h, w = frame.shape[:2]
+    zoom = rng.uniform(0.98, 1.02)
+    dx, dy = rng.uniform(-12, 12, 2)
+    matrix = np.float32([[zoom, 0, (1 - zoom) * w / 2 + dx], [0, zoom, (1 - zoom) * h / 2 + dy]])
+    moved = cv2.warpAffine(frame, matrix, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REFLECT)
+    shot = moved * rng.uniform(0.92, 1.08) + rng.normal(0, rng.uniform(2, 5), frame.shape)
+    return np.clip(shot, 0, 255).astype(np.uint8)
+
+def record_distances(seeds=5, shots=4, size=(1280, 720)):
+    # Hash distances on face_scene: between shots of one gaze position
+    # ('repeat') and between the positions of one face ('distinct'), as
+    # {distance: count}. DuplicateIndex's limit must fall between them.
+    rng = np.random.default_rng(0)
+    repeat, distinct = [], []
+    for seed in range(seeds):
+        hashes = []
+        for gaze in GAZES:
+            face = face_scene(size, gaze, seed=seed, texture=3.0 + seed)
+            hashes.append([perceptual_hash(reshoot(face, rng)) for _ in range(shots)])
+        for values in hashes:
+            repeat += [hamming(a, b) for i, a in enumerate(values) for b in values[i + 1:]]
+        firsts = [values[0] for values in hashes]
+        distinct += [hamming(a, b) for i, a in enumerate(firsts) for b in firsts[i + 1:]]
+    histogram = lambda distances: {str(d): distances.count(d) for d in sorted(set(distances))}
+    return {'bits': HASH_BITS, 'seeds': seeds, 'shots': shots, 'size': list(size),
+            'repeat': histogram(repeat), 'distinct': histogram(distinct)}
+
+def benchmark(frames=50, size=(1920, 1080)):
+    # Hash cost per frame on the simulated camera scene
+    from exposure import SimulatedCamera
+    
+    frame = SimulatedCamera(size=size).read()[1]
+    started = time.perf_counter()
+    for _ in range(frames):
+        perceptual_hash(frame)
+    return {'us_per_frame': round((time.perf_counter() - started) / frames * 1e6, 1)}
+
+def main(argv=None):
+    # perceptual_hash.py [frames] | --record PATH
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ['--record']:
+        distances = record_distances()
+        with open(argv[1], 'w', encoding='utf-8') as f:
+            json.dump(distances, f, indent=1)
+            f.write('\n')
+        repeat = max(int(d) for d in distances['repeat'])
+        distinct = min(int(d) for d in distances['distinct'])
+        print(f"repeated captures differ in up to {repeat}/{HASH_BITS} bits, gaze positions in at least "
+              f"{distinct}/{HASH_BITS}; duplicate limit {DuplicateIndex().max_distance}")
+        return 0 if repeat < DuplicateIndex().max_distance < distinct else 1
+    stats = benchmark(int(argv[0]) if argv else 50)
+    print(f"{stats['us_per_frame']} us per frame")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,104 @@
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from collage import cell_rect
+
+IDENTITY_LUT = np.repeat(np.arange(256, dtype=np.uint8)[:, None, None], 3, axis=2)
+
+# ---------------- LOOKUP TABLES ---------------- #
+
+def _histograms(image, work_width):
+    scale = min(1.0, work_width / image.shape[1])
+    if scale != 1.0:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return [cv2.calcHist([image], [c], None, [256], [0, 256]).ravel() for c in range(3)]
+
+def _cdf(hist):
+    cdf = np.cumsum(hist)
+    return cdf / cdf[-1] if cdf[-1] else cdf
+
+def matching_lut(reference_hists, image_hists, strength=1.0):
+    # Per-channel histogram matching: maps each channel's CDF onto the
+    # reference channel's, which evens out both brightness and white balance
+    levels = np.arange(256, dtype=np.float64)
+    lut = np.empty((256, 1, 3), dtype=np.uint8)
+    for c in range(3):
+        mapped = np.interp(_cdf(image_hists[c]), _cdf(reference_hists[c]), levels)
+        mapped = levels + strength * (mapped - levels)
+        lut[:, 0, c] = np.clip(np.rint(mapped), 0, 255)
+    return lut
+
+# ---------------- NORMALIZER ---------------- #
+
+class PhotometricNormalizer:
+    # Matches every gaze tile to the primary-gaze tile. Histograms are taken
+    # from the small collage cells (no full-resolution decode) and, with the
+    # LUTs, cached by capture version, so a retake only recomputes that
+    # position (or all of them if the reference changed). Applying them is
+    # one cv2.LUT pass per cell.
+    
+    def __init__(self, reference=1, work_width=320, strength=1.0):
+        self.reference = reference
+        self.work_width = work_width
+        self.strength = strength
+        self.last_runtime = 0.0
+        self._hists = {}
+        self._luts = {}
+        self._lock = threading.Lock()
+    
+    def _histograms(self, store, position, image):
+        version = store.version(position) if hasattr(store, 'version') else None
+        with self._lock:
+            cached = self._hists.get(position)
+        if version is not None and cached and cached[0] == version:
+            return cached[1]
+        hists = _histograms(image, self.work_width)
+        if version is not None:
+            with self._lock:
+                self._hists[position] = (version, hists)
+        return hists
+    
+    def luts(self, store, images=None):
+        # images: {position: image} to measure, defaults to the store frames
+        started = time.perf_counter()
+        images = images or store
+        versioned = hasattr(store, 'version')
+        reference = self._histograms(store, self.reference, images[self.reference])
+        luts = {}
+        for position in store.keys():
+            if position == self.reference:
+                luts[position] = IDENTITY_LUT
+                continue
+            key = (store.version(position), store.version(self.reference)) if versioned else None
+            with self._lock:
+                cached = self._luts.get(position)
+            if key is not None and cached and cached[0] == key:
+                luts[position] = cached[1]
+                continue
+            hists = self._histograms(store, position, images[position])
+            lut = matching_lut(reference, hists, self.strength)
+            if key is not None:
+                with self._lock:
+                    self._luts[position] = (key, lut)
+            luts[position] = lut
+        self.last_runtime = time.perf_counter() - started
+        return luts
+    
+    def apply(self, canvas, store, cell_size):
+        # Normalizes a rendered tile canvas in place, cell by cell
+        cells = {}
+        for position in store.keys():
+            x1, y1, x2, y2 = cell_rect(position, cell_size)
+            cells[position] = canvas[y1:y2, x1:x2]
+        for position, lut in self.luts(store, cells).items():
+            if lut is not IDENTITY_LUT:
+                cells[position][...] = cv2.LUT(cells[position], lut)
+        return canvas
+    
+    def normalize(self, store):
+        # {position: normalized frame}, for consumers that need whole frames
+        luts = self.luts(store)
+        return {position: cv2.LUT(store[position], luts[position]) for position in store.keys()}
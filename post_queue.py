@@ -0,0 +1,133 @@
+import itertools
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+import cv2
+
+from collage import COLLAGE_CELL, render_tiles, overlay_cache, overlay_settings
+from exam_file import write_exam, EXAM_EXTENSION
+
+# ---------------- EXAM JOBS ---------------- #
+
+_job_ids = itertools.count(1)
+
+class ExamJob:
+    def __init__(self, store, settings, label=None):
+        self.id = next(_job_ids)
+        self.label = label or f"Exam {self.id}"
+        self.store = store
+        self.settings = dict(settings)
+        self.stamp = datetime.now()
+        self.status = 'queued'
+        self.progress = 0.0
+        self.error = None
+        self.outputs = {}
+        self.durations = {}
+    
+    @property
+    def done(self):
+        return self.status in ('done', 'failed')
+    
+    def describe(self):
+        return {'id': self.id, 'label': self.label, 'status': self.status,
+                'progress': self.progress, 'error': self.error}
+
+# ---------------- POST-PROCESSING QUEUE ---------------- #
+
+class PostQueue:
+    # Finished capture sets are rendered and exported here, one at a time,
+    # while the operator is already capturing the next patient.
+    
+    def __init__(self, out_dir=None, registrar=None, normalizer=None, on_change=None,
+                 keep_finished=5):
+        self.out_dir = out_dir or os.getcwd()
+        self.registrar = registrar
+        self.normalizer = normalizer
+        self.on_change = on_change
+        self.keep_finished = keep_finished
+        self.jobs = []
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name='post-queue', daemon=True)
+        self._worker.start()
+    
+    def submit(self, store, settings, label=None):
+        job = ExamJob(store, settings, label)
+        with self._lock:
+            self.jobs.append(job)
+        self._changed(job)
+        self._queue.put(job)
+        return job
+    
+    def pending(self):
+        with self._lock:
+            return [job for job in self.jobs if not job.done]
+    
+    def snapshot(self):
+        with self._lock:
+            return [job.describe() for job in self.jobs]
+    
+    def _changed(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception:
+                pass
+    
+    def _step(self, job, status, progress):
+        job.status = status
+        job.progress = progress
+        self._changed(job)
+    
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._process(job)
+                self._step(job, 'done', 1.0)
+            except Exception as e:
+                job.error = str(e)
+                self._step(job, 'failed', job.progress)
+            finally:
+                # The originals now live in the exam file, or went with the
+                # failed job; either way the spill directory goes too
+                job.store.close()
+                self._prune()
+    
+    def _frames(self, job):
+        if not (self.registrar and job.settings.get('align_images', False)):
+            return job.store
+        aligned = threading.Event()
+        self.registrar.submit(job.store, on_done=aligned.set)
+        aligned.wait(timeout=30)
+        return self.registrar.aligned_images(job.store) or job.store
+    
+    def _process(self, job):
+        started = time.monotonic()
+        self._step(job, 'collage', 0.1)
+        frames = self._frames(job)
+        tiles = render_tiles(frames)
+        if self.normalizer and job.settings.get('normalize_tiles', False):
+            self.normalizer.apply(tiles, job.store, COLLAGE_CELL)
+        layers = overlay_settings(job.settings, job.stamp.strftime("%Y-%m-%d %H:%M:%S"))
+        collage = overlay_cache.composite(tiles, layers, COLLAGE_CELL)
+        job.durations['collage'] = time.monotonic() - started
+        
+        started = time.monotonic()
+        self._step(job, 'export', 0.5)
+        stamp = job.stamp.strftime('%Y%m%d_%H%M%S')
+        collage_path = os.path.join(self.out_dir, f"gaze_collage_{stamp}_{job.id}.jpg")
+        cv2.imwrite(collage_path, collage)
+        exam_path = os.path.join(self.out_dir, f"gaze_exam_{stamp}_{job.id}{EXAM_EXTENSION}")
+        write_exam(exam_path, job.store, collage=collage, settings=job.settings)
+        job.outputs.update(collage=collage_path, exam=exam_path)
+        job.durations['export'] = time.monotonic() - started
+    
+    def _prune(self):
+        with self._lock:
+            finished = [job for job in self.jobs if job.done]
+            for job in finished[:-self.keep_finished or None]:
+                self.jobs.remove(job)
@@ -0,0 +1,141 @@
+import sys
+import time
+
+import cv2
+import numpy as np
+
+# ---------------- MOTION DETECTION ---------------- #
+
+def motion_sample(frame, work_size=(32, 24)):
+    # Tiny grey thumbnail for frame differencing; decimating first keeps the
+    # resize cost negligible even for full-HD frames
+    step = max(1, frame.shape[1] // (work_size[0] * 4))
+    small = frame[::step, ::step]
+    if small.ndim == 3:
+        small = small[..., 1]
+    return cv2.resize(small, work_size, interpolation=cv2.INTER_AREA)
+
+def changed_fraction(a, b, threshold=12):
+    # Share of thumbnail pixels that changed by more than `threshold` levels;
+    # sensor noise and slow exposure drift stay below it
+    return float(np.count_nonzero(cv2.absdiff(a, b) > threshold)) / a.size
+
+# ---------------- IDLE GOVERNOR ---------------- #
+
+class IdleGovernor:
+    # Drops the preview to `idle_fps` once nothing has moved for `idle_after`
+    # seconds and returns to `active_fps` on the first frame with motion, or
+    # on a touch. observe() and touch() return True when the state changed,
+    # so the caller can reschedule its preview tick. CPU time and rendered
+    # frames are accounted separately for both states.
+    
+    def __init__(self, active_fps=30, idle_fps=2, idle_after=20.0, threshold=12,
+                 min_changed=0.01, work_size=(32, 24)):
+        self.active_fps = active_fps
+        self.idle_fps = idle_fps
+        self.idle_after = idle_after
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.work_size = work_size
+        self.state = 'active'
+        self.transitions = 0
+        self._sample = None
+        now = time.monotonic()
+        self._last_motion = now
+        self._entered = (now, time.process_time())
+        self._totals = {state: {'seconds': 0.0, 'cpu': 0.0, 'frames': 0}
+                        for state in ('active', 'idle')}
+    
+    @property
+    def idle(self):
+        return self.state == 'idle'
+    
+    @property
+    def interval(self):
+        return 1 / (self.idle_fps if self.idle else self.active_fps)
+    
+    def observe(self, frame, now=None):
+        now = time.monotonic() if now is None else now
+        self._totals[self.state]['frames'] += 1
+        sample = motion_sample(frame, self.work_size)
+        previous, self._sample = self._sample, sample
+        if previous is not None and changed_fraction(previous, sample, self.threshold) >= self.min_changed:
+            self._last_motion = now
+            if self.idle:
+                self._switch('active', now)
+                return True
+        elif not self.idle and now - self._last_motion >= self.idle_after:
+            self._switch('idle', now)
+            return True
+        return False
+    
+    def touch(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._last_motion = now
+        if self.idle:
+            self._switch('active', now)
+            return True
+        return False
+    
+    def _switch(self, state, now):
+        self._account(now)
+        self.state = state
+        self.transitions += 1
+    
+    def _account(self, now):
+        started, cpu_started = self._entered
+        cpu = time.process_time()
+        totals = self._totals[self.state]
+        totals['seconds'] += now - started
+        totals['cpu'] += cpu - cpu_started
+        self._entered = (now, cpu)
+    
+    def stats(self):
+        self._account(time.monotonic())
+        stats = {'state': self.state, 'transitions': self.transitions}
+        for state, totals in self._totals.items():
+            seconds = totals['seconds']
+            stats[state] = {
+                'seconds': round(seconds, 1),
+                'fps': round(totals['frames'] / seconds, 1) if seconds else None,
+                # Whole-process CPU, as a share of one core
+                'cpu_percent': round(100 * totals['cpu'] / seconds, 1) if seconds else None
+            }
+        return stats
+
+# ---------------- BENCHMARK ---------------- #
+
+def benchmark(seconds=4.0, idle_after=1.0):
+    # Runs a preview loop like GazeScreen.update_camera on the simulated
+    # camera: a moving target for `seconds`, then a still scene for as long
+    from exposure import SimulatedCamera
+    
+    camera = SimulatedCamera(fps=30)
+    governor = IdleGovernor(idle_after=idle_after)
+    started = time.monotonic()
+    next_tick = started
+    while time.monotonic() - started < 2 * seconds:
+        now = time.monotonic()
+        if now < next_tick:
+            time.sleep(next_tick - now)
+        next_tick += governor.interval
+        _, frame = camera.read()
+        if time.monotonic() - started < seconds:
+            x = int(80 + 480 * ((time.monotonic() - started) % 1.0))
+            cv2.circle(frame, (x, 240), 40, (255, 255, 255), -1)
+        frame = cv2.flip(frame, 1)
+        governor.observe(frame)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB).tobytes()
+    return governor.stats()
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    stats = benchmark(float(argv[0]) if argv else 4.0)
+    for state in ('active', 'idle'):
+        s = stats[state]
+        print(f"{state:>6}: {s['seconds']:.1f} s, {s['fps']} fps, {s['cpu_percent']}% CPU")
+    print(f"transitions: {stats['transitions']}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import hmac
+import json
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, quote
+
+import cv2
+
+DEFAULT_PORT = 8766
+BOUNDARY = b'gazeframe'
+
+# (max width, JPEG quality) from best to cheapest
+STREAM_LEVELS = [(1280, 80), (960, 75), (800, 70), (640, 65), (480, 60), (320, 50)]
+
+VIEWER_PAGE = b"""<!doctype html>
+<html><head><title>9-Gaze live preview</title></head>
+<body style="margin:0;background:#111;display:flex;justify-content:center;align-items:center;height:100vh">
+<img src="/stream?token={token}" style="max-width:100%;max-height:100%">
+</body></html>"""
+TOKEN_HEADER = 'X-Gaze-Token'
+
+# ---------------- ENCODE-ONCE BROADCASTER ---------------- #
+
+class PreviewStreamer:
+    # publish() only swaps in a reference to the newest preview frame; a
+    # single encoder thread JPEG-encodes the latest frame once and every
+    # connected viewer is sent those same bytes. Encode size and quality step
+    # down whenever encoding would take more than `cpu_share` of the preview
+    # frame interval, so streaming never competes with the local preview.
+    # Viewers must present `token`, as ?token= or an X-Gaze-Token header; the
+    # server only listens on loopback unless `host` says otherwise.
+    
+    def __init__(self, token, host='127.0.0.1', port=DEFAULT_PORT, max_fps=15, cpu_share=0.25,
+                 level=2, write_timeout=2.0):
+        if not token:
+            raise ValueError("a viewer token is required")
+        self.token = token
+        self.host = host
+        self.port = port
+        self.max_fps = max_fps
+        self.cpu_share = cpu_share
+        self.level = level
+        self.write_timeout = write_timeout
+        self.clients = 0
+        self.stats_counts = {'published': 0, 'encoded': 0, 'sent': 0, 'bytes_sent': 0,
+                             'dropped_clients': 0}
+        self._latest = None
+        self._published_at = None
+        self._preview_interval = 1 / 30
+        self._encode_ms = 0.0
+        self._calm = 0
+        self._jpeg = (0, None)
+        self._new_frame = threading.Event()
+        self._cond = threading.Condition()
+        self._clients_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._running = False
+        self._server = None
+        self._threads = []
+    
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        handler = type('Handler', (PreviewRequestHandler,), {'streamer': self})
+        self._server = ThreadingHTTPServer((self.host, self.port), handler)
+        self._server.daemon_threads = True
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name='stream-http', daemon=True),
+            threading.Thread(target=self._encode_loop, name='stream-encode', daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+    
+    def stop(self):
+        if not self._running:
+            return
+        self._running = False
+        self._new_frame.set()
+        with self._cond:
+            self._cond.notify_all()
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+    
+    @property
+    def address(self):
+        return self._server.server_address if self._server else None
+    
+    def publish(self, frame):
+        # Called from the UI thread for every rendered preview frame; O(1)
+        now = time.monotonic()
+        if self._published_at is not None:
+            # Smoothed local preview frame interval
+            self._preview_interval += 0.1 * (now - self._published_at - self._preview_interval)
+        self._published_at = now
+        if not self.clients:
+            return
+        self._latest = frame
+        self._count(published=1)
+        self._new_frame.set()
+    
+    def _encode_loop(self):
+        last_encode = 0.0
+        while self._running:
+            self._new_frame.wait()
+            self._new_frame.clear()
+            frame, self._latest = self._latest, None
+            if frame is None or not self._running:
+                continue
+            # Never encode faster than the fastest viewer may receive
+            wait = last_encode + 1 / self.max_fps - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                frame = self._latest if self._latest is not None else frame
+                self._latest = None
+            last_encode = time.monotonic()
+            
+            started = time.perf_counter()
+            width, quality = STREAM_LEVELS[self.level]
+            if frame.shape[1] > width:
+                frame = cv2.resize(frame, (width, frame.shape[0] * width // frame.shape[1]),
+                                   interpolation=cv2.INTER_AREA)
+            ok, buf = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                continue
+            elapsed = time.perf_counter() - started
+            self._adapt(elapsed)
+            
+            with self._cond:
+                self._jpeg = (self._jpeg[0] + 1, buf.tobytes())
+                self._cond.notify_all()
+            self._count(encoded=1)
+    
+    def _adapt(self, elapsed):
+        self._encode_ms += 0.2 * (elapsed * 1000 - self._encode_ms)
+        budget = self.cpu_share * self._preview_interval
+        if elapsed > budget and self.level < len(STREAM_LEVELS) - 1:
+            self.level += 1
+            self._calm = 0
+        elif elapsed < budget / 3:
+            # Step back up only after a sustained period of headroom
+            self._calm += 1
+            if self._calm >= 30 and self.level > 0:
+                self.level -= 1
+                self._calm = 0
+        else:
+            self._calm = 0
+    
+    def _count(self, **deltas):
+        # Viewer threads count concurrently
+        with self._stats_lock:
+            for key, delta in deltas.items():
+                self.stats_counts[key] += delta
+    
+    def _client(self, delta):
+        with self._clients_lock:
+            self.clients += delta
+    
+    def next_jpeg(self, after, timeout=1.0):
+        # Blocks until a frame newer than `after` is encoded; (seq, bytes)
+        with self._cond:
+            self._cond.wait_for(lambda: self._jpeg[0] > after or not self._running, timeout)
+            return self._jpeg
+    
+    def stats(self):
+        width, quality = STREAM_LEVELS[self.level]
+        with self._stats_lock:
+            counts = dict(self.stats_counts)
+        return dict(counts, clients=self.clients, width=width, quality=quality,
+                    encode_ms=round(self._encode_ms, 2),
+                    preview_fps=round(1 / self._preview_interval, 1) if self._preview_interval else None)
+
+# ---------------- HTTP VIEWERS ---------------- #
+
+class PreviewRequestHandler(BaseHTTPRequestHandler):
+    streamer = None
+    
+    def log_message(self, format, *args):
+        pass
+    
+    def do_GET(self):
+        url = urlparse(self.path)
+        supplied = self.headers.get(TOKEN_HEADER) or parse_qs(url.query).get('token', [''])[0]
+        if not hmac.compare_digest(supplied.encode('utf-8'), self.streamer.token.encode('utf-8')):
+            return self._send(401, b'missing or wrong token', 'text/plain')
+        if url.path == '/':
+            page = VIEWER_PAGE.replace(b'{token}', quote(self.streamer.token).encode('ascii'))
+            return self._send(200, page, 'text/html')
+        if url.path == '/stats':
+            return self._send(200, json.dumps(self.streamer.stats()).encode('utf-8'), 'application/json')
+        if url.path == '/snapshot.jpg':
+            # Counts as a viewer while it waits, so the encoder runs; the
+            # last frame from an earlier viewer may be long out of date, so
+            # only a newly encoded one is returned
+            self.streamer._client(1)
+            last = self.streamer._jpeg[0]
+            try:
+                seq, data = self.streamer.next_jpeg(last, timeout=2.0)
+            finally:
+                self.streamer._client(-1)
+            if seq == last:
+                return self._send(503, b'no frame yet', 'text/plain')
+            return self._send(200, data, 'image/jpeg')
+        if url.path == '/stream':
+            try:
+                fps = float(parse_qs(url.query).get('fps', [self.streamer.max_fps])[0])
+            except ValueError:
+                fps = self.streamer.max_fps
+            return self._stream(max(0.5, min(fps, self.streamer.max_fps)))
+        self._send(404, b'not found', 'text/plain')
+    
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _stream(self, fps):
+        streamer = self.streamer
+        self.send_response(200)
+        self.send_header('Content-Type', f"multipart/x-mixed-replace; boundary={BOUNDARY.decode()}")
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        # A viewer that cannot take a frame within the timeout is dropped
+        self.connection.settimeout(streamer.write_timeout)
+        streamer._client(1)
+        seq = 0
+        interval = 1 / fps
+        next_due = 0.0
+        try:
+            while streamer._running:
+                latest, data = streamer.next_jpeg(seq)
+                if latest == seq:
+                    # Timed out: the viewer already has this frame
+                    continue
+                seq = latest
+                now = time.monotonic()
+                if now < next_due:
+                    # Per-viewer throttle: wait, then send whatever is newest
+                    # instead of queueing every frame
+                    time.sleep(next_due - now)
+                    seq, data = streamer.next_jpeg(seq, timeout=0)
+                next_due = max(now, next_due) + interval
+                self.wfile.write(b'--' + BOUNDARY + b'\r\nContent-Type: image/jpeg\r\n'
+                                 + f"Content-Length: {len(data)}\r\n\r\n".encode('ascii')
+                                 + data + b'\r\n')
+                streamer._count(sent=1, bytes_sent=len(data))
+        except socket.timeout:
+            streamer._count(dropped_clients=1)
+        except OSError:
+            pass
+        finally:
+            streamer._client(-1)
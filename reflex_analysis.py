@@ -0,0 +1,199 @@
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from task_executor import submit_keyed
+
+# ---------------- EYE REGIONS ---------------- #
+
+def _load_eye_cascade():
+    try:
+        path = os.path.join(cv2.data.haarcascades, 'haarcascade_eye.xml')
+        cascade = cv2.CascadeClassifier(path)
+        return None if cascade.empty() else cascade
+    except Exception:
+        return None
+
+_eye_cascade = _load_eye_cascade()
+
+def eye_regions(gray, work_width=320):
+    # (x, y, w, h) of the image-left and image-right eye. The preview is
+    # mirrored, so image-right is the patient's right eye (OD).
+    h, w = gray.shape[:2]
+    if _eye_cascade is not None:
+        scale = min(1.0, work_width / w)
+        small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        found = _eye_cascade.detectMultiScale(small, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(int(small.shape[1] * 0.08),) * 2)
+        if len(found) >= 2:
+            # Two largest detections, ordered left to right
+            best = sorted(found, key=lambda r: r[2] * r[3], reverse=True)[:2]
+            best = sorted(best, key=lambda r: r[0])
+            return [tuple(int(v / scale) for v in r) for r in best]
+    # Without a detector assume the eyes fill the middle band of the frame
+    band_y, band_h = int(h * 0.2), int(h * 0.6)
+    return [(0, band_y, w // 2, band_h), (w // 2, band_y, w - w // 2, band_h)]
+
+# ---------------- PUPIL AND REFLEX ---------------- #
+
+def _largest_round_blob(mask, min_area, max_area, min_circularity=0.4):
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    best = None
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area or area > max_area:
+            continue
+        perimeter = cv2.arcLength(contour, True)
+        circularity = 4 * np.pi * area / (perimeter * perimeter) if perimeter else 0
+        if circularity >= min_circularity and (best is None or area > best[0]):
+            best = (area, contour)
+    return best[1] if best else None
+
+def _centroid(contour):
+    m = cv2.moments(contour)
+    if not m['m00']:
+        return None
+    return m['m10'] / m['m00'], m['m01'] / m['m00']
+
+def analyse_eye(roi):
+    # Pupil centre/radius and corneal reflex position inside one eye ROI
+    area = roi.shape[0] * roi.shape[1]
+    blurred = cv2.GaussianBlur(roi, (5, 5), 0)
+    
+    # Pupil: pixels close to the darkest level of the ROI, cleaned up and
+    # taken as the largest roughly circular blob
+    dark = int(blurred.min()) + 25
+    mask = (blurred <= dark).astype(np.uint8) * 255
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    pupil = _largest_round_blob(mask, area * 0.002, area * 0.25)
+    if pupil is None:
+        return None
+    (px, py), radius = cv2.minEnclosingCircle(pupil)
+    
+    # Reflex: brightest spot near the pupil (within ~3 pupil radii)
+    yy, xx = np.ogrid[:roi.shape[0], :roi.shape[1]]
+    near = (xx - px) ** 2 + (yy - py) ** 2 <= (3 * radius) ** 2
+    bright = max(200, np.percentile(roi[near], 99.5)) if near.any() else 255
+    spot = ((roi >= bright) & near).astype(np.uint8) * 255
+    contours, _ = cv2.findContours(spot, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    reflex = None
+    if contours:
+        # Closest bright spot to the pupil centre
+        centres = [c for c in (_centroid(c) for c in contours) if c is not None]
+        if centres:
+            reflex = min(centres, key=lambda c: (c[0] - px) ** 2 + (c[1] - py) ** 2)
+    
+    result = {'pupil': (round(px, 1), round(py, 1)), 'pupil_radius': round(radius, 1)}
+    if reflex is not None:
+        dx, dy = reflex[0] - px, reflex[1] - py
+        result.update(
+            reflex=(round(reflex[0], 1), round(reflex[1], 1)),
+            displacement=(round(dx, 1), round(dy, 1)),
+            # Decentration in pupil radii, independent of camera distance
+            relative=(round(dx / radius, 2), round(dy / radius, 2)) if radius else None
+        )
+    return result
+
+def analyse_frame(frame):
+    started = time.perf_counter()
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    eyes = {}
+    for name, (x, y, w, h) in zip(('OS', 'OD'), eye_regions(gray)):
+        eye = analyse_eye(gray[y:y + h, x:x + w])
+        if eye:
+            # Report in full-frame coordinates
+            eye['pupil'] = (eye['pupil'][0] + x, eye['pupil'][1] + y)
+            if 'reflex' in eye:
+                eye['reflex'] = (eye['reflex'][0] + x, eye['reflex'][1] + y)
+        eyes[name] = eye
+    return {'eyes': eyes, 'runtime': time.perf_counter() - started}
+
+# ---------------- ANALYSER ---------------- #
+
+class ReflexAnalyser:
+    # Analyses each capture on a worker thread as soon as it is stored and
+    # caches the result by capture version, per store. With an AnalysisPool as
+    # `offload` the thread hands the frame to a worker process instead.
+    
+    def __init__(self, max_workers=2, pool=None, offload=None):
+        self.pool = pool or ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='analysis')
+        self.offload = offload
+        # store -> {position: ...}; an exam's entries go with its store
+        self.results = weakref.WeakKeyDictionary()
+        self.pending = weakref.WeakKeyDictionary()
+        self._callbacks = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+    
+    def _claim(self, store, position):
+        # Marks a capture as pending unless it is cached or already queued
+        version = store.version(position)
+        cached = self.results.get(store, {}).get(position)
+        pending = self.pending.setdefault(store, {})
+        if (cached and cached['version'] == version) or pending.get(position) == version:
+            return None
+        pending[position] = version
+        return version
+    
+    def submit(self, store, position=None, on_done=None):
+        # Analyse one position, or every stored position when none is given
+        positions = store.keys() if position is None else [position]
+        with self._lock:
+            if on_done:
+                self._callbacks.setdefault(store, []).append(on_done)
+            claimed = [(p, self._claim(store, p)) for p in positions]
+        futures = [submit_keyed(self.pool, self._analyse, store, p, version,
+                                key=('analyse', id(self), id(store), p))
+                   for p, version in claimed if version is not None]
+        for future in futures:
+            future.add_done_callback(lambda f: self._job_done(store))
+        if not futures:
+            self._job_done(store)
+    
+    def _job_done(self, store):
+        with self._lock:
+            if self.pending.get(store):
+                return
+            callbacks = self._callbacks.pop(store, [])
+        for callback in callbacks:
+            callback()
+    
+    def _analyse(self, store, position, version):
+        try:
+            result = None
+            if self.offload:
+                try:
+                    result = self.offload.run_shared(analyse_frame, store, (position,))
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory): stay in-process
+                    self.offload = None
+            if result is None:
+                result = analyse_frame(store[position])
+        except Exception as e:
+            result = {'eyes': {}, 'runtime': 0.0, 'error': str(e)}
+        result['version'] = version
+        with self._lock:
+            pending = self.pending.get(store, {})
+            if pending.get(position) == version:
+                del pending[position]
+                self.results.setdefault(store, {})[position] = result
+    
+    def results_for(self, store):
+        # Results for the current captures, or None while any is outstanding
+        with self._lock:
+            stored = self.results.get(store, {})
+            results = {}
+            for position in store.keys():
+                result = stored.get(position)
+                if not result or result['version'] != store.version(position):
+                    return None
+                results[position] = result
+            return results
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
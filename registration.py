@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+from task_executor import submit_keyed
+
+# ---------------- TRANSFORM ESTIMATION ---------------- #
+
+IDENTITY = np.array([[1, 0, 0], [0, 1, 0]], dtype=np.float32)
+
+def prepare(frame, work_width=480):
+    # Grayscale working copy and its scale relative to the full frame
+    scale = min(1.0, work_width / frame.shape[1])
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    if scale != 1.0:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return gray, scale
+
+def estimate_features(reference, moving, orb=None, min_inliers=12):
+    # Similarity transform (scale, rotation, shift) from ORB matches
+    orb = orb or cv2.ORB_create(1000)
+    kp_ref, des_ref = orb.detectAndCompute(reference, None)
+    kp_mov, des_mov = orb.detectAndCompute(moving, None)
+    if des_ref is None or des_mov is None:
+        return None, 0
+    matcher = cv2.BFMatcher(cv2.NORM_HAMMING, crossCheck=True)
+    matches = matcher.match(des_mov, des_ref)
+    if len(matches) < min_inliers:
+        return None, 0
+    src = np.float32([kp_mov[m.queryIdx].pt for m in matches])
+    dst = np.float32([kp_ref[m.trainIdx].pt for m in matches])
+    matrix, inliers = cv2.estimateAffinePartial2D(src, dst, method=cv2.RANSAC,
+                                                  ransacReprojThreshold=3.0)
+    count = int(inliers.sum()) if inliers is not None else 0
+    if matrix is None or count < min_inliers:
+        return None, count
+    return matrix.astype(np.float32), count
+
+def estimate_ecc(reference, moving, levels=3, iterations=50):
+    # Coarse-to-fine ECC; returns the moving -> reference affine transform
+    pyramid = [(reference, moving)]
+    for _ in range(levels - 1):
+        r, m = pyramid[-1]
+        pyramid.append((cv2.pyrDown(r), cv2.pyrDown(m)))
+    warp = IDENTITY.copy()
+    criteria = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, iterations, 1e-4)
+    for level, (r, m) in enumerate(reversed(pyramid)):
+        if level:
+            warp[:, 2] *= 2
+        try:
+            _, warp = cv2.findTransformECC(r, m, warp, cv2.MOTION_AFFINE, criteria, None, 5)
+        except cv2.error:
+            return None
+    return cv2.invertAffineTransform(warp)
+
+def residual_error(reference, moving, matrix):
+    # Mean absolute grey-level difference over the overlapping area
+    h, w = reference.shape[:2]
+    warped = cv2.warpAffine(moving, matrix, (w, h))
+    mask = cv2.warpAffine(np.full(moving.shape[:2], 255, np.uint8), matrix, (w, h)) > 0
+    if not mask.any():
+        return float('inf')
+    return float(cv2.absdiff(reference, warped)[mask].mean())
+
+def to_full_resolution(matrix, scale):
+    full = matrix.copy()
+    full[:, 2] /= scale
+    return full
+
+def estimate_transform(ref_gray, moving, scale):
+    # Features first, ECC as the fallback; fields for a registration result
+    matrix, inliers = estimate_features(ref_gray, moving)
+    method = 'features'
+    if matrix is None:
+        matrix = estimate_ecc(ref_gray, moving)
+        method = 'ecc'
+    if matrix is None:
+        return {}
+    return {'method': method, 'inliers': inliers,
+            'residual': residual_error(ref_gray, moving, matrix),
+            'matrix': to_full_resolution(matrix, scale)}
+
+def register_frames(reference, moving, work_width=480):
+    # Self-contained version for worker processes (see analysis_pool)
+    ref_gray, scale = prepare(reference, work_width)
+    return estimate_transform(ref_gray, prepare(moving, work_width)[0], scale)
+
+# ---------------- BATCH REGISTRATION ---------------- #
+
+class Registrar:
+    # Registers every gaze image to the reference (primary gaze) position on
+    # a thread pool. Results are cached by capture version, so after a retake
+    # only that position, or everything if the reference changed, is redone.
+    # Results are kept per store, so several exams (queued or imported) can
+    # be registered side by side.
+    # `pool` may be any executor with submit() (e.g. a TaskExecutor lane);
+    # with an AnalysisPool as `offload` the estimation runs in its worker
+    # processes on shared frames.
+    
+    def __init__(self, reference=1, max_workers=None, work_width=480, pool=None, offload=None):
+        self.reference = reference
+        self.work_width = work_width
+        self.offload = offload
+        self.pool = pool or ThreadPoolExecutor(max_workers=max_workers or min(8, os.cpu_count() or 2),
+                                               thread_name_prefix='registration')
+        # store -> {position: ...}; an exam's entries go with its store
+        self.results = weakref.WeakKeyDictionary()
+        self.pending = weakref.WeakKeyDictionary()
+        self._callbacks = weakref.WeakKeyDictionary()
+        self._ref = None
+        self._lock = threading.Lock()
+    
+    def _key(self, store, position):
+        return (store.version(position), store.version(self.reference))
+    
+    def is_current(self, store):
+        with self._lock:
+            results = self.results.get(store, {})
+            return all(
+                position in results and results[position]['key'] == self._key(store, position)
+                for position in store.keys() if position != self.reference
+            )
+    
+    def submit(self, store, on_done=None):
+        jobs = []
+        with self._lock:
+            if on_done:
+                self._callbacks.setdefault(store, []).append(on_done)
+            results = self.results.get(store, {})
+            pending = self.pending.setdefault(store, {})
+            for position in store.keys():
+                if position == self.reference:
+                    continue
+                key = self._key(store, position)
+                cached = results.get(position)
+                if (cached and cached['key'] == key) or pending.get(position) == key:
+                    continue
+                pending[position] = key
+                jobs.append((position, key))
+        # Outside the lock: a retake supersedes the position's queued
+        # registration, whose done callback then runs right away
+        futures = [submit_keyed(self.pool, self._register, store, position, key,
+                                key=('register', id(self), id(store), position))
+                   for position, key in jobs]
+        for future in futures:
+            future.add_done_callback(lambda f: self._job_done(store))
+        if not futures:
+            self._job_done(store)
+    
+    def _job_done(self, store):
+        with self._lock:
+            if self.pending.get(store):
+                return
+            callbacks = self._callbacks.pop(store, [])
+        for callback in callbacks:
+            callback()
+    
+    def _reference(self, store):
+        version = store.version(self.reference)
+        with self._lock:
+            if self._ref and self._ref[0] == version:
+                return self._ref[1], self._ref[2]
+        gray, scale = prepare(store[self.reference], self.work_width)
+        with self._lock:
+            self._ref = (version, gray, scale)
+        return gray, scale
+    
+    def _register(self, store, position, key):
+        started = time.perf_counter()
+        result = {'key': key, 'method': 'identity', 'matrix': IDENTITY.copy(),
+                  'residual': None, 'inliers': 0}
+        try:
+            offloaded = None
+            if self.offload:
+                try:
+                    offloaded = self.offload.run_shared(register_frames, store, (self.reference, position),
+                                                        self.work_width)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed for memory): stay in-process
+                    self.offload = None
+            if offloaded is not None:
+                result.update(offloaded)
+            else:
+                ref_gray, scale = self._reference(store)
+                moving, _ = prepare(store[position], self.work_width)
+                result.update(estimate_transform(ref_gray, moving, scale))
+        except Exception as e:
+            result['error'] = str(e)
+        result['runtime'] = time.perf_counter() - started
+        with self._lock:
+            # A result for captures retaken meanwhile would overwrite a newer one
+            pending = self.pending.get(store, {})
+            if pending.get(position) == key:
+                del pending[position]
+                self.results.setdefault(store, {})[position] = result
+    
+    def aligned_images(self, store):
+        # Full-resolution frames warped onto the reference, or None while
+        # any registration for the current captures is outstanding
+        if not self.is_current(store):
+            return None
+        with self._lock:
+            results = dict(self.results[store])
+        aligned = {}
+        for position in store.keys():
+            frame = store[position]
+            if position == self.reference:
+                aligned[position] = frame
+                continue
+            h, w = frame.shape[:2]
+            aligned[position] = cv2.warpAffine(frame, results[position]['matrix'], (w, h),
+                                               flags=cv2.INTER_LINEAR,
+                                               borderMode=cv2.BORDER_REPLICATE)
+        return aligned
+    
+    def report(self, store):
+        with self._lock:
+            return {
+                position: {
+                    'method': r['method'],
+                    'runtime_ms': round(r['runtime'] * 1000, 1),
+                    'residual': None if r['residual'] is None else round(r['residual'], 2),
+                    'inliers': r['inliers']
+                }
+                for position, r in sorted(self.results.get(store, {}).items())
+            }
+    
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
@@ -0,0 +1,193 @@
+import glob
+import importlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+import cv2
+
+from collage import render_collage, overlay_settings, layout_hash
+from exam_file import ExamReader, EXAM_EXTENSION
+
+MANIFEST_NAME = 'rerender_manifest.json'
+
+def processes_available():
+    # multiprocessing needs a working sem_open, which Android lacks; this
+    # module fails to import without it
+    try:
+        importlib.import_module('multiprocessing.synchronize')
+    except ImportError:
+        return False
+    return True
+
+# ---------------- WORKER ---------------- #
+
+def rerender_exam(exam_path, out_path, settings):
+    # Runs in a pool process: decodes the stored originals, renders the
+    # collage with the given settings and writes it atomically
+    started = time.perf_counter()
+    with ExamReader(exam_path) as reader:
+        frames = {position: reader.frame(position) for position in reader.positions}
+        created = reader.created
+    if len(frames) != 9:
+        raise ValueError(f"{exam_path} has {len(frames)} of 9 frames")
+    try:
+        timestamp = datetime.fromisoformat(created).strftime("%Y-%m-%d %H:%M:%S")
+    except (TypeError, ValueError):
+        timestamp = None
+    collage = render_collage(frames, layers=overlay_settings(settings, timestamp))
+    ok, buf = cv2.imencode('.jpg', collage, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    if not ok:
+        raise ValueError("Could not encode collage")
+    tmp_path = out_path + '.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(buf.tobytes())
+    os.replace(tmp_path, out_path)
+    return time.perf_counter() - started
+
+# ---------------- RE-RENDER JOB ---------------- #
+
+class CollageRerenderer:
+    # Rebuilds the collages of past exams with the current layout settings.
+    # A manifest records, per exam, the settings hash its collage was last
+    # rendered with; it is rewritten after every finished exam, so an
+    # interrupted run resumes where it stopped and unchanged exams are skipped.
+    # Exams render on `pool` when given (the app passes its AnalysisPool,
+    # whose workers were forked at startup); otherwise on a process pool of
+    # its own, or on threads with `processes=False` or without sem_open.
+
+    def __init__(self, settings, out_dir=None, max_workers=None, manifest_path=None,
+                 pool=None, processes=True):
+        self.settings = dict(settings)
+        self.hash = layout_hash(self.settings)
+        self.out_dir = out_dir or os.path.join(os.getcwd(), 'collages')
+        self.max_workers = max_workers or max(1, min(4, (os.cpu_count() or 2) - 1))
+        self.pool = pool
+        self.processes = processes and processes_available()
+        self.manifest_path = manifest_path or os.path.join(self.out_dir, MANIFEST_NAME)
+        self.manifest = self._load_manifest()
+        self._cancelled = threading.Event()
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        tmp_path = self.manifest_path + '.part'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_path, self.manifest_path)
+
+    def output_path(self, exam_path):
+        stem = os.path.splitext(os.path.basename(exam_path))[0]
+        return os.path.join(self.out_dir, f"{stem}_collage.jpg")
+
+    def is_current(self, exam_path):
+        entry = self.manifest.get(os.path.abspath(exam_path))
+        try:
+            mtime = os.path.getmtime(exam_path)
+        except OSError:
+            return False
+        return (entry is not None and entry['hash'] == self.hash and entry['mtime'] == mtime
+                and os.path.exists(entry['output']))
+
+    def plan(self, exam_paths):
+        return [path for path in exam_paths if not self.is_current(path)]
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def _executor(self):
+        if self.processes:
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='rerender')
+
+    def run(self, exam_paths, on_progress=None):
+        # Blocking; call from a worker thread. on_progress(done, total) is
+        # called after each exam. Returns a summary dict.
+        os.makedirs(self.out_dir, exist_ok=True)
+        todo = self.plan(exam_paths)
+        summary = {'total': len(exam_paths), 'skipped': len(exam_paths) - len(todo),
+                   'rendered': 0, 'failed': {}, 'cancelled': False, 'seconds': 0.0}
+        if not todo:
+            return summary
+        started = time.perf_counter()
+        own_pool = self._executor() if self.pool is None else None
+        pool = own_pool or self.pool
+        try:
+            futures = {pool.submit(rerender_exam, path, self.output_path(path), self.settings): path
+                       for path in todo}
+            done = 0
+            for future in as_completed(futures):
+                path = futures[future]
+                done += 1
+                try:
+                    future.result()
+                    self.manifest[os.path.abspath(path)] = {
+                        'hash': self.hash,
+                        'mtime': os.path.getmtime(path),
+                        'output': self.output_path(path),
+                        'rendered': datetime.now().isoformat(timespec='seconds')
+                    }
+                    self._save_manifest()
+                    summary['rendered'] += 1
+                except Exception as e:
+                    summary['failed'][path] = str(e)
+                if on_progress:
+                    on_progress(done, len(todo))
+                if self._cancelled.is_set():
+                    summary['cancelled'] = True
+                    for pending in futures:
+                        pending.cancel()
+                    break
+        finally:
+            if own_pool:
+                own_pool.shutdown(wait=True, cancel_futures=True)
+        summary['seconds'] = round(time.perf_counter() - started, 2)
+        return summary
+
+def find_exams(directory=None):
+    return sorted(glob.glob(os.path.join(directory or os.getcwd(), f"gaze_exam_*{EXAM_EXTENSION}")))
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    settings_path = 'kivy_settings.json'
+    out_dir = None
+    workers = None
+    paths = []
+    args = iter(argv)
+    for arg in args:
+        if arg == '--settings':
+            settings_path = next(args)
+        elif arg == '--out':
+            out_dir = next(args)
+        elif arg == '-j':
+            workers = int(next(args))
+        else:
+            paths.extend(sorted(glob.glob(arg)) or [arg])
+    try:
+        with open(settings_path, 'r') as f:
+            settings = json.load(f)
+    except (OSError, ValueError):
+        settings = {}
+    rerenderer = CollageRerenderer(settings, out_dir=out_dir, max_workers=workers)
+    paths = paths or find_exams()
+    summary = rerenderer.run(
+        paths, on_progress=lambda done, total: print(f"\r{done}/{total}", end='', flush=True))
+    print(f"\nrendered {summary['rendered']}, skipped {summary['skipped']}, "
+          f"failed {len(summary['failed'])} in {summary['seconds']} s")
+    for path, error in summary['failed'].items():
+        print(f"  {path}: {error}")
+    return 1 if summary['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,309 @@
+import fnmatch
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from exam_file import compact_exam_steps, read_exam_header, EXAM_EXTENSION
+
+DAY = 24 * 3600
+
+# ---------------- UPLOAD LEDGER ---------------- #
+
+class UploadLedger:
+    # Exams that still have to be uploaded; the storage manager never
+    # transcodes or deletes anything listed here
+    
+    def __init__(self, path='pending_uploads.json'):
+        self.path = path
+        self._lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._paths = set(json.load(f))
+        except (OSError, ValueError):
+            self._paths = set()
+    
+    def add(self, *paths):
+        with self._lock:
+            self._paths.update(os.path.abspath(p) for p in paths if p)
+            self._save()
+    
+    def remove(self, *paths):
+        with self._lock:
+            self._paths.difference_update(os.path.abspath(p) for p in paths if p)
+            self._save()
+    
+    def paths(self):
+        with self._lock:
+            return set(self._paths)
+    
+    def _save(self):
+        tmp_path = self.path + '.part'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(sorted(self._paths), f, indent=1)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+# ---------------- ARTIFACT CLASSES ---------------- #
+
+# (category, glob) in the working directory. Exams, collages and reports are
+# patient records and are never deleted; previews are re-renderable and
+# clips are secondary, so those two are evicted when over quota.
+ARTIFACTS = [
+    ('exam', f"gaze_exam_*{EXAM_EXTENSION}"),
+    ('collage', "gaze_collage_*.jpg"),
+    ('report', "gaze_report_*.pdf"),
+    ('clip', "gaze_clip_*.mp4"),
+    ('temp', "temp_share_collage_*.jpg"),
+    ('partial', "*.part"),
+    ('preview', os.path.join('collages', '*_collage.jpg'))
+]
+
+EVICTION_ORDER = ('preview', 'clip')
+
+# ---------------- STORAGE MANAGER ---------------- #
+
+class StorageManager:
+    # Enforces a disk quota and retention policy on the exam artifacts.
+    # Work is split into small steps (one file or one exam each) and run in
+    # short time slices on a background thread; pause() stops all work, e.g.
+    # while an examination is being captured.
+    
+    def __init__(self, root=None, quota_bytes=2 * 1024 ** 3, archive_after_days=30,
+                 archive_quality=85, temp_max_age=3600, clip_min_age_days=7,
+                 protected=None, slice_seconds=0.05, interval=2.0, scan_interval=300):
+        self.root = root or os.getcwd()
+        self.quota_bytes = quota_bytes
+        self.archive_after_days = archive_after_days
+        self.archive_quality = archive_quality
+        self.temp_max_age = temp_max_age
+        self.clip_min_age_days = clip_min_age_days
+        self.protected = protected or (lambda: set())
+        self.slice_seconds = slice_seconds
+        self.interval = interval
+        self.scan_interval = scan_interval
+        self.stats = {'scans': 0, 'deleted': 0, 'evicted': 0, 'archived': 0,
+                      'bytes_freed': 0, 'usage_bytes': 0, 'over_quota': False, 'errors': 0}
+        self._steps = None
+        self._last_scan = 0.0
+        self._running = False
+        self._paused = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    # Background control
+    
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name='storage', daemon=True)
+            self._thread.start()
+    
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+    
+    def pause(self):
+        self._paused.set()
+    
+    def resume(self):
+        self._paused.clear()
+    
+    def request_scan(self):
+        self._last_scan = 0.0
+        self._wake.set()
+    
+    def _run(self):
+        while self._running:
+            if not self._paused.is_set():
+                self.run_slice()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def run_slice(self, budget=None):
+        # Advances the current pass for at most `budget` seconds; returns
+        # True while work remains
+        budget = self.slice_seconds if budget is None else budget
+        if self._steps is None:
+            if time.time() - self._last_scan < self.scan_interval:
+                return False
+            self._last_scan = time.time()
+            self._steps = self._pass()
+        deadline = time.perf_counter() + budget
+        while time.perf_counter() < deadline and not self._paused.is_set():
+            try:
+                next(self._steps)
+            except StopIteration:
+                self._steps = None
+                return False
+            except Exception:
+                self.stats['errors'] += 1
+        return True
+    
+    def run_to_completion(self):
+        self._last_scan = 0.0
+        while self.run_slice(budget=1.0):
+            pass
+        return dict(self.stats)
+    
+    # Policy
+    
+    def scan(self):
+        files = []
+        for category, pattern in ARTIFACTS:
+            directory = os.path.join(self.root, os.path.dirname(pattern))
+            try:
+                names = os.listdir(directory)
+            except OSError:
+                continue
+            for name in fnmatch.filter(names, os.path.basename(pattern)):
+                path = os.path.join(directory, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append({'path': path, 'category': category, 'size': st.st_size,
+                              'mtime': st.st_mtime, 'atime': max(st.st_atime, st.st_mtime)})
+        return files
+    
+    def _protected(self):
+        # Pending exams, plus the collages, reports and previews sharing their stamp
+        paths = {os.path.abspath(p) for p in self.protected()}
+        keys = {os.path.splitext(os.path.basename(p))[0].replace('gaze_exam_', '') for p in paths}
+        return paths, keys
+    
+    def _is_protected(self, path, protected):
+        paths, keys = protected
+        name = os.path.basename(path)
+        return os.path.abspath(path) in paths or any(key and key in name for key in keys)
+    
+    def _pass(self):
+        now = time.time()
+        files = self.scan()
+        yield
+        protected = self._protected()
+        
+        # 1. Orphaned temporary files and stale partial writes
+        for entry in files:
+            age = now - entry['mtime']
+            if ((entry['category'] == 'temp' and age > self.temp_max_age) or
+                    (entry['category'] == 'partial' and age > DAY)):
+                self._delete(entry, 'deleted')
+                yield
+        for path in self._orphaned_spill_dirs(now):
+            self._delete_tree(path)
+            yield
+        
+        # 2. Archive old full-resolution originals
+        for entry in files:
+            if (entry['category'] == 'exam' and now - entry['mtime'] > self.archive_after_days * DAY
+                    and not self._is_protected(entry['path'], protected)):
+                try:
+                    if read_exam_header(entry['path']).get('archived'):
+                        continue
+                except Exception:
+                    continue
+                yield
+                # One frame per step, so a slice never re-encodes a whole exam
+                try:
+                    saved = yield from compact_exam_steps(entry['path'], self.archive_quality)
+                except Exception:
+                    with self._lock:
+                        self.stats['errors'] += 1
+                    continue
+                if saved:
+                    with self._lock:
+                        self.stats['archived'] += 1
+                        self.stats['bytes_freed'] += saved
+                    entry['size'] -= saved
+                yield
+        
+        # 3. Over quota: evict re-renderable previews, then old clips, least
+        # recently used first
+        files = [e for e in files if os.path.exists(e['path'])]
+        usage = sum(e['size'] for e in files)
+        for category in EVICTION_ORDER:
+            candidates = sorted((e for e in files if e['category'] == category),
+                                key=lambda e: e['atime'])
+            for entry in candidates:
+                if usage <= self.quota_bytes:
+                    break
+                if category == 'clip' and now - entry['mtime'] < self.clip_min_age_days * DAY:
+                    continue
+                if self._is_protected(entry['path'], protected):
+                    continue
+                if self._delete(entry, 'evicted'):
+                    usage -= entry['size']
+                yield
+        
+        with self._lock:
+            self.stats['scans'] += 1
+            self.stats['usage_bytes'] = usage
+            self.stats['over_quota'] = usage > self.quota_bytes
+    
+    def _delete(self, entry, counter):
+        try:
+            os.remove(entry['path'])
+        except OSError:
+            return False
+        with self._lock:
+            self.stats[counter] += 1
+            self.stats['bytes_freed'] += entry['size']
+        return True
+    
+    def _orphaned_spill_dirs(self, now):
+        # CaptureStore spill directories left behind by a crash
+        root = tempfile.gettempdir()
+        try:
+            names = fnmatch.filter(os.listdir(root), 'gaze_spill_*')
+        except OSError:
+            return []
+        stale = []
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                if now - os.path.getmtime(path) > DAY / 2:
+                    stale.append(path)
+            except OSError:
+                pass
+        return stale
+    
+    def _delete_tree(self, path):
+        for name in os.listdir(path):
+            entry = {'path': os.path.join(path, name), 'size': 0}
+            try:
+                entry['size'] = os.path.getsize(entry['path'])
+            except OSError:
+                pass
+            self._delete(entry, 'deleted')
+        try:
+            os.rmdir(path)
+        except OSError:
+            pass
+    
+    def report(self):
+        with self._lock:
+            return dict(self.stats)
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    root = argv[0] if argv else os.getcwd()
+    quota_mb = int(argv[1]) if len(argv) > 1 else 2048
+    ledger = UploadLedger(os.path.join(root, 'pending_uploads.json'))
+    manager = StorageManager(root, quota_bytes=quota_mb * 1024 * 1024, protected=ledger.paths)
+    stats = manager.run_to_completion()
+    print(json.dumps(stats, indent=1))
+    return 1 if stats['over_quota'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
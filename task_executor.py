@@ -0,0 +1,271 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import CancelledError
+
+# ---------------- PRIORITY CLASSES ---------------- #
+
+CAPTURE, PREVIEW, ENCODE, UPLOAD, HOUSEKEEPING = range(5)
+PRIORITY_NAMES = {CAPTURE: 'capture', PREVIEW: 'preview', ENCODE: 'encode',
+                  UPLOAD: 'upload', HOUSEKEEPING: 'housekeeping'}
+
+_local = threading.local()
+
+def current_task():
+    # The Task running on this worker thread, so long jobs can poll
+    # `current_task().cancelled` and stop early
+    return getattr(_local, 'task', None)
+
+# ---------------- TASK ---------------- #
+
+class Task:
+    # Handle for one submitted job. Mirrors the parts of
+    # concurrent.futures.Future the app's components use (result(),
+    # add_done_callback()), so a lane can stand in for their pools.
+    
+    def __init__(self, executor, fn, args, priority, key, on_done, on_error):
+        self.executor = executor
+        self.fn = fn
+        self.args = args
+        self.priority = priority
+        self.key = key
+        self.on_done = on_done
+        self.on_error = on_error
+        self.state = 'queued'
+        self.error = None
+        self.submitted = time.monotonic()
+        self.started = None
+        self.finished = None
+        self._result = None
+        self._event = threading.Event()
+        self._callbacks = []
+    
+    @property
+    def cancelled(self):
+        return self.state == 'cancelled'
+    
+    def done(self):
+        return self._event.is_set()
+    
+    def cancel(self):
+        # Queued tasks never run; a running task finishes (or polls
+        # `cancelled`) but its result is not delivered
+        return self.executor._cancel(self)
+    
+    def result(self, timeout=None):
+        if not self._event.wait(timeout):
+            raise TimeoutError()
+        if self.cancelled:
+            raise CancelledError()
+        if self.error is not None:
+            raise self.error
+        return self._result
+    
+    def add_done_callback(self, fn):
+        # Called with the task on the worker thread (or right away if done)
+        with self.executor._lock:
+            if not self._event.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+    
+    def _finish(self):
+        self._event.set()
+        with self.executor._lock:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                pass
+
+# ---------------- EXECUTOR ---------------- #
+
+class TaskExecutor:
+    # One shared worker pool for all background work. Tasks run in priority
+    # class order (capture first, housekeeping last), FIFO within a class.
+    # `urgent_workers` threads only take capture and preview work, so those
+    # never queue behind a long encode or upload. Completion callbacks go
+    # through `dispatch`, e.g. onto the Kivy Clock; submitting with a `key`
+    # supersedes (cancels) the previous task with the same key.
+    
+    def __init__(self, max_workers=3, urgent_workers=1, dispatch=None, history=200):
+        self.max_workers = max_workers
+        self.dispatch = dispatch or (lambda fn: fn())
+        self._heap = []
+        self._seq = itertools.count()
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._running = True
+        self._stats = {p: {'queued': 0, 'running': 0, 'submitted': 0, 'done': 0, 'failed': 0,
+                           'cancelled': 0, 'waits': deque(maxlen=history), 'runs': deque(maxlen=history)}
+                       for p in PRIORITY_NAMES}
+        self._workers = []
+        for i in range(max_workers):
+            limit = PREVIEW if i < urgent_workers else HOUSEKEEPING
+            thread = threading.Thread(target=self._work, args=(limit,), daemon=True,
+                                      name=f"task-{PRIORITY_NAMES[limit]}-{i}")
+            thread.start()
+            self._workers.append(thread)
+    
+    def submit(self, fn, *args, priority=ENCODE, key=None, on_done=None, on_error=None):
+        task = Task(self, fn, args, priority, key, on_done, on_error)
+        superseded = None
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("executor is shut down")
+            if key is not None:
+                superseded = self._keys.get(key)
+                self._keys[key] = task
+            heapq.heappush(self._heap, (priority, next(self._seq), task))
+            stats = self._stats[priority]
+            stats['queued'] += 1
+            stats['submitted'] += 1
+            self._cond.notify_all()
+        if superseded is not None:
+            superseded.cancel()
+        return task
+    
+    def lane(self, priority):
+        return TaskLane(self, priority)
+    
+    def cancel_key(self, key):
+        with self._lock:
+            task = self._keys.get(key)
+        return task.cancel() if task else False
+    
+    def _cancel(self, task):
+        with self._lock:
+            if task.state not in ('queued', 'running'):
+                return False
+            stats = self._stats[task.priority]
+            stats['queued' if task.state == 'queued' else 'running'] -= 1
+            stats['cancelled'] += 1
+            was_queued = task.state == 'queued'
+            task.state = 'cancelled'
+            if self._keys.get(task.key) is task:
+                del self._keys[task.key]
+        if was_queued:
+            # Left in the heap and skipped when popped
+            task.finished = time.monotonic()
+            task._finish()
+        return True
+    
+    def _next(self, limit):
+        with self._cond:
+            while self._running:
+                while self._heap and self._heap[0][2].state == 'cancelled':
+                    heapq.heappop(self._heap)
+                if self._heap and self._heap[0][0] <= limit:
+                    task = heapq.heappop(self._heap)[2]
+                    task.state = 'running'
+                    task.started = time.monotonic()
+                    stats = self._stats[task.priority]
+                    stats['queued'] -= 1
+                    stats['running'] += 1
+                    stats['waits'].append(task.started - task.submitted)
+                    return task
+                self._cond.wait()
+            return None
+    
+    def _work(self, limit):
+        while True:
+            task = self._next(limit)
+            if task is None:
+                return
+            _local.task = task
+            try:
+                task._result = task.fn(*task.args)
+            except Exception as e:
+                task.error = e
+            finally:
+                _local.task = None
+            task.finished = time.monotonic()
+            with self._lock:
+                stats = self._stats[task.priority]
+                delivered = task.state == 'running'
+                if delivered:
+                    task.state = 'failed' if task.error is not None else 'done'
+                    stats['running'] -= 1
+                    stats[task.state] += 1
+                    stats['runs'].append(task.finished - task.started)
+                    if self._keys.get(task.key) is task:
+                        del self._keys[task.key]
+            task._finish()
+            if delivered:
+                self._deliver(task)
+    
+    def _deliver(self, task):
+        callback = task.on_done if task.error is None else task.on_error
+        if callback is None:
+            return
+        value = task._result if task.error is None else task.error
+        
+        def run():
+            # A task cancelled after finishing is still dropped here
+            if not task.cancelled:
+                callback(value)
+        self.dispatch(run)
+    
+    def metrics(self):
+        with self._lock:
+            classes = {}
+            for priority, name in PRIORITY_NAMES.items():
+                stats = self._stats[priority]
+                waits = sorted(stats['waits'])
+                runs = stats['runs']
+                classes[name] = {
+                    key: stats[key] for key in ('queued', 'running', 'submitted', 'done', 'failed', 'cancelled')
+                }
+                classes[name].update(
+                    wait_ms=round(1000 * sum(waits) / len(waits), 1) if waits else None,
+                    wait_p95_ms=round(1000 * waits[int(0.95 * (len(waits) - 1))], 1) if waits else None,
+                    run_ms=round(1000 * sum(runs) / len(runs), 1) if runs else None
+                )
+            return {
+                'workers': self.max_workers,
+                'queued': sum(c['queued'] for c in classes.values()),
+                'running': sum(c['running'] for c in classes.values()),
+                'classes': classes
+            }
+    
+    def shutdown(self, wait=True, cancel_pending=False):
+        if cancel_pending:
+            with self._lock:
+                pending = [entry[2] for entry in self._heap]
+            for task in pending:
+                task.cancel()
+        with self._cond:
+            if wait:
+                # Let queued work drain before the workers exit
+                while any(entry[2].state == 'queued' for entry in self._heap):
+                    self._cond.wait(0.05)
+            self._running = False
+            self._cond.notify_all()
+        if wait:
+            for thread in self._workers:
+                thread.join()
+
+class TaskLane:
+    # Fixed-priority view of the executor with the ThreadPoolExecutor
+    # methods components call; shutting a lane down leaves the pool running
+    
+    def __init__(self, executor, priority):
+        self.executor = executor
+        self.priority = priority
+    
+    def submit(self, fn, *args, key=None):
+        return self.executor.submit(fn, *args, priority=self.priority, key=key)
+    
+    def shutdown(self, wait=False):
+        pass
+
+def submit_keyed(pool, fn, *args, key=None):
+    # For components that accept any executor: on a lane the job supersedes
+    # the previous one with the same key, elsewhere the key is ignored
+    if isinstance(pool, TaskLane):
+        return pool.submit(fn, *args, key=key)
+    return pool.submit(fn, *args)
@@ -0,0 +1,67 @@
+import os
+
+import numpy as np
+import pytest
+
+from capture_store import CaptureStore
+
+def noise_frame(seed, shape=(120, 160, 3)):
+    # Random pixels barely compress, so a few frames overrun a small budget
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+def test_round_trip_is_lossless():
+    store = CaptureStore()
+    frame = noise_frame(1)
+    store[1] = frame
+    assert np.array_equal(store[1], frame)
+    assert 1 in store and len(store) == 1
+    store.close()
+
+def test_decoded_cache_is_lru():
+    store = CaptureStore(cache_size=2)
+    for position in (1, 2, 3):
+        store.put(position, noise_frame(position))
+    store.get(1)
+    assert list(store._decoded) == [3, 1]
+    assert store.footprint()['cached_frames'] == 2
+    store.close()
+
+def test_spills_least_recently_used_blobs_over_budget(tmp_path):
+    frames = {position: noise_frame(position) for position in range(1, 5)}
+    store = CaptureStore(budget_bytes=100 * 1024, cache_size=1, spill_dir=str(tmp_path))
+    for position, frame in frames.items():
+        store.put(position, frame)
+    footprint = store.footprint()
+    assert footprint['spilled_bytes'] > 0
+    assert footprint['resident_bytes'] <= store.budget_bytes or len(store._encoded) == 1
+    assert 1 in store._spilled and 4 in store._encoded
+    for position, frame in frames.items():
+        assert np.array_equal(store[position], frame)
+    spill_dir = store._spill_dir
+    assert os.listdir(spill_dir)
+    store.close()
+    assert not os.path.exists(spill_dir)
+
+def test_discard_removes_spilled_file(tmp_path):
+    store = CaptureStore(budget_bytes=1, cache_size=1, spill_dir=str(tmp_path))
+    store.put(1, noise_frame(1))
+    store.put(2, noise_frame(2))
+    path = store._spilled[1][0]
+    del store[1]
+    assert not os.path.exists(path)
+    with pytest.raises(KeyError):
+        store[1]
+    store.close()
+
+def test_versions_change_on_every_put():
+    store, other = CaptureStore(), CaptureStore()
+    store.put(1, noise_frame(1))
+    first = store.version(1)
+    store.put(1, noise_frame(1))
+    other.put(1, noise_frame(1))
+    assert store.version(1) > first
+    assert other.version(1) not in (first, store.version(1))
+    store.discard(1)
+    assert store.version(1) is None
+    store.close()
+    other.close()
@@ -0,0 +1,77 @@
+import numpy as np
+
+from capture_store import CaptureStore
+from collage import LAYOUT_SETTINGS, RenderCache, layout_hash, overlay_settings
+
+def test_layout_hash_ignores_non_layout_settings():
+    assert layout_hash({}) == layout_hash(dict(LAYOUT_SETTINGS))
+    assert layout_hash({'brightness': 80, 'drive_link': 'x'}) == layout_hash({})
+
+def test_layout_hash_changes_with_each_layout_setting():
+    base = layout_hash({})
+    for key, default in LAYOUT_SETTINGS.items():
+        if key == 'header_text':
+            continue
+        assert layout_hash({key: not default}) != base, key
+
+def test_header_text_counts_only_while_shown():
+    assert layout_hash({'header_text': 'Clinic A'}) == layout_hash({'header_text': 'Clinic B'})
+    shown = {'show_header': True}
+    assert layout_hash(dict(shown, header_text='Clinic A')) != layout_hash(dict(shown, header_text='Clinic B'))
+
+CELL = (80, 60)
+
+def filled_store():
+    store = CaptureStore()
+    for position in range(1, 10):
+        store.put(position, np.full((60, 80, 3), position * 25, np.uint8))
+    return store
+
+def test_unchanged_exam_is_served_from_cache():
+    cache = RenderCache()
+    store = filled_store()
+    layers = overlay_settings({}, '2026-01-01 09:00:00')
+    first = cache.collage(store, layers, CELL)
+    assert cache.collage(store, layers, CELL) is first
+    assert cache.tiles_rendered == 9
+    assert not first.flags.writeable
+    store.close()
+
+def test_retake_renders_one_tile():
+    cache = RenderCache()
+    store = filled_store()
+    before = cache.tiles(store, CELL).copy()
+    store.put(4, np.full((60, 80, 3), 255, np.uint8))
+    after = cache.tiles(store, CELL)
+    assert cache.tiles_rendered == 10
+    assert not np.array_equal(before, after)
+    assert np.array_equal(after, RenderCache().tiles(store, CELL))
+    store.close()
+
+def test_layout_change_reuses_tiles():
+    cache = RenderCache()
+    store = filled_store()
+    plain = cache.collage(store, overlay_settings({}, None), CELL)
+    gridded = cache.collage(store, overlay_settings({'show_grid': True}, None), CELL)
+    assert gridded is not plain and not np.array_equal(gridded, plain)
+    assert cache.tiles_rendered == 9
+    store.close()
+
+def test_plain_frames_are_keyed_by_content():
+    cache = RenderCache()
+    frames = {position: np.full((60, 80, 3), position, np.uint8) for position in range(1, 10)}
+    key = cache.key(frames)
+    frames[2] = frames[2] + 1
+    assert cache.key(frames) != key
+    assert cache.key(dict(frames)) == cache.key(frames)
+
+def test_entries_are_evicted_over_budget():
+    store = filled_store()
+    cache = RenderCache(max_bytes=2 * 180 * 240 * 3)
+    for grid in (False, True):
+        cache.collage(store, overlay_settings({'show_grid': grid}, None), CELL)
+    assert cache.stats()['bytes'] <= cache.max_bytes
+    assert cache.stats()['entries'] == 2
+    cache.clear()
+    assert cache.stats()['entries'] == 0
+    store.close()
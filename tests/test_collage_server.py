@@ -0,0 +1,39 @@
+import http.client
+import threading
+
+import pytest
+
+from collage_server import TOKEN_HEADER, CollageRequestHandler, serve
+
+@pytest.fixture
+def server(tmp_path):
+    server, service = serve('secret', port=0, out_dir=str(tmp_path))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+def request(server, method, path, headers=None):
+    connection = http.client.HTTPConnection(*server.server_address[:2], timeout=5)
+    connection.request(method, path, headers=headers or {})
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+def test_binds_to_loopback(server):
+    assert server.server_address[0] == '127.0.0.1'
+
+def test_token_is_required(server):
+    assert request(server, 'GET', '/health') == 401
+    assert request(server, 'GET', '/metrics', {TOKEN_HEADER: 'guess'}) == 401
+    assert request(server, 'GET', '/health', {TOKEN_HEADER: 'secret'}) == 200
+
+def test_oversized_uploads_are_refused(server):
+    headers = {TOKEN_HEADER: 'secret', 'Content-Length': str(CollageRequestHandler.max_body + 1)}
+    assert request(server, 'POST', '/exams', headers) == 413
+
+def test_serve_refuses_to_run_without_a_token(tmp_path):
+    with pytest.raises(ValueError):
+        serve('', port=0, out_dir=str(tmp_path))
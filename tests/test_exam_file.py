@@ -0,0 +1,65 @@
+import mmap
+import os
+
+import numpy as np
+import pytest
+
+from capture_store import CaptureStore
+from exam_file import ExamReader, compact_exam, read_exam_header, write_exam
+
+def exam_frames():
+    rng = np.random.default_rng(0)
+    return {position: rng.integers(0, 256, (60, 80, 3), dtype=np.uint8) for position in range(1, 10)}
+
+def test_round_trip(tmp_path):
+    frames = exam_frames()
+    collage = np.full((90, 120, 3), 200, np.uint8)
+    path = write_exam(str(tmp_path / 'exam.ngx'), frames, collage=collage, settings={'show_grid': True})
+    assert not (tmp_path / 'exam.ngx.part').exists()
+    with ExamReader(path) as reader:
+        assert reader.positions == list(range(1, 10))
+        assert reader.settings == {'show_grid': True}
+        assert reader.metadata(3)['shape'] == [60, 80, 3]
+        for position, frame in frames.items():
+            assert np.array_equal(reader.frame(position), frame)
+        assert reader.thumbnail(1).shape[2] == 3
+        assert reader.collage().shape == collage.shape
+    assert read_exam_header(path)['positions'].keys() == {str(p) for p in range(1, 10)}
+
+def test_store_blobs_and_metadata_are_reused(tmp_path):
+    store = CaptureStore()
+    for position, frame in exam_frames().items():
+        store.put(position, frame, brightness=position * 10)
+    path = write_exam(str(tmp_path / 'exam.ngx'), store)
+    with ExamReader(path) as reader:
+        assert bytes(reader.frame_bytes(4)) == store.encoded(4)
+        assert reader.metadata(4)['brightness'] == 40
+        assert reader.collage() is None
+    store.close()
+
+def test_frames_decode_from_the_mapping(tmp_path):
+    frames = exam_frames()
+    path = write_exam(str(tmp_path / 'exam.ngx'), frames)
+    reader = ExamReader(path)
+    assert isinstance(reader._mm, mmap.mmap)
+    assert np.array_equal(reader.frame(9), frames[9])
+    reader.close()
+    assert reader._mm is None
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / 'not_an_exam.ngx'
+    path.write_bytes(b'PNG!' + bytes(64))
+    with pytest.raises(ValueError):
+        ExamReader(str(path))
+
+def test_compact_keeps_the_exam_age(tmp_path):
+    path = write_exam(str(tmp_path / 'exam.ngx'), exam_frames(), settings={'show_grid': True})
+    old = os.path.getmtime(path) - 90 * 24 * 3600
+    os.utime(path, (old, old))
+    assert compact_exam(path, quality=80) > 0
+    assert os.path.getmtime(path) == old
+    with ExamReader(path) as reader:
+        assert reader.header['archived']['quality'] == 80
+        assert reader.settings == {'show_grid': True}
+        assert reader.frame(5).shape == (60, 80, 3)
+    assert compact_exam(path) == 0
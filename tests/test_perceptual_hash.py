@@ -0,0 +1,46 @@
+import json
+import os
+
+import numpy as np
+
+from perceptual_hash import (HASH_BITS, DuplicateIndex, face_scene, hamming, hash_hex, perceptual_hash,
+                             record_distances, reshoot)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), 'fixtures', 'phash_distances.json')
+
+def recorded():
+    # Regenerate with: python perceptual_hash.py --record tests/fixtures/phash_distances.json
+    with open(FIXTURE, encoding='utf-8') as f:
+        distances = json.load(f)
+    return [int(d) for d in distances['repeat']], [int(d) for d in distances['distinct']], distances
+
+def test_limit_leaves_a_margin_on_both_sides():
+    repeat, distinct, distances = recorded()
+    limit = DuplicateIndex().max_distance
+    assert distances['bits'] == HASH_BITS
+    assert sum(distances['repeat'].values()) >= 200 and sum(distances['distinct'].values()) >= 150
+    assert max(repeat) + 4 <= limit <= min(distinct) - 4
+
+def test_recorded_distances_match_the_current_hash():
+    repeat, distinct, _ = recorded()
+    sample = record_distances(seeds=1, shots=2)
+    assert max(int(d) for d in sample['repeat']) <= max(repeat)
+    assert min(int(d) for d in sample['distinct']) >= min(distinct)
+
+def test_hash_is_64_bits():
+    value = perceptual_hash(face_scene((640, 360)))
+    assert 0 <= value < 2 ** HASH_BITS
+    assert len(hash_hex(value)) == 16
+
+def test_index_flags_a_repeated_position():
+    rng = np.random.default_rng(0)
+    left, right = face_scene((1280, 720), (-1, 0)), face_scene((1280, 720), (1, 0))
+    index = DuplicateIndex()
+    assert index.add(4, perceptual_hash(reshoot(left, rng))) == []
+    assert index.add(6, perceptual_hash(reshoot(right, rng))) == []
+    again = perceptual_hash(reshoot(left, rng))
+    matches = index.add(5, again)
+    assert [other for other, _ in matches] == [4]
+    assert matches[0][1] == hamming(again, index.hashes[4])
+    index.discard(4)
+    assert index.matches(5) == []
@@ -0,0 +1,59 @@
+import http.client
+import time
+
+import numpy as np
+import pytest
+
+from preview_stream import TOKEN_HEADER, PreviewStreamer
+
+@pytest.fixture
+def streamer():
+    streamer = PreviewStreamer('secret', port=0)
+    streamer.start()
+    yield streamer
+    streamer.stop()
+
+def connect(streamer):
+    return http.client.HTTPConnection(*streamer.address[:2], timeout=5)
+
+def get(streamer, path, headers=None):
+    connection = connect(streamer)
+    connection.request('GET', path, headers=headers or {})
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+    return response.status, body
+
+def test_binds_to_loopback(streamer):
+    assert streamer.address[0] == '127.0.0.1'
+
+def test_token_is_required(streamer):
+    assert get(streamer, '/stats')[0] == 401
+    assert get(streamer, '/stats?token=guess')[0] == 401
+    assert get(streamer, '/stats', {TOKEN_HEADER: 'secret'})[0] == 200
+    status, page = get(streamer, '/?token=secret')
+    assert status == 200 and b'/stream?token=secret' in page
+
+def test_snapshot_never_returns_a_stale_frame(streamer):
+    assert get(streamer, '/snapshot.jpg?token=secret')[0] == 503
+
+def test_stream_does_not_resend_an_unchanged_frame(streamer):
+    connection = connect(streamer)
+    connection.request('GET', '/stream?token=secret')
+    response = connection.getresponse()
+    assert response.status == 200
+    frame = np.zeros((120, 160, 3), np.uint8)
+    deadline = time.monotonic() + 5
+    while streamer.stats()['sent'] == 0 and time.monotonic() < deadline:
+        streamer.publish(frame)
+        time.sleep(0.05)
+    assert streamer.stats()['sent'] >= 1
+    sent = streamer.stats()['sent']
+    # Longer than the 1 s wait in next_jpeg, with nothing new published
+    time.sleep(1.5)
+    assert streamer.stats()['sent'] == sent
+    connection.close()
+
+def test_a_token_is_required_to_start():
+    with pytest.raises(ValueError):
+        PreviewStreamer('')
@@ -0,0 +1,32 @@
+import threading
+
+import numpy as np
+
+from capture_store import CaptureStore
+from reflex_analysis import ReflexAnalyser
+from task_executor import CAPTURE, PREVIEW, TaskExecutor
+
+def flat_store(level):
+    store = CaptureStore()
+    for position in range(1, 10):
+        store.put(position, np.full((120, 160, 3), level, np.uint8))
+    return store
+
+def test_stores_analysed_side_by_side_keep_their_results():
+    executor = TaskExecutor(max_workers=1, urgent_workers=1)
+    analyser = ReflexAnalyser(pool=executor.lane(PREVIEW))
+    first, second = flat_store(60), flat_store(180)
+    gate = threading.Event()
+    executor.submit(gate.wait, 5, priority=CAPTURE)
+    done = [threading.Event(), threading.Event()]
+    analyser.submit(first, on_done=done[0].set)
+    analyser.submit(second, on_done=done[1].set)
+    gate.set()
+    assert done[0].wait(30) and done[1].wait(30)
+    results = analyser.results_for(first), analyser.results_for(second)
+    assert None not in results
+    assert results[0][3]['version'] == first.version(3)
+    assert results[1][3]['version'] == second.version(3)
+    executor.shutdown()
+    first.close()
+    second.close()
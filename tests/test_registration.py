@@ -0,0 +1,43 @@
+import threading
+
+import cv2
+import numpy as np
+
+from capture_store import CaptureStore
+from registration import Registrar
+from task_executor import CAPTURE, PREVIEW, TaskExecutor
+
+def shifted_store(shift):
+    # Nine views of one scene of coloured discs, each moved `shift` pixels sideways
+    rng = np.random.default_rng(1)
+    base = np.full((240, 320, 3), 90, np.uint8)
+    for _ in range(40):
+        centre = (int(rng.integers(0, 320)), int(rng.integers(0, 240)))
+        colour = tuple(int(c) for c in rng.integers(0, 256, 3))
+        cv2.circle(base, centre, int(rng.integers(4, 20)), colour, -1)
+    store = CaptureStore()
+    for position in range(1, 10):
+        offset = 0 if position == 1 else shift
+        store.put(position, np.ascontiguousarray(np.roll(base, offset, axis=1)))
+    return store
+
+def test_stores_registered_side_by_side_keep_their_results():
+    executor = TaskExecutor(max_workers=1, urgent_workers=1)
+    registrar = Registrar(pool=executor.lane(PREVIEW))
+    first, second = shifted_store(4), shifted_store(-4)
+    gate = threading.Event()
+    executor.submit(gate.wait, 5, priority=CAPTURE)
+    done = [threading.Event(), threading.Event()]
+    # Both exams queue up for the same positions before either runs
+    registrar.submit(first, on_done=done[0].set)
+    registrar.submit(second, on_done=done[1].set)
+    gate.set()
+    assert done[0].wait(30) and done[1].wait(30)
+    assert registrar.is_current(first) and registrar.is_current(second)
+    assert registrar.report(first).keys() == registrar.report(second).keys() == set(range(2, 10))
+    assert registrar.aligned_images(first) is not None
+    assert registrar.results[first][5]['matrix'][0, 2] < -2
+    assert registrar.results[second][5]['matrix'][0, 2] > 2
+    executor.shutdown()
+    first.close()
+    second.close()
@@ -0,0 +1,64 @@
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from exam_file import read_exam_header, write_exam
+from storage_manager import DAY, StorageManager, UploadLedger
+
+def age(path, days):
+    stamp = time.time() - days * DAY
+    os.utime(path, (stamp, stamp))
+
+def make_exam(root, stamp, days):
+    frames = {p: np.full((40, 60, 3), p * 20, np.uint8) for p in range(1, 10)}
+    path = write_exam(os.path.join(root, f"gaze_exam_{stamp}.ngx"), frames)
+    age(path, days)
+    return path
+
+def test_ledger_persists(tmp_path):
+    ledger = UploadLedger(str(tmp_path / 'pending.json'))
+    ledger.add('a.ngx', None, 'b.ngx')
+    ledger.remove('a.ngx')
+    assert UploadLedger(ledger.path).paths() == {os.path.abspath('b.ngx')}
+
+def test_pending_exams_are_not_archived(tmp_path):
+    pending = make_exam(str(tmp_path), '20260101_090000', 60)
+    uploaded = make_exam(str(tmp_path), '20260102_090000', 60)
+    recent = make_exam(str(tmp_path), '20260103_090000', 1)
+    ledger = UploadLedger(str(tmp_path / 'pending.json'))
+    ledger.add(pending)
+    stats = StorageManager(str(tmp_path), protected=ledger.paths).run_to_completion()
+    assert stats['archived'] == 1
+    assert 'archived' in read_exam_header(uploaded)
+    assert 'archived' not in read_exam_header(pending)
+    assert 'archived' not in read_exam_header(recent)
+
+def test_eviction_spares_previews_of_pending_exams(tmp_path):
+    os.mkdir(tmp_path / 'collages')
+    previews = []
+    for stamp in ('20260101_090000', '20260102_090000'):
+        path = tmp_path / 'collages' / f"gaze_exam_{stamp}_collage.jpg"
+        path.write_bytes(bytes(1024))
+        previews.append(path)
+    ledger = UploadLedger(str(tmp_path / 'pending.json'))
+    ledger.add(str(tmp_path / 'gaze_exam_20260101_090000.ngx'))
+    stats = StorageManager(str(tmp_path), quota_bytes=0, protected=ledger.paths).run_to_completion()
+    assert stats['evicted'] == 1
+    assert previews[0].exists() and not previews[1].exists()
+    assert stats['over_quota']
+
+def test_orphaned_spill_directories_are_removed(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmp_path))
+    stale = tmp_path / 'gaze_spill_stale'
+    live = tmp_path / 'gaze_spill_live'
+    for directory in (stale, live):
+        directory.mkdir()
+        (directory / '1.png').write_bytes(bytes(100))
+    age(stale, 1)
+    root = tmp_path / 'exams'
+    root.mkdir()
+    StorageManager(str(root)).run_to_completion()
+    assert not stale.exists()
+    assert (live / '1.png').exists()
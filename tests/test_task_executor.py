@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from task_executor import CAPTURE, ENCODE, HOUSEKEEPING, PREVIEW, UPLOAD, TaskExecutor, submit_keyed
+
+@pytest.fixture
+def executor():
+    executor = TaskExecutor(max_workers=1, urgent_workers=0)
+    yield executor
+    executor.shutdown(wait=False, cancel_pending=True)
+
+def block(executor, priority=CAPTURE):
+    # Occupies a worker until the returned event is set
+    started, gate = threading.Event(), threading.Event()
+    executor.submit(lambda: (started.set(), gate.wait(5)), priority=priority)
+    assert started.wait(5)
+    return gate
+
+def test_priority_classes_run_in_order(executor):
+    gate = block(executor)
+    order = []
+    tasks = [executor.submit(order.append, name, priority=priority)
+             for name, priority in [('housekeeping', HOUSEKEEPING), ('encode', ENCODE), ('upload', UPLOAD),
+                                    ('capture', CAPTURE), ('encode 2', ENCODE), ('preview', PREVIEW)]]
+    gate.set()
+    for task in tasks:
+        task.result(timeout=5)
+    assert order == ['capture', 'preview', 'encode', 'encode 2', 'upload', 'housekeeping']
+
+def test_keyed_submit_supersedes_queued_task(executor):
+    gate = block(executor)
+    lane = executor.lane(PREVIEW)
+    first = submit_keyed(lane, str, 1, key='render')
+    second = submit_keyed(lane, str, 2, key='render')
+    other = submit_keyed(lane, str, 3, key='other')
+    gate.set()
+    assert second.result(timeout=5) == '2' and other.result(timeout=5) == '3'
+    assert first.cancelled and first.done()
+
+def test_keys_are_ignored_on_plain_pools():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        futures = [submit_keyed(pool, str, n, key='render') for n in range(3)]
+        assert [f.result(timeout=5) for f in futures] == ['0', '1', '2']
+
+def test_urgent_workers_skip_background_work():
+    executor = TaskExecutor(max_workers=2, urgent_workers=1)
+    try:
+        gate = block(executor, HOUSEKEEPING)
+        encode = executor.submit(str, 'encode', priority=ENCODE)
+        capture = executor.submit(str, 'capture', priority=CAPTURE)
+        assert capture.result(timeout=5) == 'capture'
+        assert encode.state == 'queued'
+        gate.set()
+        assert encode.result(timeout=5) == 'encode'
+    finally:
+        executor.shutdown(wait=False, cancel_pending=True)
+
+def test_callbacks_go_through_dispatch():
+    dispatched = []
+    executor = TaskExecutor(max_workers=1, urgent_workers=0, dispatch=lambda fn: (dispatched.append(fn), fn()))
+    try:
+        done = threading.Event()
+        results = []
+        executor.submit(int, '7', on_done=lambda value: (results.append(value), done.set()))
+        assert done.wait(5)
+        assert results == [7] and len(dispatched) == 1
+    finally:
+        executor.shutdown()
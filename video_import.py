@@ -0,0 +1,260 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from capture_store import CaptureStore
+from collage import GAZE_VECTORS
+from perceptual_hash import hash_hex, perceptual_hash
+from reflex_analysis import analyse_eye, eye_regions
+
+# ---------------- FRAME MEASUREMENT ---------------- #
+
+def measure_frame(frame, work_width=640):
+    # (gaze, sharpness) for one video frame. Gaze is the mean corneal reflex
+    # offset from the pupil centre in pupil radii, negated: the pupil moves
+    # towards the gaze direction while the reflex stays behind (Hirschberg),
+    # so it points the way GAZE_VECTORS do. None when no reflex was found.
+    scale = min(1.0, work_width / frame.shape[1])
+    if scale != 1.0:
+        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    offsets = []
+    sharpness = []
+    for x, y, w, h in eye_regions(gray):
+        roi = gray[y:y + h, x:x + w]
+        sharpness.append(cv2.Laplacian(roi, cv2.CV_32F).var())
+        eye = analyse_eye(roi)
+        if eye and eye.get('relative'):
+            offsets.append(eye['relative'])
+    gaze = tuple(-np.mean(offsets, axis=0)) if offsets else None
+    return gaze, float(np.mean(sharpness)) if sharpness else 0.0
+
+# ---------------- FIXATIONS ---------------- #
+
+def find_fixations(samples, fps, still=0.35, min_duration=0.4):
+    # samples: time-ordered (frame index, gaze, sharpness). A fixation is a
+    # run of samples whose gaze stays within `still` pupil radii of the
+    # run's median for at least `min_duration` seconds.
+    fixations = []
+    run = []
+    
+    def close_run():
+        if run and (run[-1][0] - run[0][0]) / fps >= min_duration:
+            gazes = np.array([s[1] for s in run])
+            best = max(run, key=lambda s: s[2])
+            fixations.append({'gaze': tuple(np.median(gazes, axis=0)), 'start': run[0][0] / fps,
+                              'duration': (run[-1][0] - run[0][0]) / fps,
+                              'frame': best[0], 'sharpness': best[2]})
+    
+    for sample in samples:
+        if sample[1] is None:
+            # Blinks and lost reflexes end nothing on their own; short gaps
+            # are bridged by the next valid sample
+            continue
+        if run:
+            centre = np.median(np.array([s[1] for s in run[-15:]]), axis=0)
+            if np.hypot(*(np.array(sample[1]) - centre)) > still:
+                close_run()
+                run = []
+        run.append(sample)
+    close_run()
+    return fixations
+
+def assign_positions(fixations, min_share=0.3):
+    # Maps the nine gaze positions to fixations. The primary position is the
+    # fixation nearest the middle of the gaze range; the others are matched
+    # by direction from it, preferring longer fixations, each used once.
+    if not fixations:
+        return {}
+    gazes = np.array([f['gaze'] for f in fixations])
+    middle = (gazes.min(axis=0) + gazes.max(axis=0)) / 2
+    primary = int(np.argmin(np.hypot(*(gazes - middle).T)))
+    vectors = gazes - gazes[primary]
+    lengths = np.hypot(*vectors.T)
+    reach = np.median(lengths[lengths > 0]) if (lengths > 0).any() else 0
+    
+    candidates = []
+    for i, fixation in enumerate(fixations):
+        if i == primary or lengths[i] < min_share * reach:
+            continue
+        direction = vectors[i] / lengths[i]
+        for position, (dx, dy) in GAZE_VECTORS.items():
+            if position == 1:
+                continue
+            target = np.array([dx, dy]) / np.hypot(dx, dy)
+            score = float(direction @ target) + 0.1 * min(fixation['duration'], 1.0)
+            candidates.append((score, position, i))
+    
+    assigned = {1: fixations[primary]}
+    used = {primary}
+    for score, position, i in sorted(candidates, reverse=True):
+        # cos(30°): further off than that is a different gaze direction
+        if position in assigned or i in used or score < 0.86:
+            continue
+        assigned[position] = fixations[i]
+        used.add(i)
+    return assigned
+
+# ---------------- VIDEO IMPORT ---------------- #
+
+class VideoImporter:
+    # Scans a recorded exam at `sample_fps` on several threads, each with its
+    # own VideoCapture over a contiguous segment (frames between samples are
+    # grabbed but not converted), then re-reads the sharpest frame of each
+    # assigned fixation. Frames are mirrored like the live preview so the
+    # result matches captures taken in the app.
+    
+    def __init__(self, workers=None, sample_fps=10, mirror=True, work_width=640):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.sample_fps = sample_fps
+        self.mirror = mirror
+        self.work_width = work_width
+        self._cancelled = threading.Event()
+    
+    def cancel(self):
+        self._cancelled.set()
+    
+    def _scan(self, path, start, stop, stride, progress):
+        cap = cv2.VideoCapture(path)
+        samples = []
+        try:
+            if start:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            index = start
+            while index < stop and not self._cancelled.is_set():
+                if index % stride:
+                    ok = cap.grab()
+                else:
+                    ok, frame = cap.read()
+                    if ok:
+                        if self.mirror:
+                            frame = cv2.flip(frame, 1)
+                        gaze, sharpness = measure_frame(frame, self.work_width)
+                        samples.append((index, gaze, sharpness))
+                        progress(stride)
+                if not ok:
+                    break
+                index += 1
+        finally:
+            cap.release()
+        return samples
+    
+    def _frame(self, path, index):
+        cap = cv2.VideoCapture(path)
+        try:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ok, frame = cap.read()
+        finally:
+            cap.release()
+        if not ok:
+            raise ValueError(f"could not read frame {index} of {path}")
+        return cv2.flip(frame, 1) if self.mirror else frame
+    
+    def extract(self, path, on_progress=None, store=None):
+        # Returns (store, report); the store holds every position that could
+        # be found, report['missing'] lists the others
+        started = time.perf_counter()
+        cap = cv2.VideoCapture(path)
+        if not cap.isOpened():
+            raise ValueError(f"cannot open video {path}")
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        cap.release()
+        stride = max(1, round(fps / self.sample_fps))
+        
+        # Container frame counts can be missing; scan sequentially then
+        workers = self.workers if total > 0 else 1
+        bounds = np.linspace(0, total, workers + 1).astype(int) if total > 0 else [0, sys.maxsize]
+        done = [0]
+        lock = threading.Lock()
+        
+        def progress(frames):
+            with lock:
+                done[0] += frames
+                fraction = min(done[0] / total, 1.0) if total > 0 else 0.0
+            if on_progress:
+                on_progress(0.95 * fraction)
+        
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='video-import') as pool:
+            futures = [pool.submit(self._scan, path, int(a), int(b), stride, progress)
+                       for a, b in zip(bounds[:-1], bounds[1:])]
+            samples = [s for future in futures for s in future.result()]
+        if self._cancelled.is_set():
+            raise InterruptedError("video import cancelled")
+        scanned = time.perf_counter() - started
+        
+        samples.sort(key=lambda s: s[0])
+        fixations = find_fixations(samples, fps)
+        assigned = assign_positions(fixations)
+        store = store if store is not None else CaptureStore()
+        source = os.path.basename(path)
+        for position, fixation in sorted(assigned.items()):
+            frame = self._frame(path, fixation['frame'])
+            store.put(position, frame, captured_at=f"{source}@{fixation['frame'] / fps:.2f}s",
+                      sharpness=round(fixation['sharpness'], 1), phash=hash_hex(perceptual_hash(frame)))
+        if on_progress:
+            on_progress(1.0)
+        
+        elapsed = time.perf_counter() - started
+        duration = (total if total > 0 else (samples[-1][0] + 1 if samples else 0)) / fps
+        report = {
+            'video': source,
+            'duration_s': round(duration, 2),
+            'fps': fps,
+            'workers': workers,
+            'samples': len(samples),
+            'fixations': len(fixations),
+            'scan_s': round(scanned, 2),
+            'elapsed_s': round(elapsed, 2),
+            'realtime_factor': round(duration / elapsed, 1) if elapsed else None,
+            'positions': {p: {'time_s': round(f['frame'] / fps, 2), 'duration_s': round(f['duration'], 2),
+                              'sharpness': round(f['sharpness'], 1)} for p, f in sorted(assigned.items())},
+            'missing': [p for p in range(1, 10) if p not in assigned]
+        }
+        return store, report
+
+# ---------------- COMMAND LINE ---------------- #
+
+def main(argv=None):
+    from exam_file import write_exam
+    
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print("usage: video_import.py VIDEO [OUT.ngx] [--workers N]")
+        return 2
+    workers = None
+    if '--workers' in argv:
+        i = argv.index('--workers')
+        workers = int(argv[i + 1])
+        argv = argv[:i] + argv[i + 2:]
+    importer = VideoImporter(workers=workers)
+    shown = [-1]
+    
+    def on_progress(fraction):
+        if int(fraction * 100) != shown[0]:
+            shown[0] = int(fraction * 100)
+            print(f"\r{shown[0]:3d}%", end='', flush=True)
+    
+    store, report = importer.extract(argv[0], on_progress=on_progress)
+    print()
+    print(f"{report['duration_s']} s of video in {report['elapsed_s']} s "
+          f"({report['realtime_factor']}x real time, {report['workers']} threads), "
+          f"{report['fixations']} fixations")
+    for position, info in report['positions'].items():
+        print(f"  position {position}: {info['time_s']:>7.2f} s  fixation {info['duration_s']:.1f} s  "
+              f"sharpness {info['sharpness']}")
+    if report['missing']:
+        print(f"  no fixation found for positions {report['missing']}")
+    if len(argv) > 1 and not report['missing']:
+        write_exam(argv[1], store)
+        print(f"wrote {argv[1]}")
+    store.close()
+    return 0 if not report['missing'] else 1
+
+if __name__ == "__main__":
+    sys.exit(main())